@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+# End-to-end benchmark against local stand-in servers
+# (`tests/zeitgitter-standin.py`): wall-clock latency of complete
+# `git timestamp` runs, per phase, for single, multi-server and bulk use.
+# Each run's own `--timings` trace (`TIMESTAMP_TRACE`) breaks this down into
+# the client's phases (configuration, keys, HTTP, verification, writing).
+#
+# `--json FILE` saves the results; `--compare FILE` prints the change
+# relative to results saved earlier, e.g., by another release.
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.dirname(HERE)
+CLIENT = os.path.join(TOP, 'git-timestamp.py')
+STANDIN = os.path.join(TOP, 'tests', 'zeitgitter-standin.py')
+# Phases of the client's `--timings` trace, in order
+TRACE_PHASES = ('repository', 'config', 'gnupg', 'key', 'http', 'verify',
+                'write')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="End-to-end `git timestamp` benchmark, offline")
+    parser.add_argument('--rounds', type=int, default=5,
+                        help="Runs per phase (default: 5)")
+    parser.add_argument('--servers', type=int, default=3,
+                        help="Stand-in servers for multi-server phases")
+    parser.add_argument('--branches', type=int, default=20,
+                        help="Branches for the bulk phase")
+    parser.add_argument('--repos', type=int, default=10,
+                        help="Repositories for the fleet phase")
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help="Simulated server latency in seconds")
+    parser.add_argument('--json', metavar='FILE',
+                        help="Save the results to FILE")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Compare with results saved to FILE earlier")
+    return parser.parse_args()
+
+
+def run(cmd, cwd, env, check=True):
+    subprocess.run(cmd, cwd=cwd, env=env, check=check,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def git(cwd, env, *args):
+    run(['git'] + list(args), cwd, env)
+
+
+class Standins:
+    """Stand-in servers, stopped when leaving the `with` block"""
+
+    def __init__(self, count, delay, tmp):
+        self.procs = []
+        self.urls = []
+        for i in range(count):
+            port_file = os.path.join(tmp, 'port-%d' % i)
+            self.procs.append(subprocess.Popen(
+                [sys.executable, STANDIN, '--port-file', port_file,
+                 '--delay', str(delay)], stdout=subprocess.DEVNULL))
+            while not os.path.exists(port_file):
+                if self.procs[-1].poll() is not None:
+                    sys.exit("Stand-in server failed to start")
+                time.sleep(0.05)
+            with open(port_file) as f:
+                self.urls.append('http://localhost:%d' % int(f.read()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            proc.wait()
+
+
+class Bench:
+    def __init__(self, args, tmp, urls):
+        self.args = args
+        self.results = {}
+        self.trace = os.path.join(tmp, 'trace.json')
+        self.env = dict(os.environ,
+                        HOME=os.path.join(tmp, 'home'),
+                        GNUPGHOME=os.path.join(tmp, 'gnupg'),
+                        XDG_CACHE_HOME=os.path.join(tmp, 'cache'),
+                        GIT_CONFIG_NOSYSTEM='1')
+        for var in list(self.env):
+            if var.startswith('TIMESTAMP_'):
+                del self.env[var]
+        # Measure the client, not the (default) request rate limit
+        self.env['TIMESTAMP_RATE'] = '0'
+        os.makedirs(self.env['HOME'])
+        os.makedirs(self.env['GNUPGHOME'], mode=0o700)
+        git(tmp, self.env, 'config', '--global', 'user.name', 'Bench')
+        git(tmp, self.env, 'config', '--global', 'user.email',
+            'bench@localhost')
+        self.urls = urls
+        self.repo = self.new_repo(os.path.join(tmp, 'repo'))
+        self.fleet = [self.new_repo(os.path.join(tmp, 'fleet', str(i)))
+                      for i in range(args.repos)]
+        self.fleet_list = os.path.join(tmp, 'fleet.txt')
+        with open(self.fleet_list, 'w') as f:
+            f.write('\n'.join(self.fleet) + '\n')
+
+    def new_repo(self, path):
+        os.makedirs(path)
+        git(path, self.env, 'init', '-q', '--initial-branch', 'main')
+        self.commit(path)
+        return path
+
+    def commit(self, path):
+        """New commit in `path`; returns no arguments"""
+        with open(os.path.join(path, 'file.txt'), 'a') as f:
+            f.write("%f\n" % time.time())
+        git(path, self.env, 'add', 'file.txt')
+        git(path, self.env, 'commit', '-q', '-m', 'Benchmark commit')
+        return []
+
+    def client(self, cwd, *args, trace=None):
+        env = self.env if trace is None else dict(self.env,
+                                                  TIMESTAMP_TRACE=trace)
+        start = time.perf_counter()
+        run([sys.executable, CLIENT] + list(args), cwd, env)
+        return time.perf_counter() - start
+
+    def traced(self, cwd, *args):
+        """Time a client run; returns the wall-clock time and the seconds
+        per trace phase, summed over servers and repositories"""
+        if os.path.exists(self.trace):
+            os.unlink(self.trace)
+        elapsed = self.client(cwd, *args, trace=self.trace)
+        phases = {}
+        with open(self.trace) as f:
+            for line in f:
+                for p in json.loads(line)['phases']:
+                    phases[p['phase']] = (phases.get(p['phase'], 0)
+                                          + p['seconds'])
+        return (elapsed, phases)
+
+    def phase(self, name, prepare):
+        """Time the client for `--rounds` runs, with the arguments returned
+        by `prepare()` each"""
+        times = []
+        traces = []
+        for _ in range(self.args.rounds):
+            (elapsed, phases) = self.traced(self.repo, *prepare())
+            times.append(elapsed)
+            traces.append(phases)
+        names = set().union(*traces)
+        self.results[name] = {
+            'min': min(times),
+            'median': statistics.median(times),
+            'max': max(times),
+            # Median per trace phase; phases missing from a run count as 0
+            'trace': {p: statistics.median(t.get(p, 0) for t in traces)
+                      for p in sorted(names, key=trace_order)},
+        }
+
+    def run_all(self):
+        one = ['--server', self.urls[0]]
+        every = ['--server', ','.join(self.urls)]
+        self.phase('first-contact', lambda: self.forget_keys() + one)
+        # Import the other keys outside of the measurements
+        self.commit(self.repo)
+        self.client(self.repo, *every)
+        self.phase('single', lambda: self.commit(self.repo) + one)
+        self.phase('multi-server', lambda: self.commit(self.repo) + every)
+        self.phase('tag', lambda: self.commit(self.repo) + one + [
+            '--tag', 'bench-%d' % time.time_ns()])
+        self.phase('bulk-branches',
+                   lambda: self.update_branches() + every + ['--all-branches'])
+        self.phase('bulk-fleet', lambda: self.update_fleet() + every)
+        self.phase('verify', lambda: ['--verify', '--full'])
+        return self.results
+
+    def forget_keys(self):
+        """Empty keyring and key cache; returns no arguments"""
+        shutil.rmtree(self.env['XDG_CACHE_HOME'], ignore_errors=True)
+        subprocess.run(['gpgconf', '--kill', 'all'], env=self.env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.env['GNUPGHOME'])
+        os.makedirs(self.env['GNUPGHOME'], mode=0o700)
+        self.commit(self.repo)
+        return []
+
+    def update_branches(self):
+        self.commit(self.repo)
+        for i in range(self.args.branches):
+            git(self.repo, self.env, 'branch', '-f', 'bench-%d' % i)
+        return []
+
+    def update_fleet(self):
+        for path in self.fleet:
+            self.commit(path)
+        return ['--repos', self.fleet_list]
+
+
+def trace_order(name):
+    """Sort key: known trace phases in order, then any others by name"""
+    if name in TRACE_PHASES:
+        return (TRACE_PHASES.index(name), name)
+    return (len(TRACE_PHASES), name)
+
+
+def change(value, before):
+    """Relative change as a column, if there is anything to compare with"""
+    if not before:
+        return ""
+    return "  %+6.1f%%" % ((value / before - 1) * 100)
+
+
+def report(results, baseline=None):
+    print("%-16s %10s %10s %10s%s" % ('phase', 'min', 'median', 'max',
+                                      '  vs. baseline' if baseline else ''))
+    for (name, r) in results.items():
+        line = "%-16s %8.0fms %8.0fms %8.0fms" % (
+            name, r['min'] * 1000, r['median'] * 1000, r['max'] * 1000)
+        if baseline and name in baseline:
+            line += change(r['median'], baseline[name]['median'])
+        print(line)
+    print()
+    print("%-16s %-10s %10s%s" % ('phase', 'trace', 'median',
+                                  '  vs. baseline' if baseline else ''))
+    for (name, r) in results.items():
+        before = (baseline or {}).get(name, {}).get('trace', {})
+        for (step, seconds) in r['trace'].items():
+            print("%-16s %-10s %8.1fms%s" % (
+                name, step, seconds * 1000,
+                change(seconds, before.get(step))))
+
+
+def main():
+    args = get_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    tmp = tempfile.mkdtemp(prefix='git-timestamp-bench-')
+    try:
+        with Standins(max(1, args.servers), args.delay, tmp) as standins:
+            results = Bench(args, tmp, standins.urls).run_all()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'version': subprocess.run(
+                    [sys.executable, CLIENT, '--version'],
+                    capture_output=True, text=True).stdout.strip(),
+                'python': platform.python_version(),
+                'settings': {k: getattr(args, k) for k in
+                             ('rounds', 'servers', 'branches', 'repos',
+                              'delay')},
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
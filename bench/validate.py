@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# Microbenchmarks: reading and validating a timestamp server response,
+# current single-pass `bytes` validator vs. the former `str`/regex one.
+# Signature verification itself is not measured (see `--verifier`).
+import io
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from git_timestamp import timestamp  # noqa: E402
+
+NAME = 'Bench Stamper <stamper@example.org>'
+NOW = 1600000000
+TREE = '4b825dc642cb6eb9a060e54bf8d69288fbe4904d'
+PARENT = '8a4b3a5c0c3e1d6f2a9b7c5d3e1f0a2b4c6d8e0f'
+COMMIT = '1f2e3d4c5b6a79880716253443526170ff0e1d2c'
+SIGNATURE = ('-----BEGIN PGP SIGNATURE-----\n\n'
+             + 'iQEzBAABCAAdFiEE' * 4 + '\n'
+             + ('A' * 64 + '\n') * 5 + '=AbCd\n'
+             + '-----END PGP SIGNATURE-----\n')
+
+
+def branch_commit(message='stamped\n'):
+    """A timestamp branch commit as returned by the server"""
+    head = ('tree %s\nparent %s\nparent %s\nauthor %s %d +0000\n'
+            'committer %s %d +0000\n'
+            % (TREE, PARENT, COMMIT, NAME, NOW, NAME, NOW))
+    gpgsig = 'gpgsig ' + SIGNATURE.rstrip('\n').replace('\n', '\n ') + '\n'
+    return head + gpgsig + '\n' + message
+
+
+def legacy_validate_branch(text, keyid, name, data, args, now=None):
+    """`validate_branch()` before streaming, on `str`"""
+    if len(text) > 8000:
+        sys.exit("Returned branch commit too long (%d > 8000)" % len(text))
+    if not re.match('^[ -~\n]*$', text, re.MULTILINE):
+        sys.exit("Returned branch commit does not only contain ASCII chars")
+    lead = 'tree %s\n' % data['tree']
+    if 'parent' in data:
+        lead += 'parent %s\n' % data['parent']
+    lead += '''parent %s
+author %s ''' % (data['commit'], name)
+    if not text.startswith(lead):
+        sys.exit("Unexpected lead")
+    pos = legacy_timestamp_zone_eol(text, len(lead), now)
+    follow = 'committer %s ' % name
+    if not text[pos:].startswith(follow):
+        sys.exit("Committer in signed branch commit does not match")
+    pos = legacy_timestamp_zone_eol(text, pos + len(follow), now)
+    if not text[pos:].startswith('gpgsig '):
+        sys.exit("Signed branch commit missing 'gpgsig' after 'committer'")
+    sig = re.match('^-----BEGIN PGP SIGNATURE-----\n \n'
+                   '[ -~\n]+\n -----END PGP SIGNATURE-----\n\n',
+                   text[pos + 7:], re.MULTILINE)
+    if not sig:
+        sys.exit("Incorrect OpenPGP signature in signed branch commit")
+    signature = sig.group()
+    signed = (text[:pos] + text[pos + 7 + sig.end() - 1:]).encode('ASCII')
+    signature = signature.replace('\n ', '\n')
+    timestamp.verify_signature_and_timestamp(keyid, signed, signature, args,
+                                             now)
+
+
+def legacy_timestamp_zone_eol(text, offset, now):
+    istamp = int(text[offset:offset + 10])
+    if not timestamp.validate_timestamp(istamp, now):
+        sys.exit("Falseticker")
+    if text[offset + 10:offset + 17] != ' +0000\n':
+        sys.exit("Not GMT")
+    return offset + 17
+
+
+def response(body):
+    """A streamed `requests` response delivering `body`"""
+    r = timestamp.requests.models.Response()
+    r.status_code = 200
+    r.raw = io.BytesIO(body)
+    return r
+
+
+def legacy_read(body):
+    """Former reading: download everything, decode, then check the size"""
+    r = response(body)
+    try:
+        legacy_validate_branch(r.text, None, NAME, DATA, None, NOW)
+    except SystemExit:
+        pass
+
+
+def current_read(body):
+    try:
+        timestamp.validate_branch(timestamp.read_limited(response(body),
+                                                         'branch commit'),
+                                  None, NAME, DATA, None, NOW)
+    except timestamp.TimestampError:
+        pass
+
+
+DATA = {'tree': TREE, 'parent': PARENT, 'commit': COMMIT}
+
+
+def bench(label, stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print("%-42s %9.2f µs" % (label, best / number * 1e6))
+
+
+def main():
+    # Measure parsing only
+    timestamp.verify_signature_and_timestamp = lambda *args: None
+    text = branch_commit()
+    body = text.encode('ascii')
+    timestamp.validate_branch(body, None, NAME, DATA, None, NOW)
+    legacy_validate_branch(text, None, NAME, DATA, None, NOW)
+    large = branch_commit('x' * 7000 + '\n')
+    huge = branch_commit('x' * (10 * 1024 * 1024) + '\n').encode('ascii')
+    print("Validation of a %d byte branch commit:" % len(body))
+    bench("  legacy (str, regex)",
+          lambda: legacy_validate_branch(text, None, NAME, DATA, None, NOW),
+          20000)
+    bench("  current (bytes, single pass)",
+          lambda: timestamp.validate_branch(body, None, NAME, DATA, None,
+                                            NOW),
+          20000)
+    print("Validation of a %d byte branch commit:" % len(large))
+    bench("  legacy (str, regex)",
+          lambda: legacy_validate_branch(large, None, NAME, DATA, None, NOW),
+          5000)
+    large = large.encode('ascii')
+    bench("  current (bytes, single pass)",
+          lambda: timestamp.validate_branch(large, None, NAME, DATA, None,
+                                            NOW),
+          5000)
+    print("Reading and validating the %d byte response:" % len(body))
+    bench("  legacy (r.text)", lambda: legacy_read(body), 5000)
+    bench("  current (streamed)", lambda: current_read(body), 5000)
+    print("Rejecting a %d byte response:" % len(huge))
+    bench("  legacy (r.text)", lambda: legacy_read(huge), 5)
+    bench("  current (streamed)", lambda: current_read(huge), 5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+from git_timestamp.timestamp import (AlreadyTimestamped, ClockSkew,
+                                     InvalidSignature, InvalidTimestamp,
+                                     ServerUnavailable, Stamper, StampResult,
+                                     TimestampError)
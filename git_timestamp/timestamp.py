@@ -23,91 +23,449 @@
 
 # This has not been modularized for ease of installation
 
-import configargparse
-import distutils.util
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import fcntl
+import fnmatch
+import functools
+import glob
+import hashlib
+import json
 import os
+import random
 import re
 import sys
 import tempfile
+import threading
 import time
 import traceback
 
-# Provided e.g. by `pip install python-gnupg` (try with `pip3` if `pip` does not work)
-import gnupg
-import pygit2 as git
-import requests
 import deltat
 
 VERSION = '1.2.0'
 
 
-class GitArgumentParser(configargparse.ArgumentParser):
-    """Insert git config options between command line and default.
-
-    WARNING: There is no way to handle custom actions correctly by default, so
-    your custom actions need to include a `convert_default(value)` method."""
-
-    def __init__(self, *args, **kwargs):
-        super(GitArgumentParser, self).__init__(*args, **kwargs)
-
-    def repo_config(self, key):
-        """`repo_config(key)` is similar to `repo.config[key]`, but `key` can
-        be a comma-separated list of keys. It returns the value of the first
-        which exists or raises `KeyError` if none is set.
-        """
-        for k in key.split(','):
-            if k in repo.config:
-                return repo.config[k]
-        raise KeyError("Key%s `%s` not in git config" % ('s' if ',' in key else "", key))
-
-    def add_argument(self, *args, **kwargs):
-        global repo
-        if repo is None and 'gitopt' in kwargs:
-            # Called outside a repo (maybe for --help or --version):
-            # Ignore repo options
-            del kwargs['gitopt']
-        elif 'gitopt' in kwargs:
-            if 'help' in kwargs:
-                kwargs['help'] += '. '
-            else:
-                kwargs['help'] = ''
-            gitopt = kwargs['gitopt']
+class LazyModule:
+    """Import module `name` on first use only. Importing `requests`,
+    `pygit2` and `gnupg` takes much longer than the trivial paths
+    (`--version`, disabled timestamping, not in a repository) themselves."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr):
+        # Unlike `importlib.import_module()`, visible to `-X importtime`
+        module = __import__(self._name)
+        # Further lookups will not need to go through `__getattr__()`
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+# Provided e.g. by `pip install python-gnupg` (try with `pip3` if `pip` does not work)
+gnupg = LazyModule('gnupg')
+git = LazyModule('pygit2')
+requests = LazyModule('requests')
+# Only needed when arguments are parsed beyond the trivial paths
+configargparse = LazyModule('configargparse')
+# Only needed for the timestamp index and `--daemon`/`--notify`
+sqlite3 = LazyModule('sqlite3')
+socket = LazyModule('socket')
+signal = LazyModule('signal')
+
+# Serialize access to each repository and to the git configuration when
+# talking to multiple timestampers concurrently
+repo_locks = {}
+repo_locks_lock = threading.Lock()
+config_lock = threading.Lock()
+
+
+def repo_lock(repo):
+    """The (reentrant) lock for `repo`, shared by everything using the same
+    git directory in this process; other repositories are not held up"""
+    gitdir = os.path.normpath(repo.path)
+    with repo_locks_lock:
+        lock = repo_locks.get(gitdir)
+        if lock is None:
+            lock = repo_locks[gitdir] = threading.RLock()
+        return lock
+
+
+class Context:
+    """What a run needs besides its options, passed along as `args.context`:
+    the repository whose git config records the timestampers (`None`
+    outside of a repository), GnuPG and the signature verifier, the HTTP
+    session, key caches, server statistics and the request rate limiter.
+    Created by `setup()`, for each run of `main()` and each `Stamper`."""
+
+    def __init__(self, repository):
+        self.repo = repository
+        self.gpg = None
+        self.verifier = None
+        self.session = None
+        self.key_cache = None
+        self.server_stats = None
+        self.rate_limiter = None
+        # (keyid, name) per timestamper, once known in this context
+        self.keyid_cache = {}
+
+
+class Timings:
+    """`--timings`: How long the phases of this run (repository discovery,
+    configuration, GnuPG setup, key lookup, HTTP request, verification,
+    writing) took, per server and repository. Nothing is recorded unless
+    enabled; the trace is written as a single line of JSON."""
+
+    def __init__(self):
+        self.target = None
+        self.start = time.time()
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def enable(self, target, start):
+        """Write the trace to `target` ('-' for stderr), timed from `start`"""
+        self.target = target
+        self.start = start
+
+    def add(self, name, start, end, server=None, repository=None, ok=True):
+        if self.target is None:
+            return
+        entry = {'phase': name, 'start': round(start - self.start, 6),
+                 'seconds': round(end - start, 6),
+                 'thread': threading.current_thread().name}
+        if server is not None:
+            entry['server'] = server_keyname(server)
+        if repository is not None:
+            entry['repository'] = repository.path
+        if not ok:
+            entry['ok'] = False
+        with self.lock:
+            self.phases.append(entry)
+
+    @contextlib.contextmanager
+    def phase(self, name, server=None, repository=None):
+        """Record the duration of the `with` block as phase `name`"""
+        if self.target is None:
+            yield
+            return
+        start = time.time()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.add(name, start, time.time(), server, repository, ok)
+
+    def write(self, status):
+        if self.target is None:
+            return
+        trace = json.dumps({
+            'version': VERSION,
+            'argv': sys.argv[1:],
+            'time': round(self.start, 3),
+            'seconds': round(time.time() - self.start, 6),
+            'status': status,
+            'phases': self.phases,
+        })
+        if self.target == '-':
+            sys.stderr.write(trace + '\n')
+        else:
             try:
-                if 'action' in kwargs and issubclass(kwargs['action'],
-                                                     configargparse.Action):
-                    try:
-                        val = kwargs['action'].convert_default(
-                            self.repo_config(gitopt))
-                    except AttributeError:
-                        raise NotImplementedError("Custom action `%r' passed "
-                                                  "to GitArgumentParser does not support "
-                                                  "`convert_default()' method." % kwargs['action'])
-                else:
-                    val = self.repo_config(gitopt)
-                kwargs['help'] += "Defaults to '%s' from `git config %s`" % (
-                    val, gitopt.replace(',', ' or '))
-                if 'default' in kwargs:
-                    kwargs['help'] += "; fallback default: '%s'" % kwargs['default']
-                kwargs['default'] = val
-                if 'required' in kwargs:
-                    del kwargs['required']
-            except KeyError:
-                kwargs['help'] += "Can be set by `git config %s`" % gitopt
-                if 'default' in kwargs:
-                    kwargs['help'] += "; fallback default: '%s'" % kwargs['default']
-            del kwargs['gitopt']
-        return super(GitArgumentParser, self).add_argument(*args, **kwargs)
+                with open(self.target, 'a') as fh:
+                    fh.write(trace + '\n')
+            except OSError as e:
+                sys.stderr.write("INFO: Cannot write timings to %s: %s\n"
+                                 % (self.target, e))
+
+
+timings = Timings()
+
 
-    add = add_argument
+class Profiler:
+    """`--profile`: cProfile statistics of all threads of this run (each
+    profiled separately, then merged), dumped for `pstats`"""
 
+    def __init__(self, path):
+        import cProfile
+        self.path = path
+        self.profiles = [cProfile.Profile()]
+        self.lock = threading.Lock()
+        self.thread_run = threading.Thread.run
+        profiler = self
 
-def asciibytes(data):
-    """For Python 2/3 compatibility:
-    If it is 'bytes' already, do nothing, otherwise convert to ASCII Bytes"""
-    if isinstance(data, bytes):
-        return data
+        def run(thread):
+            profile = cProfile.Profile()
+            with profiler.lock:
+                profiler.profiles.append(profile)
+            profile.enable()
+            try:
+                profiler.thread_run(thread)
+            finally:
+                profile.disable()
+
+        threading.Thread.run = run
+        self.profiles[0].enable()
+
+    def stop(self):
+        import pstats
+        self.profiles[0].disable()
+        threading.Thread.run = self.thread_run
+        with self.lock:
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        try:
+            stats.dump_stats(self.path)
+        except OSError as e:
+            sys.stderr.write("INFO: Cannot write profile to %s: %s\n"
+                             % (self.path, e))
+
+
+
+class Metrics:
+    """`--metrics FILE`: Outcome and duration of the timestamp requests per
+    server, in the Prometheus text format (for the node exporter's textfile
+    collector). Counters and the times of the last success and failure are
+    merged with those already in FILE, under a lock, so FILE accumulates
+    the history of all runs (and processes) writing to it."""
+
+    PREFIX = 'git_timestamp_'
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    FAMILIES = {
+        'stamps_total': ('counter', "Timestamps obtained"),
+        'failures_total': ('counter', "Failed timestamp requests, by reason"),
+        'request_duration_seconds': (
+            'histogram', "Duration of successful timestamp requests"),
+        'last_success_timestamp_seconds': (
+            'gauge', "Time of the last timestamp obtained"),
+        'last_failure_timestamp_seconds': (
+            'gauge', "Time of the last failed timestamp request"),
+        'last_run_timestamp_seconds': ('gauge', "End of the last run"),
+        'last_run_duration_seconds': ('gauge', "Duration of the last run"),
+        'last_run_exit_status': ('gauge', "Exit status of the last run"),
+    }
+    SERIES = re.compile(r'^git_timestamp_(\w+?)(?:\{(.*)\})? (\S+)$')
+    LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+    def __init__(self):
+        self.path = None
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def enable(self, path):
+        self.path = path
+
+    def set(self, name, labels, value, combine=None):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if combine is None or key not in self.values:
+                self.values[key] = value
+            else:
+                self.values[key] = combine(self.values[key], value)
+
+    def add(self, name, labels, value=1):
+        self.set(name, labels, value, lambda a, b: a + b)
+
+    @contextlib.contextmanager
+    def stamp(self, server):
+        """Count the outcome of the timestamp request in the `with` block,
+        classifying failures by `failure_reason()`"""
+        if self.path is None:
+            yield
+            return
+        try:
+            yield
+        except (SystemExit, TimestampError) as e:
+            self.failure(server, failure_reason(e))
+            raise
+        keyname = server_keyname(server)
+        self.add('stamps_total', {'server': keyname})
+        self.set('last_success_timestamp_seconds', {'server': keyname},
+                 round(time.time(), 3), max)
+
+    def failure(self, server, reason):
+        if self.path is None:
+            return
+        keyname = server_keyname(server)
+        self.add('failures_total', {'server': keyname, 'reason': reason})
+        self.set('last_failure_timestamp_seconds', {'server': keyname},
+                 round(time.time(), 3), max)
+
+    def observe(self, server, seconds):
+        """Add a request taking `seconds` to the duration histogram"""
+        if self.path is None:
+            return
+        labels = {'server': server_keyname(server)}
+        for bucket in self.BUCKETS:
+            self.add('request_duration_seconds_bucket',
+                     dict(labels, le=str(bucket)), int(seconds <= bucket))
+        self.add('request_duration_seconds_bucket',
+                 dict(labels, le='+Inf'))
+        self.add('request_duration_seconds_sum', labels, seconds)
+        self.add('request_duration_seconds_count', labels)
+
+    def parse(self, text):
+        """Series previously written to FILE, as `self.values` keys"""
+        values = {}
+        for line in text.splitlines():
+            match = self.SERIES.match(line)
+            if match is None:
+                continue
+            labels = tuple(sorted(
+                (k, re.sub(r'\\(.)', lambda m: {'n': '\n'}.get(
+                    m.group(1), m.group(1)), v))
+                for (k, v) in self.LABEL.findall(match.group(2) or '')))
+            try:
+                values[(match.group(1), labels)] = float(match.group(3))
+            except ValueError:
+                pass
+        return values
+
+    @staticmethod
+    def family(name):
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in \
+                    Metrics.FAMILIES:
+                return name[:-len(suffix)]
+        return name
+
+    def format(self, values):
+        def label_str(labels):
+            if len(labels) == 0:
+                return ''
+            return '{%s}' % ','.join(
+                '%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"')
+                             .replace('\n', '\\n'))
+                for (k, v) in labels)
+
+        def order(key):
+            (name, labels) = key
+            le = dict(labels).get('le')
+            return (self.family(name), [kv for kv in labels if kv[0] != 'le'],
+                    name, float('inf') if le in (None, '+Inf') else float(le))
+
+        lines = []
+        family = None
+        for key in sorted(values, key=order):
+            (name, labels) = key
+            if self.family(name) != family:
+                family = self.family(name)
+                if family in self.FAMILIES:
+                    (kind, text) = self.FAMILIES[family]
+                    lines.append('# HELP %s%s %s' % (self.PREFIX, family,
+                                                      text))
+                    lines.append('# TYPE %s%s %s' % (self.PREFIX, family,
+                                                      kind))
+            value = values[key]
+            lines.append('%s%s%s %s' % (
+                self.PREFIX, name, label_str(labels),
+                int(value) if value == int(value) else repr(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, status=None, start=None):
+        """Merge this process's values into FILE and reset them. With the
+        exit `status` of a run started at `start`, also the `last_run_*`"""
+        if self.path is None:
+            return
+        with self.lock:
+            values = self.values
+            self.values = {}
+        if status is not None:
+            now = time.time()
+            values[('last_run_timestamp_seconds', ())] = round(now, 3)
+            values[('last_run_duration_seconds', ())] = round(now - start, 3)
+            values[('last_run_exit_status', ())] = status
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with open(self.path + '.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    with open(self.path, 'r') as fh:
+                        old = self.parse(fh.read())
+                except FileNotFoundError:
+                    old = {}
+                for (key, value) in old.items():
+                    if key not in values:
+                        values[key] = value
+                    elif key[0].startswith('last_run_'):
+                        pass
+                    elif key[0].startswith('last_'):
+                        values[key] = max(values[key], value)
+                    else:
+                        values[key] += value
+                # Atomically, the textfile collector may read at any time
+                tmp = os.path.join(directory, '.%s.%d.tmp' % (
+                    os.path.basename(self.path), os.getpid()))
+                with open(tmp, 'w') as fh:
+                    fh.write(self.format(values))
+                os.replace(tmp, self.path)
+        except OSError as e:
+            sys.stderr.write("INFO: Cannot write metrics to %s: %s\n"
+                             % (self.path, e))
+
+
+metrics = Metrics()
+
+
+class TimestampError(Exception):
+    """Timestamping failed; `str()` gives the message. `status` is the HTTP
+    status, if the server responded with an error. `main()` exits with the
+    message, as for `sys.exit(message)`."""
+
+    status = None
+
+
+class AlreadyTimestamped(TimestampError):
+    """The commit has already been timestamped to this branch"""
+
+
+class InvalidTimestamp(TimestampError):
+    """The server returned a timestamp which does not pass validation"""
+
+
+class ClockSkew(InvalidTimestamp):
+    """The time of the returned timestamp or signature is too far off"""
+
+
+class InvalidSignature(InvalidTimestamp):
+    """The returned timestamp is not signed (correctly) by the expected key"""
+
+
+class ServerUnavailable(TimestampError):
+    """The server could not be reached or is temporarily unable to serve
+    the request; worth trying again later"""
+
+
+def failure_reason(e):
+    """Short reason for the failed timestamp request `e`, for `Metrics`"""
+    if isinstance(e, AlreadyTimestamped):
+        return 'already_timestamped'
+    elif isinstance(e, ClockSkew):
+        return 'falseticker'
+    elif isinstance(e, InvalidSignature):
+        return 'invalid_signature'
+    elif isinstance(e, InvalidTimestamp):
+        return 'invalid'
+    elif getattr(e, 'status', None) is not None:
+        return 'http_%d' % e.status
+    elif isinstance(e, ServerUnavailable):
+        return 'unavailable'
+    else:
+        return 'error'
+
+
+def strtobool(value):
+    """Replacement for `distutils.util.strtobool()`, as `distutils` is
+    deprecated (and slow to import)"""
+    value = value.lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    elif value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return False
     else:
-        return data.encode('ASCII')
+        raise ValueError("Invalid truth value %r" % (value,))
 
 
 def timestamp_branch_name(fields):
@@ -121,23 +479,6 @@ def timestamp_branch_name(fields):
     return 'zeitgitter-timestamps'
 
 
-class DefaultTrueIfPresent(configargparse.Action):
-    def __call__(self, parser, namespace, values, option_string=None):
-        if values is None:
-            values = True
-        else:
-            try:
-                values = self.convert_default(values)
-            except ValueError:
-                raise configargparse.ArgumentError(
-                    self, "Requires boolean value")
-        setattr(namespace, self.dest, values)
-
-    @classmethod
-    def convert_default(cls, value):
-        return bool(distutils.util.strtobool(value))
-
-
 server_aliases = {
     "gitta": "gitta.zeitgitter.net",
     "diversity": "diversity.zeitgitter.net",
@@ -150,9 +491,95 @@ def expanded_aliases():
     return ', '.join(map(lambda t: "%s → %s" % t, server_aliases.items()))
 
 
-def get_args():
-    """Parse command line and git config parameters"""
+@functools.lru_cache(maxsize=None)
+def argument_classes():
+    """`(GitArgumentParser, DefaultTrueIfPresent)`; defined on first use, as
+    the trivial paths do not need to import `configargparse`"""
+
+    class GitArgumentParser(configargparse.ArgumentParser):
+        """Insert git config options between command line and default.
+
+        WARNING: There is no way to handle custom actions correctly by default, so
+        your custom actions need to include a `convert_default(value)` method."""
+
+        def __init__(self, *args, repository=None, **kwargs):
+            super(GitArgumentParser, self).__init__(*args, **kwargs)
+            self.repository = repository
+
+        def repo_config(self, key):
+            """`repo_config(key)` is similar to `repo.config[key]`, but `key` can
+            be a comma-separated list of keys. It returns the value of the first
+            which exists or raises `KeyError` if none is set.
+            """
+            for k in key.split(','):
+                if k in self.repository.config:
+                    return self.repository.config[k]
+            raise KeyError("Key%s `%s` not in git config" % ('s' if ',' in key else "", key))
+
+        def add_argument(self, *args, **kwargs):
+            if self.repository is None and 'gitopt' in kwargs:
+                # Called outside a repo (maybe for --help or --version):
+                # Ignore repo options
+                del kwargs['gitopt']
+            elif 'gitopt' in kwargs:
+                if 'help' in kwargs:
+                    kwargs['help'] += '. '
+                else:
+                    kwargs['help'] = ''
+                gitopt = kwargs['gitopt']
+                try:
+                    if 'action' in kwargs and issubclass(kwargs['action'],
+                                                         configargparse.Action):
+                        try:
+                            val = kwargs['action'].convert_default(
+                                self.repo_config(gitopt))
+                        except AttributeError:
+                            raise NotImplementedError("Custom action `%r' passed "
+                                                      "to GitArgumentParser does not support "
+                                                      "`convert_default()' method." % kwargs['action'])
+                    else:
+                        val = self.repo_config(gitopt)
+                    kwargs['help'] += "Defaults to '%s' from `git config %s`" % (
+                        val, gitopt.replace(',', ' or '))
+                    if 'default' in kwargs:
+                        kwargs['help'] += "; fallback default: '%s'" % kwargs['default']
+                    kwargs['default'] = val
+                    if 'required' in kwargs:
+                        del kwargs['required']
+                except KeyError:
+                    kwargs['help'] += "Can be set by `git config %s`" % gitopt
+                    if 'default' in kwargs:
+                        kwargs['help'] += "; fallback default: '%s'" % kwargs['default']
+                del kwargs['gitopt']
+            return super(GitArgumentParser, self).add_argument(*args, **kwargs)
+
+        add = add_argument
+
+    class DefaultTrueIfPresent(configargparse.Action):
+        def __call__(self, parser, namespace, values, option_string=None):
+            if values is None:
+                values = True
+            else:
+                try:
+                    values = self.convert_default(values)
+                except ValueError:
+                    raise configargparse.ArgumentError(
+                        self, "Requires boolean value")
+            setattr(namespace, self.dest, values)
+
+        @classmethod
+        def convert_default(cls, value):
+            return strtobool(value)
+
+    return (GitArgumentParser, DefaultTrueIfPresent)
+
+
+def argument_parser(repository=None):
+    """The parser for the command line, with the defaults from the git config
+    of `repository` (if any)"""
+    (GitArgumentParser, DefaultTrueIfPresent) = argument_classes()
     parser = GitArgumentParser(
+        repository=repository,
         auto_env_var_prefix='timestamp_',
         add_help=False,
         description="""Interface to Zeitgitter, the network of
@@ -196,6 +623,218 @@ def get_args():
                help="""Delay between timestamping against the different
                    timestampers. For consistent ordering of timestamps,
                    set this to at least <maximum clock skew>+1s.""")
+    parser.add('--jobs', '-j',
+               type=int,
+               default=4,
+               gitopt='timestamp.jobs',
+               help="""Maximum number of timestampers to contact concurrently
+                   (only for automatic branch name selection). Key lookup and
+                   verification always overlap; with `--interval`, only the
+                   stamp requests themselves are serialized. `1` restores
+                   strictly sequential operation""")
+    parser.add('--spool',
+               nargs='?',
+               default=True,
+               action=DefaultTrueIfPresent,
+               metavar='bool',
+               gitopt='timestamp.spool',
+               help="""Remember automatic branch timestamps which could not
+                   be obtained because the server was unavailable, in
+                   `$GIT_DIR/git-timestamp/`; only the newest commit per
+                   timestamp branch is kept""")
+    parser.add('--flush',
+               action='store_true',
+               help="""Send the spooled timestamp requests, up to `--jobs`
+                   at a time, and exit""")
+    parser.add('--server-health',
+               nargs='?',
+               default=True,
+               action=DefaultTrueIfPresent,
+               metavar='bool',
+               gitopt='timestamp.server-health',
+               help="""Record per-server latencies and failures in
+                   `$XDG_CACHE_HOME/git-timestamp/servers.json`, to adapt the
+                   first read timeout (below `--timeout`), to contact healthy
+                   servers first, and to skip servers which failed repeatedly
+                   for a while (in automatic mode)""")
+    parser.add('--server-stats',
+               action='store_true',
+               help="""Print the recorded health of the configured and all
+                   other known servers and exit""")
+    parser.add('--quorum',
+               type=int,
+               metavar='K',
+               gitopt='timestamp.quorum',
+               help="""Succeed as soon as K of the servers have timestamped
+                   the commit (or had done so before), instead of requiring
+                   all of them. Servers still busy after `--quorum-grace`
+                   are abandoned""")
+    parser.add('--quorum-grace',
+               default='0s',
+               gitopt='timestamp.quorum-grace',
+               help="""With `--quorum`: How long to wait for further servers
+                   once the quorum has been reached""")
+    parser.add('--timeout',
+               default='10s,60s',
+               gitopt='timestamp.timeout',
+               help="""Connect and read timeout for requests to timestampers,
+                   separated by a comma. A single value applies to both""")
+    parser.add('--retries',
+               type=int,
+               default=2,
+               gitopt='timestamp.retries',
+               help="""How often to retry a request after a connection
+                   error, timeout, server error (5xx) or 429 Too Many
+                   Requests, with jittered exponential backoff or after the
+                   server's `Retry-After` (up to 60 s)""")
+    parser.add('--rate',
+               type=float,
+               default=5,
+               gitopt='timestamp.rate',
+               help="""Send at most RATE requests per second to each
+                   server, in bursts of up to RATE, together with all other
+                   `git timestamp` processes of this user (coordinated in
+                   `$XDG_CACHE_HOME/git-timestamp/rates.json`); further
+                   requests wait their turn. 0 disables the limit""")
+    parser.add('--repos',
+               metavar='FILE',
+               help="""Fleet mode: Timestamp each of the repositories listed
+                   (one path per line) in FILE (`-` for stdin) to its
+                   automatic branches, sharing keys and connections. Up to
+                   `--jobs` repositories are timestamped concurrently; the
+                   servers of a repository one after the other""")
+    parser.add('--repo-glob',
+               metavar='GLOB',
+               help="""Fleet mode: Timestamp all repositories matching GLOB
+                   (`**` matches any number of directories). Can be combined
+                   with `--repos`""")
+    parser.add('--stdin-refs',
+               action='store_true',
+               help="""Timestamp all branches updated according to
+                   `<old> <new> <ref>` lines on stdin, as passed to a
+                   `post-receive` hook, each to its automatic branches (like
+                   `--append-branch-name` for the branch as COMMIT). Up to
+                   `--jobs` branches are timestamped concurrently, sharing
+                   keys and connections""")
+    parser.add('--all-branches',
+               action='store_true',
+               help="""Timestamp the heads of all local branches (except
+                   timestamp branches and heads already timestamped), each
+                   to its automatic branches (like `--append-branch-name`
+                   for the branch as COMMIT). Up to `--jobs` branches are
+                   timestamped concurrently, sharing keys and connections""")
+    parser.add('--include-branches',
+               metavar='GLOBS',
+               default='*',
+               gitopt='timestamp.include-branches',
+               help="""`--all-branches` mode: Comma-separated list of glob
+                   patterns; only branches matching one of them are
+                   timestamped""")
+    parser.add('--exclude-branches',
+               metavar='GLOBS',
+               default='',
+               gitopt='timestamp.exclude-branches',
+               help="""`--all-branches` mode: Comma-separated list of glob
+                   patterns; branches matching one of them are not
+                   timestamped""")
+    parser.add('--aggregate',
+               action='store_true',
+               help="""Timestamp the heads of all branches (in fleet mode: of
+                   all repositories) with a single timestamp per server: An
+                   aggregate commit, whose tree refers to all heads, is
+                   timestamped to `*-aggregate-timestamps` in the current
+                   repository. Each repository then gets a proof ref per
+                   branch, `refs/timestamp-proofs/<timestamp branch>/<branch>`
+                   """)
+    parser.add('--load',
+               type=int,
+               metavar='N',
+               help="""Load test: Timestamp new commits in N synthetic
+                   repositories concurrently against the (first) server,
+                   validating each response as usual, for
+                   `--load-duration`; report throughput, latency and
+                   failures. For sizing your own timestamping server""")
+    parser.add('--load-rate',
+               type=float,
+               metavar='REQUESTS',
+               help="""`--load`: Total requests per second to aim for
+                   (default: as fast as the N repositories can go)""")
+    parser.add('--load-duration',
+               default='10s',
+               metavar='DURATION',
+               help="`--load`: How long to generate load")
+    parser.add('--timings',
+               nargs='?',
+               const='-',
+               metavar='FILE',
+               env_var='TIMESTAMP_TRACE',
+               help="""Write a JSON trace of how long each phase (config,
+                   key lookup, HTTP request, verification, writing) took,
+                   per server and repository, to stderr or append it as a
+                   line to FILE. Environment: `TIMESTAMP_TRACE=FILE`, e.g.,
+                   for hooks""")
+    parser.add('--metrics',
+               metavar='FILE',
+               gitopt='timestamp.metrics',
+               help="""After each run, update the per-server counts of
+                   timestamps and failures (by reason), request durations
+                   and last success/failure times in FILE, in the
+                   Prometheus text format, e.g., for the node exporter's
+                   textfile collector (`*.prom`)""")
+    parser.add('--profile',
+               metavar='FILE',
+               help="""Profile this run (all threads) with `cProfile` and
+                   dump the statistics to FILE, for `python3 -m pstats
+                   FILE`""")
+    parser.add('--fail-on',
+               choices=('any', 'all', 'never'),
+               default='any',
+               help="""Fleet, `--stdin-refs`, `--all-branches` and `--load`
+                   mode: Whether to exit with an
+                   error if `any` repository/branch, `all` of them, or
+                   `never` failed to be timestamped. Commits which had
+                   already been timestamped do not count as failure""")
+    parser.add('--verify',
+               nargs='?',
+               const='',
+               metavar='REF',
+               help="""Verify existing timestamps instead of creating one:
+                   All timestamps in timestamp branch or tag REF or, without
+                   REF, in all `*-timestamps*` branches and all tags by known
+                   timestampers. Runs the same checks as when obtaining a
+                   timestamp, except for the time window, in `--jobs`
+                   processes; prints a per-timestamper summary""")
+    parser.add('--all',
+               action='store_true',
+               help="""With `--verify`: Verify all timestamp branches and
+                   tags (the default without REF)""")
+    parser.add('--when',
+               metavar='COMMIT',
+               help="""Instead of timestamping, print when COMMIT was first
+                   timestamped by each timestamper, directly or through a
+                   timestamp of a descendant. Answered from the timestamp
+                   index in `$GIT_DIR/git-timestamp/`, which records new
+                   timestamps as they are obtained; use `--verify` to check
+                   them""")
+    parser.add('--full',
+               action='store_true',
+               help="""With `--verify`: Check all timestamps again, even
+                   those already recorded as verified in the timestamp
+                   index in `$GIT_DIR/git-timestamp/`""")
+    parser.add('--refresh-keys',
+               action='store_true',
+               help="""Re-fetch the keys of all configured servers and all
+                   server aliases concurrently, update the key cache and
+                   exit""")
+    parser.add('--verifier',
+               choices=('gnupg', 'native', 'auto'),
+               default='gnupg',
+               gitopt='timestamp.verifier',
+               help="""How to verify OpenPGP signatures: `gnupg` runs `gpg`
+                   for every signature; `native` verifies RSA and Ed25519
+                   signatures in-process against keys exported from GnuPG
+                   once; `auto` uses `native` where possible and `gnupg`
+                   otherwise""")
     parser.add('--append-branch-name',
                default=True,
                action=DefaultTrueIfPresent,
@@ -212,6 +851,43 @@ def get_args():
                     those, where the branch name will not automatically be
                     appended to. `git config init.defaultBranch`, if it exists,
                     is always appended to this list.""")
+    parser.add('--skip',
+               choices=['branch', 'stamped', 'covered'],
+               default='branch',
+               gitopt='timestamp.skip',
+               help="""When to skip a branch timestamp request without asking
+                   the server: `branch` if the commit has already been
+                   timestamped to the target branch; `stamped` if it has been
+                   timestamped by the same timestamper to any branch or tag
+                   (e.g., a sibling `*-timestamps-<branch>`); `covered` also
+                   if a descendant has been timestamped, i.e., nothing new has
+                   been committed since. Uses the timestamp index in
+                   `$GIT_DIR/git-timestamp/`""")
+    parser.add('--daemon',
+               action='store_true',
+               help="""Run as timestamp daemon: Accept requests from
+                   `--notify` on `--socket` and, `--coalesce` after the first
+                   request for a branch, timestamp its then-newest head to the
+                   automatic branches, once. Keys and connections are kept
+                   between requests""")
+    parser.add('--notify',
+               action='store_true',
+               help="""Hand COMMIT (resolved to the current branch for HEAD)
+                   to the daemon listening on `--socket` and return
+                   immediately, e.g., from a hook. Timestamps directly if no
+                   daemon is listening""")
+    parser.add('--socket',
+               metavar='PATH',
+               gitopt='timestamp.socket',
+               help="""Unix socket for `--daemon` and `--notify` (default:
+                   `$GIT_DIR/git-timestamp/daemon.sock`). With an explicit
+                   path, one daemon can serve many repositories""")
+    parser.add('--coalesce',
+               default='5s',
+               metavar='WINDOW',
+               gitopt='timestamp.coalesce',
+               help="""How long `--daemon` collects requests for the same
+                   branch before timestamping it""")
     parser.add('--gnupg-home',
                gitopt='timestamp.gnupg-home',
                help="Where to store timestamper public keys")
@@ -239,11 +915,36 @@ def get_args():
                gitopt='timestamp.commit-branch',
                help="""Which commit-ish to timestamp. Must be a branch name
                        for branch timestamps with `--append-branch-name`""")
-    arg = parser.parse_args()
+    return parser
+
+
+def get_args(argv=None, repository=None):
+    """Parse command line (or `argv`) and git config parameters (of
+    `repository`, if any)"""
+    arg = argument_parser(repository).parse_args(argv)
     arg.interval = deltat.parse_time(arg.interval)
+    arg.coalesce = deltat.parse_time(arg.coalesce).total_seconds()
+    arg.quorum_grace = deltat.parse_time(arg.quorum_grace).total_seconds()
+    arg.load_duration = deltat.parse_time(arg.load_duration).total_seconds()
+    if arg.load is not None:
+        if arg.load < 1:
+            sys.exit("`--load` needs at least one repository")
+        # Measure the server, not our statistics file
+        arg.server_health = False
+        arg.jobs = max(arg.jobs, arg.load)
+    if arg.quorum is not None and not (
+            1 <= arg.quorum <= len(arg.server.split(','))):
+        sys.exit("`--quorum` must be between 1 and the number of servers")
+    # Set by `timestamp_servers()` for its workers
+    arg.abandon = None
+    # Set by `setup()`
+    arg.context = None
+    arg.timeout = parse_timeout(arg.timeout)
     arg.default_branch = arg.default_branch.split(',')
+    arg.include_branches = [g for g in arg.include_branches.split(',') if g]
+    arg.exclude_branches = [g for g in arg.exclude_branches.split(',') if g]
     try:
-        arg.default_branch.append(repo.config['init.defaultBranch'])
+        arg.default_branch.append(repository.config['init.defaultBranch'])
     except AttributeError: # No repo (test deferred for `--version` etc.)
         pass
     except KeyError: # No config entry
@@ -255,7 +956,18 @@ def get_args():
     return arg
 
 
-def ensure_gnupg_ready_for_scan_keys():
+def parse_timeout(text):
+    """'connect,read' or a single value for both → (connect, read) seconds"""
+    timeouts = [deltat.parse_time(t).total_seconds() for t in text.split(',')]
+    if len(timeouts) == 1:
+        return (timeouts[0], timeouts[0])
+    elif len(timeouts) == 2:
+        return tuple(timeouts)
+    else:
+        sys.exit("`--timeout` expects at most two values (connect,read)")
+
+
+def ensure_gnupg_ready_for_scan_keys(gpg):
     """`scan_keys()` on older GnuPG installs returns an empty list when
     `~/.gnupg/pubring.kbx` has not yet been created. `list_keys()` or most
     other commands will create it. Trying to have no match (for speed).
@@ -266,12 +978,19 @@ def ensure_gnupg_ready_for_scan_keys():
 
 def validate_key_and_import(text, args):
     """Is this a single key? Then import it"""
-    ensure_gnupg_ready_for_scan_keys()
-    f = tempfile.NamedTemporaryFile(mode='w', delete=False)
-    f.write(text)
-    f.close()
-    info = gpg.scan_keys(f.name)
-    os.unlink(f.name)
+    gpg = args.context.gpg
+    ensure_gnupg_ready_for_scan_keys(gpg)
+    if hasattr(gpg, 'scan_keys_mem'):
+        info = gpg.scan_keys_mem(text)
+    else:
+        # python-gnupg before 0.5.1 can only scan files
+        f = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        try:
+            f.write(text)
+            f.close()
+            info = gpg.scan_keys(f.name)
+        finally:
+            os.unlink(f.name)
     if len(info) != 1 or info[0]['type'] != 'pub' or len(info[0]['uids']) == 0:
         sys.exit("Invalid key returned\n"
                  "Maybe not a Zeitgitter server or ~/.gnupg permission problem")
@@ -283,7 +1002,7 @@ def validate_key_and_import(text, args):
     return (info[0]['keyid'], info[0]['uids'][0])
 
 
-def get_global_config_if_possible():
+def get_global_config_if_possible(repo):
     """Try to return global git configuration, which normally lies in
     `~/.gitconfig`.
 
@@ -304,7 +1023,9 @@ def get_global_config_if_possible():
        `IOError`), or because the installed `libgit2`/`pygit2` is too old
        (`AttributeError`; function added in 2014 only),
     3. `touch ~/.gitconfig` and retry `get_global_config()`, and, as fallback
-    4. use the repo's `.git/config`, which should always be there."""
+    4. use the `.git/config` of `repo`, which should always be there.
+    Outside a repository (`repo` is `None`, e.g., for a `--daemon` with a
+    global `--socket`), there is no fallback and this exits instead."""
     try:
         return git.Config.get_global_config()  # 1
     except (IOError, OSError):
@@ -321,16 +1042,342 @@ def get_global_config_if_possible():
                     pass
                 return git.Config.get_global_config()  # 3
             except (IOError, OSError):
+                if repo is None:
+                    sys.exit("Cannot use or create the global git config"
+                             " (~/.gitconfig) for the timestamper keys,"
+                             " and not in a git repository")
                 sys.stderr.write("INFO: Cannot record key ID in global config,"
                                  " falling back to repo config\n")
                 return repo.config  # 4
     # Not reached
 
 
-def get_keyid(args):
-    """Return keyid/fullname from git config, if known.
-    Otherwise, request it from server and remember TOFU-style"""
-    keyname = args.server
+def keyring_stamp(args):
+    """Path, modification time and size of the GnuPG public keyring,
+    or `None` if it does not exist (yet)"""
+    home = (args.gnupg_home or os.getenv('GNUPGHOME')
+            or os.path.expanduser('~/.gnupg'))
+    for name in ('pubring.kbx', 'pubring.gpg', 'public-keys.d/pubring.db'):
+        path = os.path.abspath(os.path.join(home, name))
+        try:
+            st = os.stat(path)
+            return [path, st.st_mtime_ns, st.st_size]
+        except OSError:
+            pass
+    return None
+
+
+class KeyCache:
+    """Persistent cache of timestamper keys, by normalized server name.
+
+    Each entry records key ID, fingerprint, user ID, the exported key and
+    the state of the keyring it was found in. As long as the keyring has not
+    changed, the key is known to be there and `gpg` need not be asked.
+    Stored in `$XDG_CACHE_HOME/git-timestamp/keys.json`."""
+
+    def __init__(self, args, gpg):
+        self.path = os.path.join(
+            os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+            'git-timestamp', 'keys.json')
+        self.args = args
+        self.gpg = gpg
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, 'r') as fh:
+                    self.entries = json.load(fh)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def get(self, keyname, keyid):
+        """The entry for `keyname`, if it is for `keyid` and still valid"""
+        with self.lock:
+            entry = self.load().get(keyname)
+        stamp = keyring_stamp(self.args)
+        if (entry is not None and entry.get('keyid') == keyid
+                and stamp is not None and entry.get('keyring') == stamp):
+            return entry
+        return None
+
+    def put(self, keyname, keyid, name):
+        """Record the now-verified presence of `keyid` in the keyring"""
+        key = self.gpg.export_keys(keyid)
+        info = self.gpg.list_keys(keys=keyid)
+        if not key or len(info) == 0:
+            return
+        with self.lock:
+            entries = self.load()
+            entries[keyname] = {
+                'keyid': keyid,
+                'fingerprint': info[0]['fingerprint'],
+                'name': name,
+                'key': key,
+                'keyring': keyring_stamp(self.args)
+            }
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = '%s.%d.tmp' % (self.path, os.getpid())
+                with open(tmp, 'w') as fh:
+                    json.dump(entries, fh, indent=1, sort_keys=True)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                sys.stderr.write("INFO: Cannot write key cache: %s\n" % e)
+
+
+class ServerStats:
+    """Persistent health statistics per server, by normalized server name,
+    in `$XDG_CACHE_HOME/git-timestamp/servers.json`: request and failure
+    counts, the latencies of the last `SAMPLES` successful requests, the
+    number of consecutive failures, and the time of the last success and
+    failure. Updates from concurrent processes are merged under a lock.
+
+    After `THRESHOLD` consecutive failures, the circuit is open: the server
+    is skipped for `COOLDOWN` seconds, doubling with each further failure
+    (up to `MAX_COOLDOWN`). Then, one more attempt is allowed."""
+
+    SAMPLES = 50
+    THRESHOLD = 3
+    COOLDOWN = 60
+    MAX_COOLDOWN = 3600
+
+    def __init__(self, args):
+        self.path = os.path.join(
+            os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+            'git-timestamp', 'servers.json')
+        self.enabled = args.server_health
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, keyname):
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.load()
+            return self.entries.get(keyname, {})
+
+    def record(self, keyname, latency=None):
+        """Record a successful request taking `latency` seconds or, with
+        `None`, a failed one"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path + '.lock', 'w') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    entries = self.load()
+                    entry = entries.setdefault(keyname, {
+                        'requests': 0, 'failures': 0, 'latencies': [],
+                        'consecutive_failures': 0})
+                    entry['requests'] += 1
+                    if latency is None:
+                        entry['failures'] += 1
+                        entry['consecutive_failures'] += 1
+                        entry['last_failure'] = now
+                    else:
+                        entry['latencies'] = (entry['latencies']
+                                              + [round(latency, 3)]
+                                              )[-self.SAMPLES:]
+                        entry['consecutive_failures'] = 0
+                        entry['last_success'] = now
+                    tmp = '%s.%d.tmp' % (self.path, os.getpid())
+                    with open(tmp, 'w') as fh:
+                        json.dump(entries, fh, indent=1, sort_keys=True)
+                    os.replace(tmp, self.path)
+                    self.entries = entries
+            except OSError as e:
+                sys.stderr.write("INFO: Cannot write server statistics: %s\n"
+                                 % e)
+
+    @staticmethod
+    def percentile(entry, p):
+        """The `p`th percentile of the recorded latencies, or `None`"""
+        latencies = sorted(entry.get('latencies', []))
+        if len(latencies) == 0:
+            return None
+        return latencies[min(len(latencies) - 1,
+                             int(len(latencies) * p / 100))]
+
+    def timeout(self, keyname, configured):
+        """(connect, read) timeout: The read timeout is reduced to four
+        times the 95th percentile latency (at least 5 s), once enough
+        samples are known; `configured` (`--timeout`) is the upper bound"""
+        entry = self.get(keyname) if self.enabled else {}
+        if len(entry.get('latencies', [])) < 5:
+            return configured
+        (connect, read) = configured
+        return (connect, min(read, max(5.0, 4 * self.percentile(entry, 95))))
+
+    def open_until(self, keyname):
+        """Until when the circuit for `keyname` is open, or `None`"""
+        entry = self.get(keyname) if self.enabled else {}
+        failures = entry.get('consecutive_failures', 0)
+        if failures < self.THRESHOLD:
+            return None
+        until = entry['last_failure'] + min(
+            self.MAX_COOLDOWN,
+            self.COOLDOWN * 2 ** (failures - self.THRESHOLD))
+        return until if until > time.time() else None
+
+    def rank(self, keyname):
+        """Sort key: Healthy and fast servers first"""
+        entry = self.get(keyname) if self.enabled else {}
+        median = self.percentile(entry, 50)
+        return (self.open_until(keyname) is not None,
+                entry.get('consecutive_failures', 0) > 0,
+                1.0 if median is None else median)
+
+
+def print_server_stats(args):
+    """`--server-stats`: Report the health of the configured and all other
+    known servers"""
+    server_stats = args.context.server_stats
+    keynames = [server_keyname(server_url(s)) for s in args.server.split(',')]
+    with server_stats.lock:
+        known = server_stats.load()
+    keynames += sorted(k for k in known if k not in keynames)
+    print("%-30s %8s %7s %7s %7s  %-19s  %s" % (
+        'server', 'requests', 'failed', 'p50', 'p95', 'last success',
+        'circuit'))
+    for keyname in keynames:
+        entry = known.get(keyname, {})
+        p50 = ServerStats.percentile(entry, 50)
+        p95 = ServerStats.percentile(entry, 95)
+        until = server_stats.open_until(keyname)
+        print("%-30s %8d %7d %7s %7s  %-19s  %s" % (
+            keyname, entry.get('requests', 0), entry.get('failures', 0),
+            '-' if p50 is None else '%.2fs' % p50,
+            '-' if p95 is None else '%.2fs' % p95,
+            time_str(entry['last_success']) if 'last_success' in entry
+            else '-',
+            'closed' if until is None else 'open until ' + time_str(until)))
+
+
+class RateLimiter:
+    """Token bucket per server, by normalized server name, shared by all
+    processes through `$XDG_CACHE_HOME/git-timestamp/rates.json`: A request
+    takes a token, refilled at `--rate` per second (up to `--rate` tokens);
+    without one, it reserves the next and waits for it, so concurrent
+    processes queue instead of hitting the server at once.
+
+    A server's `Retry-After` pauses all requests to it until then; waits of
+    more than `MAX_RETRY_AFTER` seconds fail instead (see `--spool`)."""
+
+    MAX_RETRY_AFTER = 60
+
+    def __init__(self, args):
+        self.path = os.path.join(
+            os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+            'git-timestamp', 'rates.json')
+        self.rate = args.rate
+        # `--load` measures the server as it is
+        self.enabled = args.load is None
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def update(self, keyname, change):
+        """Apply `change(entry, now)` to the state of `keyname` under the
+        lock; returns its result"""
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path + '.lock', 'w') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    entries = self.load()
+                    now = time.time()
+                    # Forget idle servers
+                    entries = {k: e for (k, e) in entries.items()
+                               if max(e.get('updated', 0),
+                                      e.get('not_before', 0)) > now - 86400}
+                    result = change(entries.setdefault(keyname, {}), now)
+                    tmp = '%s.%d.tmp' % (self.path, os.getpid())
+                    with open(tmp, 'w') as fh:
+                        json.dump(entries, fh, indent=1, sort_keys=True)
+                    os.replace(tmp, self.path)
+                    return result
+            except OSError as e:
+                sys.stderr.write("INFO: Cannot coordinate request rate: %s\n"
+                                 % e)
+                return change({}, time.time())
+
+    def acquire(self, server):
+        """Wait until a request to `server` may be sent"""
+        if not self.enabled:
+            return
+        keyname = server_keyname(server)
+        if self.rate <= 0:
+            # Only honor `Retry-After`
+            not_before = self.load().get(keyname, {}).get('not_before', 0)
+            wait = self.check_pause(server, not_before - time.time())
+        else:
+            def take(entry, now):
+                pause = entry.get('not_before', 0) - now
+                if pause > self.MAX_RETRY_AFTER:
+                    return pause  # Do not reserve, `check_pause()` fails
+                burst = max(1.0, self.rate)
+                tokens = min(burst, entry.get('tokens', burst) + self.rate
+                             * (now - entry.get('updated', now)))
+                entry['tokens'] = tokens - 1
+                entry['updated'] = now
+                # A negative balance means slots reserved by others
+                return max(pause, (1 - tokens) / self.rate)
+            wait = self.check_pause(server, self.update(keyname, take))
+        if wait > 0:
+            time.sleep(wait)
+
+    def check_pause(self, server, wait):
+        if wait > self.MAX_RETRY_AFTER:
+            raise ServerUnavailable(
+                "%s asked to retry after %s, not waiting"
+                % (server, time_str(time.time() + wait)))
+        return wait
+
+    def pause(self, server, seconds):
+        """The server asked to wait `seconds` before the next request"""
+        if not self.enabled:
+            return
+
+        def set_pause(entry, now):
+            entry['not_before'] = max(entry.get('not_before', 0),
+                                      now + seconds)
+        self.update(server_keyname(server), set_pause)
+
+
+def retry_after(r):
+    """Seconds to wait according to the `Retry-After` header of `r`, if any"""
+    value = r.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return int(value)
+    elif value != '':
+        import email.utils
+        try:
+            return max(0, email.utils.parsedate_to_datetime(value).timestamp()
+                       - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def server_keyname(server):
+    """Normalized server name, as used in `git config timestamper.*`"""
+    keyname = server
     if keyname.startswith('http://'):
         keyname = keyname[7:]
     elif keyname.startswith('https://'):
@@ -338,29 +1385,99 @@ def get_keyid(args):
     while keyname.endswith('/'):
         keyname = keyname[0:-1]
     # Replace everything outside 0-9a-z with '-':
-    keyname = ''.join(map(lambda x:
-                          x if (x >= '0' and x <= '9') or (x >= 'a' and x <= 'z') else '-', keyname))
-    try:
-        keyid = repo.config['timestamper.%s.keyid' % keyname]
-        keys = gpg.list_keys(keys=keyid)
-        if len(keys) == 0:
-            sys.stderr.write("WARNING: Key %s missing in keyring;"
-                             " refetching timestamper key\n" % keyid)
-            raise KeyError("GPG Key not found")  # Evil hack
-        return (keyid, repo.config['timestamper.%s.name' % keyname])
-    except KeyError:
-        # Obtain key in TOFU fashion and remember keyid
-        r = requests.get(args.server, params={'request': 'get-public-key-v1'},
-                         timeout=30)
-        quit_if_http_error(args.server, r)
-        (keyid, name) = validate_key_and_import(r.text, args)
+    return ''.join(map(lambda x:
+                       x if (x >= '0' and x <= '9') or (x >= 'a' and x <= 'z') else '-', keyname))
+
+
+def fetch_key(keyname, config, args):
+    """Request key from server, import and remember it TOFU-style"""
+    r = http_request('GET', args.server, args,
+                     params={'request': 'get-public-key-v1'})
+    quit_if_http_error(args.server, r)
+    (keyid, name) = validate_key_and_import(r.text, args)
+    with config_lock:
         if not os.getenv('FORCE_GIT_REPO_CONFIG'):
-            gcfg = get_global_config_if_possible()
+            gcfg = get_global_config_if_possible(args.context.repo)
         else:
-            gcfg = repo.config
+            gcfg = config
         gcfg['timestamper.%s.keyid' % keyname] = keyid
         gcfg['timestamper.%s.name' % keyname] = name
-        return (keyid, name)
+    args.context.key_cache.put(keyname, keyid, name)
+    args.context.keyid_cache[keyname] = (keyid, name)
+    return (keyid, name)
+
+
+def get_keyid(args):
+    """Return keyid/fullname from git config, if known.
+    Otherwise, request it from server and remember TOFU-style"""
+    keyname = server_keyname(args.server)
+    if keyname in args.context.keyid_cache:
+        return args.context.keyid_cache[keyname]
+    with timings.phase('key', server=args.server):
+        return lookup_keyid(keyname, args)
+
+
+def lookup_keyid(keyname, args):
+    """`get_keyid()` for a timestamper not yet known in this context"""
+    context = args.context
+    config = (context.repo.config if context.repo is not None
+              else get_global_config_if_possible(None))
+    try:
+        keyid = config['timestamper.%s.keyid' % keyname]
+        name = config['timestamper.%s.name' % keyname]
+    except KeyError:
+        return fetch_key(keyname, config, args)
+    cached = context.key_cache.get(keyname, keyid)
+    if cached is not None:
+        # Keyring unchanged since the key was last seen there
+        context.verifier.add_key(keyid, cached['key'])
+    elif context.verifier.has_key(keyid):
+        context.key_cache.put(keyname, keyid, name)
+    else:
+        sys.stderr.write("WARNING: Key %s missing in keyring;"
+                         " refetching timestamper key\n" % keyid)
+        return fetch_key(keyname, config, args)
+    context.keyid_cache[keyname] = (keyid, name)
+    return (keyid, name)
+
+
+def refresh_keys(args):
+    """Re-fetch the keys of all configured servers and server aliases"""
+    servers = []
+    for server in args.server.split(',') + list(server_aliases.keys()):
+        if server_url(server) not in servers:
+            servers.append(server_url(server))
+    repo = args.context.repo
+    config = (repo.config if repo is not None
+              else get_global_config_if_possible(None))
+
+    def refresh(server):
+        key_args = copy.copy(args)
+        key_args.server = server
+        keyname = server_keyname(server)
+        try:
+            old = config['timestamper.%s.keyid' % keyname]
+        except KeyError:
+            old = None
+        (keyid, name) = fetch_key(keyname, config, key_args)
+        if old is not None and old != keyid:
+            return "WARNING: Key changed from %s to %s: %s" % (old, keyid, name)
+        return "%s: %s" % (keyid, name)
+
+    success = True
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(args.jobs, len(servers)))) as pool:
+        futures = [pool.submit(refresh, server) for server in servers]
+        for (server, f) in zip(servers, futures):
+            try:
+                result = f.result()
+                if not args.quiet or result.startswith('WARNING'):
+                    print("%s: %s" % (server, result))
+            except (SystemExit, TimestampError) as e:
+                sys.stderr.write("%s: %s\n" % (server, e))
+                success = False
+    if not success:
+        sys.exit(1)
 
 
 def sig_time():
@@ -368,9 +1485,10 @@ def sig_time():
     return int(os.getenv('ZEITGITTER_FAKE_TIME', time.time()))
 
 
-def validate_timestamp(stamp):
+def validate_timestamp(stamp, now=None):
     """Is this timestamp within ± of now?"""
-    now = sig_time()
+    if now is None:
+        now = sig_time()
     # Allow a ±30 s window
     return stamp > now - 30 and stamp < now + 30
 
@@ -380,88 +1498,636 @@ def time_str(seconds):
     return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
 
 
-def validate_timestamp_zone_eol(header, text, offset):
-    """Does this line end with a current timestamp and GMT?
-    Returns start of next line."""
-    stamp = text[offset:offset + 10]
+def validate_timestamp_zone_eol(header, body, offset, now=None):
+    """Does this line of `bytes` end with a current timestamp and GMT?
+    Returns start of next line.
+    `now` replaces the current time, e.g., when verifying old timestamps."""
+    stamp = body[offset:offset + 10]
     try:
         istamp = int(stamp)
-        sigtime = sig_time()
-        if not validate_timestamp(istamp):
-            sys.exit("Ignoring returned %s timestamp (%s) as possible falseticker\n"
-                     "(off by %d seconds compared to this computer's time; check clock)"
-                     % (header, time_str(istamp), istamp - sigtime))
+        sigtime = sig_time() if now is None else now
+        if not validate_timestamp(istamp, sigtime):
+            raise ClockSkew(
+                "Ignoring returned %s timestamp (%s) as possible falseticker\n"
+                "(off by %d seconds compared to this computer's time; check clock)"
+                % (header, time_str(istamp), istamp - sigtime))
     except ValueError:
-        sys.exit("Returned %s timestamp '%s' is not a number" %
-                 (header, stamp))
-    tz = text[offset + 10:offset + 17]
-    if tz != ' +0000\n':
-        sys.exit("Returned %s timezone is not GMT or not at end of line,\n"
-                 "but '%s' instead of '%s'"
-                 % (header, repr(tz), repr(' +0000\n')))
+        raise InvalidTimestamp("Returned %s timestamp '%s' is not a number"
+                               % (header,
+                                  stamp.decode('ascii', errors='replace')))
+    if not body.startswith(b' +0000\n', offset + 10):
+        tz = body[offset + 10:offset + 17].decode('ascii', errors='replace')
+        raise InvalidTimestamp(
+            "Returned %s timezone is not GMT or not at end of line,\n"
+            "but '%s' instead of '%s'"
+            % (header, repr(tz), repr(' +0000\n')))
     return offset + 17
 
 
-def verify_signature_and_timestamp(keyid, signed, signature, args):
+# Printable ASCII and newline, the only bytes allowed in timestamps
+ASCII_TEXT = bytes(range(0x20, 0x7f)) + b'\n'
+# Upper limit for a timestamp tag or commit as returned by the server
+MAX_STAMP_SIZE = 8000
+
+
+def check_stamp_text(body, what):
+    """Raise `InvalidTimestamp` unless `body` is a plausible timestamp
+    object: not too long and only printable ASCII and newlines (a single
+    pass in C)"""
+    if len(body) > MAX_STAMP_SIZE:
+        raise InvalidTimestamp("Returned %s too long (%d > %d)"
+                               % (what, len(body), MAX_STAMP_SIZE))
+    if body.translate(None, ASCII_TEXT):
+        raise InvalidTimestamp("Returned %s does not only contain ASCII chars"
+                               % what)
+
+
+def expect_lead(body, lead, what):
+    """Raise `InvalidTimestamp` unless `body` starts with `lead` (both
+    `bytes`)"""
+    if not body.startswith(lead):
+        raise InvalidTimestamp(
+            "Expected %s to start with:\n"
+            "> %s\n\nInstead, it started with:\n> %s\n"
+            % (what, lead.decode('utf-8').replace('\n', '\n> '),
+               body.decode('ascii', errors='replace').replace('\n', '\n> ')))
+
+
+def dearmor(armored):
+    """Binary contents of an ASCII-armored OpenPGP block.
+    The optional checksum is ignored; signatures protect themselves."""
+    lines = armored.strip('\n').split('\n')
+    if (len(lines) < 3 or not lines[0].startswith('-----BEGIN PGP ')
+            or not lines[-1].startswith('-----END PGP ')
+            or '' not in lines):
+        raise ValueError("Not an ASCII-armored OpenPGP block")
+    # Armor headers (e.g., `Version:`) end with an empty line
+    body = lines[lines.index('') + 1:-1]
+    body = [line for line in body if not line.startswith('=')]
+    try:
+        return base64.b64decode(''.join(body), validate=True)
+    except ValueError:
+        raise ValueError("Invalid Base64 in OpenPGP block")
+
+
+def openpgp_packets(data):
+    """Split binary OpenPGP data into a list of `(tag, body)` packets"""
+    packets = []
+    pos = 0
+    while pos < len(data):
+        ctb = data[pos]
+        if not ctb & 0x80:
+            raise ValueError("Invalid OpenPGP packet header")
+        if ctb & 0x40:  # New format
+            tag = ctb & 0x3f
+            first = data[pos + 1] if pos + 1 < len(data) else 0
+            if first < 192:
+                (length, pos) = (first, pos + 2)
+            elif first < 224 and pos + 2 < len(data):
+                (length, pos) = (((first - 192) << 8) + data[pos + 2] + 192,
+                                 pos + 3)
+            elif first == 255:
+                (length, pos) = (int.from_bytes(data[pos + 2:pos + 6], 'big'),
+                                 pos + 6)
+            else:
+                raise ValueError("Unsupported OpenPGP packet length")
+        else:  # Old format
+            tag = (ctb >> 2) & 0x0f
+            if ctb & 3 == 3:
+                raise ValueError("Unsupported OpenPGP packet length")
+            size = 1 << (ctb & 3)
+            length = int.from_bytes(data[pos + 1:pos + 1 + size], 'big')
+            pos += 1 + size
+        if pos + length > len(data):
+            raise ValueError("Truncated OpenPGP packet")
+        packets.append((tag, data[pos:pos + length]))
+        pos += length
+    return packets
+
+
+def openpgp_packet(tag, body):
+    """Encode a new-format OpenPGP packet"""
+    if len(body) < 192:
+        length = bytes([len(body)])
+    elif len(body) < 8384:
+        length = bytes([((len(body) - 192) >> 8) + 192, (len(body) - 192) & 0xff])
+    else:
+        length = b'\xff' + len(body).to_bytes(4, 'big')
+    return bytes([0xc0 | tag]) + length + body
+
+
+def signature_packet(signature):
+    """Body of the single signature packet in the detached, armored
+    `signature`. Raises `InvalidSignature` unless there is exactly one
+    signature."""
+    try:
+        packets = openpgp_packets(dearmor(signature))
+    except (ValueError, IndexError):
+        raise InvalidSignature("Not a valid OpenPGP signature")
+    if len(packets) != 1 or packets[0][0] != 2:
+        raise InvalidSignature(
+            "Expected a single OpenPGP signature, found %d packet(s)"
+            % len(packets))
+    return packets[0][1]
+
+
+def signed_message(signed, signature):
+    """Combine the detached, armored `signature` and the `signed` pieces
+    (bytes-like) into a single binary OpenPGP signed message (signature
+    packet followed by a binary literal data packet), which can be verified
+    through a pipe."""
+    # Literal data: binary format, no file name, no date
+    return (openpgp_packet(2, signature_packet(signature))
+            + openpgp_packet(11, b''.join((b'b\0\0\0\0\0',) + signed)))
+
+
+Verification = collections.namedtuple(
+    'Verification', 'valid key_id pubkey_fingerprint sig_timestamp')
+
+# A timestamp obtained: server URL, ref written, timestamped commit ID,
+# ID of the timestamp (branch commit or tag) and its time (seconds since
+# the epoch), as returned by `timestamp_branch()` and `timestamp_tag()`
+StampResult = collections.namedtuple(
+    'StampResult', 'server ref commit stamp time')
+
+
+class GnuPGVerifier:
+    """Verify signatures by running `gpg` (through python-gnupg)"""
+
+    def __init__(self, gpg):
+        self.gpg = gpg
+
+    def has_key(self, keyid):
+        return len(self.gpg.list_keys(keys=keyid)) > 0
+
+    def add_key(self, keyid, armored):
+        pass  # GnuPG has its own keyring
+
+    def verify(self, keyid, signed, signature):
+        verified = self.gpg.verify(signed_message(signed, signature))
+        return Verification(bool(verified.valid), verified.key_id,
+                            verified.pubkey_fingerprint,
+                            int(verified.sig_timestamp or 0))
+
+
+# PKCS#1 v1.5 DigestInfo prefixes and hash functions, by OpenPGP hash algorithm
+openpgp_hashes = {
+    2: ('sha1', bytes.fromhex('3021300906052b0e03021a05000414')),
+    8: ('sha256', bytes.fromhex('3031300d060960864801650304020105000420')),
+    9: ('sha384', bytes.fromhex('3041300d060960864801650304020205000430')),
+    10: ('sha512', bytes.fromhex('3051300d060960864801650304020305000440')),
+    11: ('sha224', bytes.fromhex('302d300d06096086480165030402040500041c')),
+}
+ED25519_OID = bytes.fromhex('2b06010401da470f01')
+ED25519_P = 2 ** 255 - 19
+ED25519_L = 2 ** 252 + 27742317777372353535851937790883648493
+ED25519_D = -121665 * pow(121666, ED25519_P - 2, ED25519_P) % ED25519_P
+
+
+def ed25519_add(p, q):
+    """Add two points in extended coordinates"""
+    a = (p[1] - p[0]) * (q[1] - q[0]) % ED25519_P
+    b = (p[1] + p[0]) * (q[1] + q[0]) % ED25519_P
+    c = 2 * p[3] * q[3] * ED25519_D % ED25519_P
+    d = 2 * p[2] * q[2] % ED25519_P
+    (e, f, g, h) = (b - a, d - c, d + c, b + a)
+    return (e * f % ED25519_P, g * h % ED25519_P,
+            f * g % ED25519_P, e * h % ED25519_P)
+
+
+def ed25519_mul(scalar, p):
+    q = (0, 1, 1, 0)
+    while scalar > 0:
+        if scalar & 1:
+            q = ed25519_add(q, p)
+        p = ed25519_add(p, p)
+        scalar >>= 1
+    return q
+
+
+def ed25519_decode(encoded):
+    """Decode a point; raises `ValueError` if it is not on the curve"""
+    if len(encoded) != 32:
+        raise ValueError("Ed25519 point must be 32 bytes")
+    y = int.from_bytes(encoded, 'little')
+    sign = y >> 255
+    y &= (1 << 255) - 1
+    if y >= ED25519_P:
+        raise ValueError("Ed25519 point out of range")
+    x2 = ((y * y - 1) * pow(ED25519_D * y * y + 1, ED25519_P - 2, ED25519_P)
+          % ED25519_P)
+    x = pow(x2, (ED25519_P + 3) // 8, ED25519_P)
+    if (x * x - x2) % ED25519_P != 0:
+        x = x * pow(2, (ED25519_P - 1) // 4, ED25519_P) % ED25519_P
+    if (x * x - x2) % ED25519_P != 0 or (x == 0 and sign):
+        raise ValueError("Not an Ed25519 point")
+    if x & 1 != sign:
+        x = ED25519_P - x
+    return (x, y, 1, x * y % ED25519_P)
+
+
+ED25519_B = ed25519_decode((4 * pow(5, ED25519_P - 2, ED25519_P)
+                            % ED25519_P).to_bytes(32, 'little'))
+
+
+def ed25519_verify(public, message, signature):
+    """RFC 8032 Ed25519 signature verification"""
+    try:
+        a = ed25519_decode(public)
+        r = ed25519_decode(signature[:32])
+    except ValueError:
+        return False
+    s = int.from_bytes(signature[32:], 'little')
+    if s >= ED25519_L:
+        return False
+    h = int.from_bytes(hashlib.sha512(signature[:32] + public + message)
+                       .digest(), 'little') % ED25519_L
+    left = ed25519_mul(s, ED25519_B)
+    right = ed25519_add(r, ed25519_mul(h, a))
+    return ((left[0] * right[2] - right[0] * left[2]) % ED25519_P == 0 and
+            (left[1] * right[2] - right[1] * left[2]) % ED25519_P == 0)
+
+
+def openpgp_mpis(data, count):
+    """Read `count` multiprecision integers (as bytes);
+    returns them and the remaining data"""
+    mpis = []
+    for _ in range(count):
+        if len(data) < 2:
+            raise ValueError("Truncated MPI")
+        length = (int.from_bytes(data[:2], 'big') + 7) // 8
+        if len(data) < 2 + length:
+            raise ValueError("Truncated MPI")
+        mpis.append(data[2:2 + length])
+        data = data[2 + length:]
+    return (mpis, data)
+
+
+def parse_public_key(body):
+    """Parse a v4 public (sub)key packet into a dict with `fingerprint`,
+    `keyid`, `algorithm`, and the algorithm-specific `material`
+    (`None` for unsupported algorithms).
+    Raises `NotImplementedError` for other key versions."""
+    if len(body) < 6 or body[0] != 4:
+        raise NotImplementedError("Only v4 keys are supported")
+    fingerprint = hashlib.sha1(b'\x99' + len(body).to_bytes(2, 'big')
+                               + body).hexdigest().upper()
+    algorithm = body[5]
+    material = None
+    if algorithm in (1, 3):  # RSA
+        ((n, e), _) = openpgp_mpis(body[6:], 2)
+        material = (int.from_bytes(n, 'big'), int.from_bytes(e, 'big'))
+    elif algorithm == 22:  # EdDSA (legacy)
+        oidlen = body[6]
+        ((point,), _) = openpgp_mpis(body[7 + oidlen:], 1)
+        if (body[7:7 + oidlen] == ED25519_OID and len(point) == 33
+                and point[0] == 0x40):
+            material = point[1:]
+    return {'fingerprint': fingerprint, 'keyid': fingerprint[-16:],
+            'algorithm': algorithm, 'material': material}
+
+
+def openpgp_subpackets(data):
+    """Split signature subpacket area into a list of `(type, critical, body)`"""
+    subpackets = []
+    pos = 0
+    while pos < len(data):
+        first = data[pos]
+        if first < 192:
+            (length, pos) = (first, pos + 1)
+        elif first < 255:
+            (length, pos) = (((first - 192) << 8) + data[pos + 1] + 192,
+                             pos + 2)
+        else:
+            (length, pos) = (int.from_bytes(data[pos + 1:pos + 5], 'big'),
+                             pos + 5)
+        if length == 0 or pos + length > len(data):
+            raise ValueError("Invalid signature subpacket")
+        subpackets.append((data[pos] & 0x7f, bool(data[pos] & 0x80),
+                           data[pos + 1:pos + length]))
+        pos += length
+    return subpackets
+
+
+class NativeVerifier:
+    """Verify RSA and Ed25519 signatures in-process.
+
+    Timestamper keys are exported from GnuPG once per process and parsed;
+    no `gpg` process is needed for the signatures themselves. Like `gpg`,
+    only the key itself is trusted; the revocation and expiry state of keys
+    is not checked. Other algorithms are handed to `fallback` (another
+    verifier), if given."""
+
+    def __init__(self, gpg, fallback=None):
+        self.gpg = gpg
+        self.fallback = fallback
+        self.keys = {}  # keyid → list of parsed (sub)keys
+        self.lock = threading.Lock()
+
+    def add_key(self, keyid, armored):
+        """Use the exported key `armored` for `keyid` (e.g., from a cache)"""
+        keys = []
+        for (tag, body) in openpgp_packets(dearmor(armored)):
+            if tag in (6, 14):  # Public key and subkey
+                try:
+                    keys.append(parse_public_key(body))
+                except (NotImplementedError, ValueError):
+                    pass
+        with self.lock:
+            self.keys[keyid] = keys
+
+    def load_key(self, keyid):
+        """Parsed primary key and subkeys, or `[]` if unknown"""
+        with self.lock:
+            if keyid in self.keys:
+                return self.keys[keyid]
+        exported = self.gpg.export_keys(keyid)
+        if exported:
+            self.add_key(keyid, exported)
+            return self.keys[keyid]
+        return []
+
+    def has_key(self, keyid):
+        return len(self.load_key(keyid)) > 0
+
+    def verify(self, keyid, signed, signature):
+        try:
+            return self.verify_native(keyid, signed, signature)
+        except NotImplementedError as e:
+            if self.fallback is None:
+                raise TimestampError("Cannot verify signature natively: %s\n"
+                                     "Try `--verifier=auto`" % e)
+            return self.fallback.verify(keyid, signed, signature)
+
+    def verify_native(self, keyid, signed, signature):
+        invalid = Verification(False, None, None, 0)
+        sig = signature_packet(signature)
+        if len(sig) < 6 or sig[0] != 4:
+            raise NotImplementedError("Only v4 signatures are supported")
+        (sigtype, algorithm, hashalg) = (sig[1], sig[2], sig[3])
+        if hashalg not in openpgp_hashes:
+            raise NotImplementedError("Hash algorithm %d not supported"
+                                      % hashalg)
+        hashed_end = 6 + int.from_bytes(sig[4:6], 'big')
+        unhashed_end = hashed_end + 2 + int.from_bytes(
+            sig[hashed_end:hashed_end + 2], 'big')
+        try:
+            hashed = openpgp_subpackets(sig[6:hashed_end])
+            unhashed = openpgp_subpackets(sig[hashed_end + 2:unhashed_end])
+        except (ValueError, IndexError):
+            return invalid
+        if sigtype != 0x00:  # Binary document
+            return invalid
+        created = None
+        issuers = set()
+        for (kind, critical, body) in hashed:
+            if kind == 2 and len(body) == 4:  # Signature creation time
+                created = int.from_bytes(body, 'big')
+            elif kind not in (16, 33) and critical:
+                return invalid  # Unknown critical subpacket
+        for (kind, _, body) in hashed + unhashed:
+            if kind == 16:  # Issuer key ID
+                issuers.add(body.hex().upper())
+            elif kind == 33 and len(body) == 21:  # Issuer fingerprint
+                issuers.add(body[-8:].hex().upper())
+        if created is None:
+            return invalid
+        keys = self.load_key(keyid)
+        candidates = [k for k in keys if k['keyid'] in issuers]
+        if len(candidates) == 0:
+            return invalid
+        key = candidates[0]
+        if key['material'] is None:
+            raise NotImplementedError("Public key algorithm %d not supported"
+                                      % key['algorithm'])
+        (hashname, digestinfo) = openpgp_hashes[hashalg]
+        hasher = hashlib.new(hashname)
+        for piece in signed:
+            hasher.update(piece)
+        hasher.update(sig[:hashed_end] + b'\x04\xff'
+                      + hashed_end.to_bytes(4, 'big'))
+        digest = hasher.digest()
+        if sig[unhashed_end:unhashed_end + 2] != digest[:2]:
+            return invalid
+        try:
+            (mpis, _) = openpgp_mpis(sig[unhashed_end + 2:],
+                                     1 if algorithm in (1, 3) else 2)
+        except ValueError:
+            return invalid
+        if algorithm in (1, 3) and key['algorithm'] in (1, 3):
+            (n, e) = key['material']
+            size = (n.bit_length() + 7) // 8
+            s = int.from_bytes(mpis[0], 'big')
+            if s >= n:
+                return invalid
+            expected = digestinfo + digest
+            padded = (b'\x00\x01' + b'\xff' * (size - len(expected) - 3)
+                      + b'\x00' + expected)
+            valid = pow(s, e, n).to_bytes(size, 'big') == padded
+        elif algorithm == 22 and key['algorithm'] == 22:
+            (r, s) = mpis
+            if len(r) > 32 or len(s) > 32:
+                return invalid
+            valid = ed25519_verify(key['material'], digest,
+                                   r.rjust(32, b'\0') + s.rjust(32, b'\0'))
+        else:
+            return invalid
+        if not valid:
+            return invalid
+        return Verification(True, key['keyid'], keys[0]['fingerprint'], created)
+
+
+def new_gpg(args):
+    """GnuPG for `--gnupg-home`"""
+    try:
+        return gnupg.GPG(gnupghome=args.gnupg_home)
+    except TypeError:
+        traceback.print_exc()
+        sys.exit("*** `git timestamp` needs `python-gnupg`"
+                 " module from PyPI, not `gnupg`\n"
+                 "    Possible remedy: `pip uninstall gnupg;"
+                 " pip install python-gnupg`\n"
+                 "    (try `pip2`/`pip3` if it does not work with `pip`)")
+
+
+def new_verifier(gpg, args):
+    """Verifier backend selected by `--verifier`, using `gpg`"""
+    if args.verifier == 'native':
+        return NativeVerifier(gpg)
+    elif args.verifier == 'auto':
+        return NativeVerifier(gpg, fallback=GnuPGVerifier(gpg))
+    else:
+        return GnuPGVerifier(gpg)
+
+
+def verify_signature_and_timestamp(keyid, signed, signature, args, now=None):
     """Is the signature valid
-    and the signature timestamp within range as well?"""
-    f = tempfile.NamedTemporaryFile(mode='w', delete=False)
-    f.write(signature)
-    f.close()
-    verified = gpg.verify_data(f.name, signed)
+    and the signature timestamp within range as well?
+    `signed` is a tuple of bytes-like pieces, e.g., `memoryview`s of the
+    response around the signature.
+    Verification is done in memory, without temporary files."""
+    verified = args.context.verifier.verify(keyid, signed, signature)
     if not verified.valid:
-        sys.exit("Not a valid OpenPGP signature")
-    os.remove(f.name)
-    if not validate_timestamp(int(verified.sig_timestamp)):
-        sigtime = sig_time()
-        sys.exit("Signature timestamp (%d, %s) too far off now (%d, %s)" %
-                 (verified.sig_timestamp, time_str(verified.sig_timestamp),
-                  sigtime, time_str(sigtime)))
+        raise InvalidSignature("Not a valid OpenPGP signature")
+    if not validate_timestamp(verified.sig_timestamp, now):
+        sigtime = sig_time() if now is None else now
+        raise ClockSkew("Signature timestamp (%d, %s) too far off (%d, %s)" %
+                        (verified.sig_timestamp,
+                         time_str(verified.sig_timestamp),
+                         sigtime, time_str(sigtime)))
     if keyid != verified.key_id and keyid != verified.pubkey_fingerprint:
-        sys.exit("Received signature with key ID %s; but expected %s -- refusing" %
-                 (verified.key_id, keyid))
+        raise InvalidSignature(
+            "Received signature with key ID %s; but expected %s -- refusing"
+            % (verified.key_id, keyid))
 
 
-def validate_tag(text, commit, keyid, name, args):
-    """Check this tag head to toe"""
-    if len(text) > 8000:
-        sys.exit("Returned tag too long (%d > 8000)" % len(text))
-    if not re.match('^[ -~\n]*$', text, re.MULTILINE):
-        sys.exit("Returned tag does not only contain ASCII chars")
-    lead = '''object %s
+def validate_tag(body, commit_id, keyid, name, args, now=None):
+    """Check this tag (`bytes`) head to toe, in a single pass"""
+    check_stamp_text(body, 'tag')
+    lead = ('''object %s
 type commit
 tag %s
-tagger %s ''' % (commit.id, args.tag, name)
-    if not text.startswith(lead):
-        sys.exit("Expected signed tag to start with:\n"
-                 "> %s\n\nInstead, it started with:\n> %s\n"
-                 % (lead.replace('\n', '\n> '), text.replace('\n', '\n> ')))
-    pos = validate_timestamp_zone_eol('tagger', text, len(lead))
-    if text[pos] != '\n':
-        sys.exit("Signed tag has unexpected data after 'tagger' header")
-
-    pgpstart = text.find('\n-----BEGIN PGP SIGNATURE-----\n\n', len(lead))
+tagger %s ''' % (commit_id, args.tag, name)).encode('utf-8')
+    expect_lead(body, lead, 'signed tag')
+    pos = validate_timestamp_zone_eol('tagger', body, len(lead), now)
+    if not body.startswith(b'\n', pos):
+        raise InvalidTimestamp(
+            "Signed tag has unexpected data after 'tagger' header")
+
+    pgpstart = body.find(b'\n-----BEGIN PGP SIGNATURE-----\n\n', pos)
     if pgpstart >= 0:
-        signed = asciibytes(text[:pgpstart + 1])
-        signature = text[pgpstart + 1:]
-        verify_signature_and_timestamp(keyid, signed, signature, args)
+        signed = (memoryview(body)[:pgpstart + 1],)
+        signature = body[pgpstart + 1:].decode('ascii')
+        verify_signature_and_timestamp(keyid, signed, signature, args, now)
     else:
-        sys.exit("No OpenPGP signature found")
+        raise InvalidSignature("No OpenPGP signature found")
 
 
 def quit_if_http_error(server, r):
+    """Raises a `TimestampError` (`ServerUnavailable` for temporary
+    problems) with the HTTP `status` unless `r` is a 200 response"""
+    if r.status_code == 200:
+        return
+    r.close()  # Return a streamed connection to the pool
     if r.status_code == 301:
-        sys.exit("Timestamping server URL changed from %s to %s\n"
-                 "Please change this on the command line(s) or run\n"
-                 "    git config [--global] timestamp.server %s"
-                 % (server, r.headers['Location'], r.headers['Location']))
-    if r.status_code != 200:
-        sys.exit("Timestamping request failed; server responded with %d %s"
-                 % (r.status_code, r.reason))
+        e = TimestampError("Timestamping server URL changed from %s to %s\n"
+                           "Please change this on the command line(s) or"
+                           " run\n"
+                           "    git config [--global] timestamp.server %s"
+                           % (server, r.headers['Location'],
+                              r.headers['Location']))
+    elif r.status_code >= 500 or r.status_code == 429:
+        e = ServerUnavailable(
+            "Timestamping request failed; server responded with %d %s%s"
+            % (r.status_code, r.reason,
+               " (Retry-After: %s)" % r.headers['Retry-After']
+               if 'Retry-After' in r.headers else ""))
+    else:
+        e = TimestampError(
+            "Timestamping request failed; server responded with %d %s"
+            % (r.status_code, r.reason))
+    e.status = r.status_code
+    raise e
+
+
+def new_session(args):
+    """HTTP session shared by all requests of this process, keeping
+    connections to the timestampers alive"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max(10, args.jobs), pool_maxsize=max(10, args.jobs))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = 'git-timestamp/%s %s' % (
+        VERSION, requests.utils.default_user_agent())
+    return session
+
+
+def retry_delay(attempt):
+    """Exponential backoff with full jitter: 0…0.5 s, 0…1 s, 0…2 s, …"""
+    return random.uniform(0, 0.5 * 2 ** attempt)
+
+
+def http_request(method, url, args, **kwargs):
+    """`session.request()` with `--timeout` (possibly reduced, see
+    `ServerStats.timeout()`), retrying `--retries` times on connection
+    errors, timeouts, server errors (5xx) and 429 Too Many Requests (after
+    `Retry-After`, if given), at the rate allowed by `RateLimiter`; the
+    outcome is recorded in the server statistics.
+    Raises `ServerUnavailable` on connection problems and timeouts; HTTP
+    errors are left to the caller."""
+    (session, server_stats, rate_limiter) = (
+        args.context.session, args.context.server_stats,
+        args.context.rate_limiter)
+    keyname = server_keyname(url)
+    kwargs.setdefault('allow_redirects', False)
+    timeout = kwargs.pop('timeout', None)
+    attempt = 0
+    while True:
+        rate_limiter.acquire(url)
+        start = time.time()
+        delay = None
+        try:
+            # Retries get the full `--timeout`
+            r = session.request(method, url, timeout=timeout or (
+                server_stats.timeout(keyname, args.timeout) if attempt == 0
+                else args.timeout), **kwargs)
+            if r.status_code < 500 and r.status_code != 429:
+                server_stats.record(keyname, time.time() - start)
+                return r
+            delay = retry_after(r)
+            if delay is not None:
+                # Also holds back other processes
+                rate_limiter.pause(url, delay)
+            if (attempt >= args.retries or (
+                    delay is not None
+                    and delay > RateLimiter.MAX_RETRY_AFTER)):
+                server_stats.record(keyname)
+                return r
+            r.close()
+        except requests.exceptions.Timeout as e:
+            if attempt >= args.retries:
+                server_stats.record(keyname)
+                raise ServerUnavailable("Timeout talking to server: %s" % e)
+        except requests.exceptions.ConnectionError as e:
+            if attempt >= args.retries:
+                server_stats.record(keyname)
+                raise ServerUnavailable("Cannot connect to server: %s" % e)
+        if delay is None:
+            time.sleep(retry_delay(attempt))
+        elif not rate_limiter.enabled:
+            # Otherwise, `rate_limiter.acquire()` waits
+            time.sleep(delay)
+        attempt += 1
+
+
+def read_limited(r, what):
+    """Body of the streamed response `r` as `bytes`; raises
+    `InvalidTimestamp` as soon as it exceeds `MAX_STAMP_SIZE`, without
+    downloading the rest, and `ServerUnavailable` if reading fails"""
+    try:
+        length = r.headers.get('Content-Length')
+        if length is not None and length.isdigit() \
+                and int(length) > MAX_STAMP_SIZE:
+            raise InvalidTimestamp("Returned %s too long (%s > %d)"
+                                   % (what, length, MAX_STAMP_SIZE))
+        chunks = []
+        size = 0
+        for chunk in r.iter_content(chunk_size=MAX_STAMP_SIZE + 1):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > MAX_STAMP_SIZE:
+                raise InvalidTimestamp("Returned %s too long (> %d)"
+                                       % (what, MAX_STAMP_SIZE))
+        return b''.join(chunks)
+    except requests.exceptions.RequestException as e:
+        raise ServerUnavailable("Cannot read response from server: %s" % e)
+    finally:
+        r.close()
 
 
 def timestamp_tag(repo, keyid, name, args):
-    """Obtain and add a signed tag"""
+    """Obtain and add a signed tag; returns a `StampResult`"""
     try:
         commit = repo.revparse_single(args.commit)
     except KeyError as e:
@@ -473,55 +2139,67 @@ def timestamp_tag(repo, keyid, name, args):
         sys.exit("Tag '%s' already in use" % args.tag)
     except KeyError:
         pass
-    try:
-        r = requests.post(args.server,
-                          data={
-                              'request': 'stamp-tag-v1',
-                              'commit': commit.id,
-                              'tagname': args.tag
-                          }, allow_redirects=False)
-        quit_if_http_error(args.server, r)
-        validate_tag(r.text, commit, keyid, name, args)
-        tagid = repo.write(
-            git.GIT_OBJECT_TAG,
-            r.text)
-        repo.create_reference('refs/tags/%s' % args.tag, tagid)
-    except requests.exceptions.ConnectionError as e:
-        sys.exit("Cannot connect to server: %s" % e)
-
-
-def validate_branch(text, keyid, name, data, args):
-    """Check this branch commit head to toe"""
-    if len(text) > 8000:
-        sys.exit("Returned branch commit too long (%d > 8000)" % len(text))
-    if not re.match('^[ -~\n]*$', text, re.MULTILINE):
-        sys.exit("Returned branch commit does not only contain ASCII chars")
+    with metrics.stamp(args.server):
+        with timings.phase('http', args.server, repo):
+            start = time.time()
+            r = http_request('POST', args.server, args,
+                             data={
+                                 'request': 'stamp-tag-v1',
+                                 'commit': commit.id,
+                                 'tagname': args.tag
+                             }, stream=True)
+            quit_if_http_error(args.server, r)
+            body = read_limited(r, 'tag')
+            seconds = time.time() - start
+        with timings.phase('verify', args.server, repo):
+            validate_tag(body, commit.id, keyid, name, args)
+        # Only valid timestamps count as requests served
+        metrics.observe(args.server, seconds)
+        with timings.phase('write', args.server, repo):
+            tagid = repo.write(
+                git.GIT_OBJECT_TAG,
+                body)
+            repo.create_reference('refs/tags/%s' % args.tag, tagid)
+            text = body.decode('ascii')
+            record_stamp(repo, commit.id, tagid, text, 'tagger', args,
+                         'refs/tags/' + args.tag)
+    return StampResult(args.server, 'refs/tags/' + args.tag, str(commit.id),
+                       str(tagid), header_name_time(text, 'tagger')[1])
+
+
+def validate_branch(body, keyid, name, data, args, now=None):
+    """Check this branch commit (`bytes`) head to toe, in a single pass"""
+    check_stamp_text(body, 'branch commit')
     lead = 'tree %s\n' % data['tree']
     if 'parent' in data:
         lead += 'parent %s\n' % data['parent']
     lead += '''parent %s
 author %s ''' % (data['commit'], name)
-    if not text.startswith(lead):
-        sys.exit("Expected signed branch commit to start with:\n"
-                 "> %s\n\nInstead, it started with:\n> %s\n"
-                 % (lead.replace('\n', '\n> '), text.replace('\n', '\n> ')))
-    pos = validate_timestamp_zone_eol('tagger', text, len(lead))
-    follow = 'committer %s ' % name
-    if not text[pos:].startswith(follow):
-        sys.exit("Committer in signed branch commit does not match")
-    pos = validate_timestamp_zone_eol('committer', text, pos + len(follow))
-    if not text[pos:].startswith('gpgsig '):
-        sys.exit("Signed branch commit missing 'gpgsig' after 'committer'")
-    sig = re.match('^-----BEGIN PGP SIGNATURE-----\n \n'
-                   '[ -~\n]+\n -----END PGP SIGNATURE-----\n\n',
-                   text[pos + 7:], re.MULTILINE)
-    if not sig:
-        sys.exit("Incorrect OpenPGP signature in signed branch commit")
-    signature = sig.group()
-    # Everything except the signature
-    signed = asciibytes(text[:pos] + text[pos + 7 + sig.end() - 1:])
-    signature = signature.replace('\n ', '\n')
-    verify_signature_and_timestamp(keyid, signed, signature, args)
+    lead = lead.encode('utf-8')
+    expect_lead(body, lead, 'signed branch commit')
+    pos = validate_timestamp_zone_eol('tagger', body, len(lead), now)
+    follow = ('committer %s ' % name).encode('utf-8')
+    if not body.startswith(follow, pos):
+        raise InvalidTimestamp(
+            "Committer in signed branch commit does not match")
+    pos = validate_timestamp_zone_eol('committer', body, pos + len(follow),
+                                      now)
+    if not body.startswith(b'gpgsig ', pos):
+        raise InvalidTimestamp(
+            "Signed branch commit missing 'gpgsig' after 'committer'")
+    sigstart = pos + 7
+    # The header ends with the first line not continued by a space
+    sigend = body.find(b'\n -----END PGP SIGNATURE-----\n\n', sigstart)
+    if (sigend < 0 or not body.startswith(
+            b'-----BEGIN PGP SIGNATURE-----\n \n', sigstart)):
+        raise InvalidSignature(
+            "Incorrect OpenPGP signature in signed branch commit")
+    sigend += len(b'\n -----END PGP SIGNATURE-----\n')
+    # Everything except the signature, without copying the payload
+    view = memoryview(body)
+    signed = (view[:pos], view[sigend:])
+    signature = body[sigstart:sigend].replace(b'\n ', b'\n').decode('ascii')
+    verify_signature_and_timestamp(keyid, signed, signature, args, now)
 
 
 def valid_name(name):
@@ -579,83 +2257,1804 @@ def append_branch_name(repo, commit_name, branch_name, default_branches):
                       "source branch %s)\n" + explanation)
                      % (extended_name, branch_name, comname))
 
-def timestamp_branch(repo, keyid, name, args, first):
-    """Obtain and add branch commit; create/update branch head"""
+class IntervalSequencer:
+    """Keep the `--interval` spacing between stamp requests to multiple
+    timestampers, even when they are contacted concurrently.
+
+    Only the stamp requests themselves are ordered: Request `index` is sent
+    after request `index - 1` has completed (successfully or not) and, if any
+    earlier request succeeded, `interval` after the last successful one.
+    Without an interval, no ordering is needed and nobody waits."""
+
+    def __init__(self, count, interval):
+        self.interval = interval.total_seconds()
+        self.finished = [threading.Event() for _ in range(count)]
+        self.last_success = None
+
+    def wait_turn(self, index):
+        if self.interval <= 0:
+            return
+        if index > 0:
+            self.finished[index - 1].wait()
+        if self.last_success is not None:
+            delay = self.last_success + self.interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def done(self, index, success):
+        """Mark request `index` as complete; may be called repeatedly,
+        only the first call counts"""
+        if self.finished[index].is_set():
+            return
+        if success:
+            self.last_success = time.time()
+        self.finished[index].set()
+
+
+def timestamp_branch(repo, keyid, name, args, sequencer=None, index=0):
+    """Obtain and add branch commit; create/update branch head.
+    Returns a `StampResult`"""
     # If the base name is already invalid, it cannot become valid by appending
     if not valid_name(args.branch):
         sys.exit("Branch name %s is not valid for timestamping" %
                  args.branch)
-    if args.append_branch_name:
-        args.branch = append_branch_name(repo, args.commit, args.branch, args.default_branch)
+    with repo_lock(repo):
+        if args.append_branch_name:
+            args.branch = append_branch_name(repo, args.commit, args.branch, args.default_branch)
+        try:
+            commit = repo.revparse_single(args.commit)
+        except KeyError as e:
+            sys.exit("No such revision: '%s'" % (e,))
+        branch_head = None
+        reason = None
+        data = {
+            'request': 'stamp-branch-v1',
+            'commit': commit.id,
+            'tree': commit.tree.id
+        }
+        try:
+            branch_head = repo.lookup_reference('refs/heads/' + args.branch)
+            if branch_head.target == commit.id:
+                # Would create a merge commit with the same parent twice
+                sys.exit("Cannot timestamp head of timestamp branch to itself")
+            data['parent'] = branch_head.target
+            try:
+                if (repo[branch_head.target].parent_ids[0] == commit.id or
+                        repo[branch_head.target].parent_ids[1] == commit.id):
+                    reason = ("Already timestamped commit %s to branch %s"
+                              % (commit.id, args.branch))
+            except IndexError:
+                pass
+        except KeyError:
+            pass
+        # Also catch older stamps and, depending on `--skip`, other branches
+        if reason is None:
+            reason = already_covered(repo, commit.id,
+                                     server_keyname(args.server),
+                                     'refs/heads/' + args.branch, args.skip)
+        if reason is not None:
+            metrics.failure(args.server, 'already_timestamped')
+            raise AlreadyTimestamped(reason)
+    if sequencer is not None:
+        sequencer.wait_turn(index)
+    written = False
     try:
-        commit = repo.revparse_single(args.commit)
-    except KeyError as e:
-        sys.exit("No such revision: '%s'" % (e,))
-    branch_head = None
-    data = {
-        'request': 'stamp-branch-v1',
-        'commit': commit.id,
-        'tree': commit.tree.id
-    }
+        with metrics.stamp(args.server):
+            with timings.phase('http', args.server, repo):
+                start = time.time()
+                r = http_request('POST', args.server, args, data=data,
+                                 stream=True)
+                quit_if_http_error(args.server, r)
+                body = read_limited(r, 'branch commit')
+                seconds = time.time() - start
+            with timings.phase('verify', args.server, repo):
+                validate_branch(body, keyid, name, data, args)
+            # Only valid timestamps count as requests served
+            metrics.observe(args.server, seconds)
+            with timings.phase('write', args.server, repo), repo_lock(repo):
+                if args.abandon is not None and args.abandon.is_set():
+                    sys.exit("%s: Timestamp arrived after reaching the quorum,"
+                             " not written" % args.server)
+                commitid = repo.write(
+                    git.GIT_OBJECT_COMMIT,
+                    body)
+                repo.create_reference('refs/heads/' + args.branch,
+                                      commitid, force=True)
+                text = body.decode('ascii')
+                record_stamp(repo, commit.id, commitid, text, 'author', args,
+                             'refs/heads/' + args.branch)
+        written = True
+    finally:
+        # Only timestamps written count for `--interval`
+        if sequencer is not None:
+            sequencer.done(index, written)
+    return StampResult(args.server, 'refs/heads/' + args.branch,
+                       str(commit.id), str(commitid),
+                       header_name_time(text, 'author')[1])
+
+
+def server_url(server):
+    """Expand aliases and add the default scheme"""
+    if server in server_aliases:
+        server = server_aliases[server]
+    if ':' not in server:
+        server = 'https://' + server
+    return server
+
+
+def server_branch_name(server, args):
+    """The automatic timestamp branch name for `server`, before appending
+    the branch name"""
+    fields = server.replace('/', '.').split('.')
+    branch = timestamp_branch_name(fields[1:])
+    if args.aggregate:
+        branch = aggregate_branch_name(branch)
+    return branch
+
+
+def timestamp_server(repo, server, args, sequencer, index):
+    """Timestamp to the automatic branch of one of multiple servers, unless
+    its circuit is open (see `ServerStats`). If the server is unavailable,
+    the request is spooled for `--flush`. Returns a `StampResult`.
+    Works on a copy of `args`, so it can run concurrently with others."""
+    args = copy.copy(args)
+    try:
+        args.branch = server_branch_name(server, args)
+        args.server = server
+        # Resolve now, so the target is known for spooling
+        with repo_lock(repo):
+            if args.append_branch_name:
+                args.branch = append_branch_name(repo, args.commit,
+                                                 args.branch,
+                                                 args.default_branch)
+                args.append_branch_name = False
+            try:
+                args.commit = str(repo.revparse_single(args.commit).id)
+            except KeyError as e:
+                sys.exit("No such revision: '%s'" % (e,))
+        try:
+            return stamp_server_branch(repo, args, sequencer, index)
+        except ServerUnavailable as e:
+            if not args.spool:
+                raise
+            with StampIndex(repo) as stamp_index:
+                stamp_index.spool(server, args.branch, args.commit)
+            raise ServerUnavailable("%s\n(Spooled for `git timestamp --flush`)"
+                                    % e)
+    finally:
+        # Do not block the followers if we failed before our turn
+        sequencer.done(index, False)
+
+
+def stamp_server_branch(repo, args, sequencer, index):
+    """Timestamp `args.commit` to `args.branch` on `args.server`, unless its
+    circuit is open; drop spooled requests this covers. Returns a
+    `StampResult`"""
+    server_stats = args.context.server_stats
+    until = server_stats.open_until(server_keyname(args.server))
+    if until is not None:
+        metrics.failure(args.server, 'circuit_open')
+        raise ServerUnavailable(
+            "%s: Skipped after %d failures in a row, until %s"
+            " (see `--server-stats`)" % (
+                args.server,
+                server_stats.get(server_keyname(args.server))[
+                    'consecutive_failures'],
+                time_str(until)))
+    (keyid, name) = get_keyid(args)
+    stamp = timestamp_branch(repo, keyid, name, args, sequencer, index)
+    with StampIndex(repo) as stamp_index:
+        stamp_index.unspool(repo, args.server, args.branch, args.commit)
+    return stamp
+
+
+def timestamp_servers(repo, args, jobs, stamps=None):
+    """Timestamp `repo` to the automatic branches of all servers in
+    `args.server`, up to `jobs` of them concurrently, healthiest first (in
+    the configured order with `--interval`).
+    Returns one error (`SystemExit` or `TimestampError`) per server, in
+    server order (`None` = success).
+    The `StampResult`s are added to the dict `stamps`, by server index.
+
+    With `--quorum`, returns once that many servers have timestamped the
+    commit (now or before) and `--quorum-grace` has passed. Servers not done
+    by then are abandoned: they are reported as failed and their timestamps,
+    should they still arrive, are not written."""
+    servers = [server_url(s) for s in args.server.split(',')]
+    sequencer = IntervalSequencer(len(servers), args.interval)
+    args = copy.copy(args)
+    args.abandon = threading.Event()
+    done = threading.Condition()
+    results = {}
+    if args.interval.total_seconds() > 0:
+        # The configured order is the order of the timestamps
+        order = collections.deque(range(len(servers)))
+    else:
+        # Healthy, fast servers first
+        order = collections.deque(sorted(
+            range(len(servers)),
+            key=lambda i: args.context.server_stats.rank(
+                server_keyname(servers[i]))))
+    turns = {i: turn for (turn, i) in enumerate(order)}
+
+    def run():
+        while True:
+            with done:
+                if len(order) == 0:
+                    return
+                index = order.popleft()
+            server = servers[index]
+            try:
+                if args.abandon.is_set():
+                    raise SystemExit("%s: Not contacted, quorum reached"
+                                     % server)
+                stamp = timestamp_server(repo, server, args, sequencer,
+                                         turns[index])
+                result = None
+            except BaseException as e:  # Reported by the main thread
+                result = e
+            with done:
+                results[index] = result
+                if result is None and stamps is not None:
+                    stamps[index] = stamp
+                done.notify_all()
+
+    # Daemon threads, so abandoned servers do not delay exiting
+    for _ in range(max(1, min(jobs, len(servers)))):
+        threading.Thread(target=run, daemon=True).start()
+    quorum = args.quorum or len(servers)
+    deadline = None
+    with done:
+        while len(results) < len(servers):
+            if stamped_count(results.values()) >= quorum:
+                if deadline is None:
+                    deadline = time.time() + args.quorum_grace
+                if deadline <= time.time():
+                    break
+                done.wait(deadline - time.time())
+            else:
+                done.wait()
+        args.abandon.set()
+    with repo_lock(repo):
+        # Now, no abandoned timestamp is being written
+        with done:
+            results = [results.get(i, SystemExit(
+                "%s: Abandoned, quorum reached" % server))
+                for (i, server) in enumerate(servers)]
+    for e in results:
+        if e is not None and not isinstance(e, (SystemExit, TimestampError)):
+            raise e
+    return results
+
+
+def stamped_count(results):
+    """Number of `timestamp_servers()` results which mean the commit has
+    been timestamped, now or before"""
+    return sum(1 for e in results
+               if e is None or isinstance(e, AlreadyTimestamped))
+
+
+def quorum_reached(results, quorum):
+    """Whether `timestamp_servers()` succeeded: for every server or, with
+    `quorum`, for at least that many (counting earlier timestamps)"""
+    if quorum is None:
+        return all(e is None for e in results)
+    return stamped_count(results) >= quorum
+
+
+def fleet_paths(args):
+    """Repository paths from `--repos` and `--repo-glob`, in order"""
+    paths = []
+    if args.repos == '-':
+        paths.extend(sys.stdin.read().splitlines())
+    elif args.repos is not None:
+        with open(args.repos, 'r') as fh:
+            paths.extend(fh.read().splitlines())
+    if args.repo_glob is not None:
+        paths.extend(sorted(glob.glob(args.repo_glob, recursive=True)))
+    return [p.strip() for p in paths
+            if p.strip() != '' and not p.startswith('#')]
+
+
+def timestamp_fleet_repo(path, args):
+    """Timestamp a single repository of the fleet.
+    Returns (status, seconds, messages)"""
+    start = time.time()
     try:
-        branch_head = repo.lookup_reference('refs/heads/' + args.branch)
-        if branch_head.target == commit.id:
-            # Would create a merge commit with the same parent twice
-            sys.exit("Cannot timestamp head of timestamp branch to itself")
-        data['parent'] = branch_head.target
+        fleet_repo = git.Repository(path)
+    except (KeyError, git.GitError) as e:  # pylint: disable=maybe-no-member
+        return ('failed', time.time() - start, ["Not a git repository: %s" % e])
+    (status, errors) = stamp_status(timestamp_servers(fleet_repo, args, 1),
+                                    args.quorum)
+    return (status, time.time() - start, errors)
+
+
+def stamp_status(results, quorum=None):
+    """Summarize the results of `timestamp_servers()` as `(status, errors)`,
+    with status 'stamped', 'already stamped' or 'failed' (below `quorum`)"""
+    errors = [str(e) for e in results
+              if e is not None and not isinstance(e, AlreadyTimestamped)]
+    if (len(errors) > 0 if quorum is None
+            else not quorum_reached(results, quorum)):
+        return ('failed', errors)
+    elif None in results:
+        return ('stamped', errors)
+    else:
+        return ('already stamped', errors)
+
+
+def report_stamps(names, futures, args):
+    """Print a line per `(status, seconds, errors)` result of `futures` and
+    a summary; exit according to `--fail-on`"""
+    counts = {'stamped': 0, 'already stamped': 0, 'failed': 0}
+    for (name, f) in zip(names, futures):
+        (status, seconds, errors) = f.result()
+        counts[status] += 1
+        if status == 'failed' or not args.quiet:
+            print("%-15s %7.2fs  %s" % (status, seconds, name))
+        for e in errors:
+            sys.stderr.write("    %s\n" % e.replace('\n', '\n    '))
+    if not args.quiet:
+        print("%d stamped, %d already stamped, %d failed" %
+              (counts['stamped'], counts['already stamped'], counts['failed']))
+    if ((args.fail_on == 'any' and counts['failed'] > 0)
+            or (args.fail_on == 'all' and counts['failed'] == len(names))):
+        sys.exit(1)
+
+
+def prefetch_keys(args):
+    """Look up the keys of all servers in `args.server`. Failures will be
+    reported when timestamping."""
+    for server in args.server.split(','):
+        key_args = copy.copy(args)
+        key_args.server = server_url(server)
         try:
-            if (repo[branch_head.target].parent_ids[0] == commit.id or
-                    repo[branch_head.target].parent_ids[1] == commit.id):
-                sys.exit("Already timestamped commit %s to branch %s" %
-                         (commit.id, args.branch))
-        except IndexError:
+            get_keyid(key_args)
+        except (SystemExit, TimestampError):
             pass
-    except KeyError:
+
+
+def timestamp_fleet(args):
+    """Timestamp many repositories in one process; print a result table"""
+    paths = fleet_paths(args)
+    if len(paths) == 0:
+        sys.exit("No repositories to timestamp")
+    # Look up the keys once, not once per repository
+    prefetch_keys(args)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, args.jobs)) as pool:
+        futures = [pool.submit(timestamp_fleet_repo, path, args)
+                   for path in paths]
+        report_stamps(paths, futures, args)
+
+
+def aggregate_branch_name(branch):
+    """'gitta-timestamps' → 'gitta-aggregate-timestamps'"""
+    return branch[:-len('-timestamps')] + '-aggregate-timestamps'
+
+
+def aggregate_heads(repo):
+    """`(refname, id)` of all branches except timestamp branches"""
+    return [(refname, repo.lookup_reference(refname).target)
+            for refname in sorted(repo.references)
+            if refname.startswith('refs/heads/')
+            and '-timestamps' not in refname]
+
+
+def build_tree(repo, entries):
+    """Write nested trees for `{path: (id, filemode)}`, return the tree id"""
+    builder = repo.TreeBuilder()
+    subtrees = {}
+    for (path, (oid, mode)) in entries.items():
+        (first, _, rest) = path.partition('/')
+        if rest:
+            subtrees.setdefault(first, {})[rest] = (oid, mode)
+        else:
+            builder.insert(first, oid, mode)
+    for (name, subentries) in subtrees.items():
+        builder.insert(name, build_tree(repo, subentries),
+                       git.GIT_FILEMODE_TREE)
+    return builder.write()
+
+
+def write_aggregate(repo, members):
+    """Write an aggregate commit into `repo`, whose tree has a gitlink for
+    each branch head of the `(label, repository)` `members`, at
+    `<label>/refs/heads/<branch>`. Identical heads give an identical commit,
+    so an unchanged aggregate is recognized as already timestamped."""
+    entries = {}
+    for (label, member) in members:
+        for (refname, oid) in aggregate_heads(member):
+            path = refname if label == '' else label + '/' + refname
+            entries[path] = (oid, git.GIT_FILEMODE_COMMIT)
+    if len(entries) == 0:
+        sys.exit("No branches to aggregate")
+    tree = build_tree(repo, entries)
+    signature = git.Signature('git timestamp', 'git-timestamp@localhost', 0, 0)
+    message = "Aggregate of %d branch heads\n\n%s\n" % (
+        len(entries),
+        '\n'.join("%s %s" % (entries[path][0], path)
+                  for path in sorted(entries)))
+    return repo.create_commit(None, signature, signature, message, tree, [])
+
+
+def copy_objects(src, dst, oid):
+    """Copy commit `oid` with its trees and ancestors from repository `src`
+    to `dst`, as far as they are missing there (gitlinks are not followed)"""
+    pending = [oid]
+    while pending:
+        oid = pending.pop()
+        if oid in dst:
+            continue
+        obj = src[oid]
+        if obj.type == git.GIT_OBJECT_COMMIT:
+            pending.append(obj.tree_id)
+            pending.extend(obj.parent_ids)
+        elif obj.type == git.GIT_OBJECT_TREE:
+            pending.extend(entry.id for entry in obj
+                           if entry.filemode != git.GIT_FILEMODE_COMMIT)
+        dst.odb.write(obj.type, obj.read_raw())
+
+
+def timestamp_aggregate(repo, members, args):
+    """`--aggregate`: Timestamp all branch heads of the `(label, repository)`
+    `members` with one request per server; write the proof refs"""
+    aggregate = write_aggregate(repo, members)
+    args = copy.copy(args)
+    args.commit = str(aggregate)
+    args.append_branch_name = False
+    # The proof refs can only be written while the members are at hand
+    args.spool = False
+    servers = [server_url(s) for s in args.server.split(',')]
+    results = timestamp_servers(repo, args, args.jobs)
+    failed = False
+    for (server, e) in zip(servers, results):
+        fields = server.replace('/', '.').split('.')
+        branch = aggregate_branch_name(timestamp_branch_name(fields[1:]))
+        if e is not None and not isinstance(e, AlreadyTimestamped):
+            failed = True
+            print("%-15s %s" % ('failed', server))
+            sys.stderr.write("    %s\n" % str(e).replace('\n', '\n    '))
+            continue
+        stamp = repo.lookup_reference('refs/heads/' + branch).target
+        for (label, member) in members:
+            if member.path != repo.path:
+                copy_objects(repo, member, stamp)
+            for (refname, _) in aggregate_heads(member):
+                member.references.create(
+                    'refs/timestamp-proofs/%s/%s'
+                    % (branch, refname[len('refs/'):]), stamp, force=True)
+        if not args.quiet:
+            print("%-15s %s %s" % ('stamped' if e is None
+                                   else 'already stamped', branch, stamp))
+    if (failed if args.quorum is None
+            else not quorum_reached(results, args.quorum)):
+        sys.exit(1)
+
+
+def flush_spooled(repo, server, branch, source, args):
+    """Send one spooled request. Returns (status, seconds, messages);
+    the request stays spooled only while the server is unavailable."""
+    start = time.time()
+    args = copy.copy(args)
+    args.server = server
+    args.branch = branch
+    args.commit = source
+    args.append_branch_name = False
+    try:
+        stamp_server_branch(repo, args, IntervalSequencer(1, args.interval), 0)
+        return ('stamped', time.time() - start, [])
+    except AlreadyTimestamped:
+        status = 'already stamped'
+        errors = []
+    except ServerUnavailable as e:
+        return ('failed', time.time() - start, [str(e)])
+    except (SystemExit, TimestampError) as e:
+        status = 'failed'
+        errors = ["%s\n(Dropped from the spool)" % e]
+    with StampIndex(repo) as stamp_index:
+        stamp_index.unspool(repo, server, branch, source)
+    return (status, time.time() - start, errors)
+
+
+def flush_spool(repos, args):
+    """`--flush`: Send the spooled requests of all `(label, repository)`
+    `repos`, up to `--jobs` at a time"""
+    spooled = []
+    for (label, repo) in repos:
+        with StampIndex(repo) as stamp_index:
+            spooled.extend((label, repo) + tuple(entry)
+                           for entry in stamp_index.spooled())
+    if len(spooled) == 0:
+        if not args.quiet:
+            print("Nothing spooled")
+        return
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, args.jobs)) as pool:
+        futures = [pool.submit(flush_spooled, repo, server, branch, source,
+                               args)
+                   for (_, repo, server, branch, source, _) in spooled]
+        report_stamps([("%s %s %s %s" % (label, branch, source[:12], server))
+                       .strip()
+                       for (label, _, server, branch, source, _) in spooled],
+                      futures, args)
+
+
+def read_stdin_refs(stream):
+    """Branches updated according to `<old> <new> <ref>` lines as passed to
+    a `post-receive` hook; without deletions, other refs, timestamp branches
+    and duplicates"""
+    branches = []
+    for line in stream:
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        (_, new, ref) = fields
+        if (not ref.startswith('refs/heads/') or '-timestamps' in ref
+                or re.match('^0+$', new)):
+            continue
+        branch = ref[len('refs/heads/'):]
+        if branch not in branches:
+            branches.append(branch)
+    return branches
+
+
+def timestamp_ref(repo, branch, args):
+    """Timestamp the head of `branch` to its automatic branches.
+    Returns (status, seconds, messages)"""
+    start = time.time()
+    args = copy.copy(args)
+    args.commit = branch
+    (status, errors) = stamp_status(timestamp_servers(repo, args, 1),
+                                    args.quorum)
+    return (status, time.time() - start, errors)
+
+
+def timestamp_stdin_refs(repo, args):
+    """`--stdin-refs`: Timestamp all branches updated by a push"""
+    branches = read_stdin_refs(sys.stdin)
+    if len(branches) == 0:
+        return
+    prefetch_keys(args)
+    # Without appending, all would go to the same timestamp branch
+    jobs = max(1, args.jobs) if args.append_branch_name else 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(timestamp_ref, repo, branch, args)
+                   for branch in branches]
+        report_stamps(branches, futures, args)
+
+
+def local_branches(repo, include, exclude):
+    """`(branch, id)` of all local branches matching one of the `include`
+    and none of the `exclude` glob patterns; except timestamp branches"""
+    branches = []
+    # Names and targets of the local branches in one pass, no lookups
+    for ref in repo.references.iterator(git.enums.ReferenceFilter.BRANCHES):
+        branch = ref.shorthand
+        if ('-timestamps' not in branch
+                and any(fnmatch.fnmatchcase(branch, g) for g in include)
+                and not any(fnmatch.fnmatchcase(branch, g) for g in exclude)):
+            branches.append((branch, ref.target))
+    return sorted(branches)
+
+
+def head_stamped(repo, branch, head, servers, args):
+    """Whether `head` of `branch` has already been timestamped to its
+    automatic branches on all `servers`, according to the timestamp index"""
+    for server in servers:
+        target = server_branch_name(server, args)
+        if args.append_branch_name and branch not in args.default_branch:
+            target = "%s-%s" % (target, branch)
+        if already_covered(repo, head, server_keyname(server),
+                           'refs/heads/' + target, args.skip) is None:
+            return False
+    return True
+
+
+def timestamp_all_branches(repo, args):
+    """`--all-branches`: Timestamp the heads of all local branches not
+    timestamped yet"""
+    branches = local_branches(repo, args.include_branches,
+                              args.exclude_branches)
+    if len(branches) == 0:
+        sys.exit("No branches to timestamp")
+    servers = [server_url(s) for s in args.server.split(',')]
+    with StampIndex(repo) as index:
+        index_stamps(repo, index, known_timestampers(repo.config))
+    prefetch_keys(args)
+    # Without appending, all would go to the same timestamp branch
+    jobs = max(1, args.jobs) if args.append_branch_name else 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for (branch, head) in branches:
+            if head_stamped(repo, branch, head, servers, args):
+                # Known from the index, no need to resolve anything again
+                f = concurrent.futures.Future()
+                f.set_result(('already stamped', 0, []))
+            else:
+                f = pool.submit(timestamp_ref, repo, branch, args)
+            futures.append(f)
+        report_stamps([branch for (branch, _) in branches], futures, args)
+
+
+def load_worker(path, keyid, name, args, next_slot, results):
+    """`--load`: Timestamp new commits in a synthetic repository at `path`
+    at the times given by `next_slot()`, until it returns `None`. Appends
+    `(outcome, seconds)` per request to `results`."""
+    repo = git.init_repository(path, bare=True)
+    tree = repo.TreeBuilder().write()
+    author = git.Signature('git timestamp --load', 'load@localhost')
+    parents = []
+    while True:
+        slot = next_slot()
+        if slot is None:
+            return
+        if slot > time.time():
+            time.sleep(slot - time.time())
+        commit = repo.create_commit(None, author, author,
+                                    "Load %f\n" % time.time(), tree, parents)
+        parents = [commit]
+        stamp_args = copy.copy(args)
+        stamp_args.commit = str(commit)
+        start = time.time()
+        try:
+            timestamp_branch(repo, keyid, name, stamp_args)
+            outcome = 'ok'
+        except ClockSkew:
+            outcome = 'clock skew'
+        except InvalidTimestamp:
+            outcome = 'invalid'
+        except ServerUnavailable:
+            outcome = 'unavailable'
+        except (SystemExit, TimestampError):
+            outcome = 'failed'
+        results.append((outcome, time.time() - start))
+
+
+def run_load(args):
+    """`--load N`: Drive N synthetic repositories against the server at
+    `--load-rate` for `--load-duration`; print a report"""
+    args = copy.copy(args)
+    args.server = server_url(args.server.split(',')[0])
+    args.branch = 'load-timestamps'
+    args.append_branch_name = False
+    (keyid, name) = get_keyid(args)
+    lock = threading.Lock()
+    schedule = {'sent': 0}
+    results = []
+
+    def next_slot():
+        with lock:
+            if args.load_rate:
+                slot = schedule['start'] + schedule['sent'] / args.load_rate
+            else:
+                slot = time.time()
+            if slot >= schedule['start'] + args.load_duration:
+                return None
+            schedule['sent'] += 1
+            return slot
+
+    with tempfile.TemporaryDirectory(prefix='git-timestamp-load-') as tmp:
+        workers = [threading.Thread(target=load_worker,
+                                    args=(os.path.join(tmp, str(i)), keyid,
+                                          name, args, next_slot, results))
+                   for i in range(args.load)]
+        schedule['start'] = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - schedule['start']
+    print_load_report(results, elapsed, args)
+
+
+def print_load_report(results, elapsed, args):
+    """Summary of the `(outcome, seconds)` `results` of `--load`;
+    exits according to `--fail-on`"""
+    print("Load on %s: %d repositories, %s, %.1fs" % (
+        args.server, args.load,
+        "%.1f/s target" % args.load_rate if args.load_rate else "unlimited",
+        elapsed))
+    print("  %-12s %6d (%.1f/s)" % ('requests', len(results),
+                                    len(results) / elapsed))
+    counts = collections.Counter(outcome for (outcome, _) in results)
+    for outcome in ('ok', 'invalid', 'clock skew', 'unavailable', 'failed'):
+        print("  %-12s %6d" % (outcome, counts[outcome]))
+    latencies = {'latencies': [seconds for (outcome, seconds) in results
+                               if outcome == 'ok']}
+    if len(latencies['latencies']) > 0:
+        print("  %-12s p50 %.0fms, p95 %.0fms, p99 %.0fms, max %.0fms" % (
+            'latency', ServerStats.percentile(latencies, 50) * 1000,
+            ServerStats.percentile(latencies, 95) * 1000,
+            ServerStats.percentile(latencies, 99) * 1000,
+            max(latencies['latencies']) * 1000))
+    failed = len(results) - counts['ok']
+    if ((args.fail_on == 'any' and failed > 0)
+            or (args.fail_on == 'all' and counts['ok'] == 0)):
+        sys.exit(1)
+
+
+class CoalescingQueue:
+    """Pending `--daemon` requests by `(gitdir, commit)`. A target becomes
+    due `window` seconds after its first request; all requests until then
+    are served by a single timestamp. A target is never handed out again
+    while it is still being timestamped."""
+
+    def __init__(self, window):
+        self.window = window
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.active = set()
+        self.closing = False
+
+    def add(self, target):
+        """Queue `target`; returns the number of requests now pending for it"""
+        with self.cond:
+            (due, count) = self.pending.get(target,
+                                            (time.time() + self.window, 0))
+            self.pending[target] = (due, count + 1)
+            self.cond.notify()
+            return count + 1
+
+    def take(self):
+        """Wait for the next due target, `(target, count)`, or `None` once
+        closed and drained (when closing, everything is due at once)"""
+        with self.cond:
+            while True:
+                ready = [(due, target)
+                         for (target, (due, _)) in self.pending.items()
+                         if target not in self.active]
+                if len(ready) > 0:
+                    (due, target) = min(ready)
+                    delay = 0 if self.closing else due - time.time()
+                    if delay <= 0:
+                        (_, count) = self.pending.pop(target)
+                        self.active.add(target)
+                        return (target, count)
+                    self.cond.wait(delay)
+                elif self.closing and len(self.pending) == 0:
+                    return None
+                else:
+                    self.cond.wait()
+
+    def done(self, target):
+        with self.cond:
+            self.active.discard(target)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+
+
+def daemon_socket(repo, args):
+    """Path of the `--daemon` socket"""
+    if args.socket:
+        return args.socket
+    if repo is None:
+        sys.exit("`--socket` is required outside of a git repository")
+    return os.path.join(timestamp_dir(repo), 'daemon.sock')
+
+
+def daemon_stamp(target, count, args, repos, repos_lock):
+    """Timestamp the newest head of a coalesced `--daemon` target;
+    `repos` caches the opened repositories, shared by the pool threads"""
+    (gitdir, commit) = target
+    args = copy.copy(args)
+    args.commit = commit
+    start = time.time()
+    try:
+        with repos_lock:
+            if gitdir not in repos:
+                repos[gitdir] = git.Repository(gitdir)
+            repo = repos[gitdir]
+        results = timestamp_servers(repo, args, args.jobs)
+    except (git.GitError, KeyError) as e:
+        results = [SystemExit("Not a git repository: %s" % e)]
+    except (SystemExit, TimestampError) as e:
+        results = [e]
+    (status, errors) = stamp_status(results, args.quorum)
+    if status == 'failed' or not args.quiet:
+        print("%s %-15s %7.2fs  %s %s (%d request%s)" % (
+            time_str(time.time()), status, time.time() - start, gitdir,
+            commit, count, "" if count == 1 else "s"), flush=True)
+    for e in errors:
+        sys.stderr.write("    %s\n" % e.replace('\n', '\n    '))
+    metrics.write()
+
+
+def run_daemon(repo, args):
+    """`--daemon`: Serve `--notify` requests until terminated; pending
+    requests are still timestamped on SIGTERM or SIGINT"""
+    path = daemon_socket(repo, args)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        listener.connect(path)
+        sys.exit("A timestamp daemon is already listening on %s" % path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        pass  # Not running
+    listener.close()
+    if os.path.exists(path):
+        os.unlink(path)  # Stale
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    except OSError as e:
+        sys.exit("Cannot listen on %s: %s" % (path, e))
+    finally:
+        os.umask(old_umask)
+    listener.listen(64)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+
+    prefetch_keys(args)
+    queue = CoalescingQueue(args.coalesce)
+    repos = {}
+    repos_lock = threading.Lock()
+
+    def dispatch(pool):
+        while True:
+            item = queue.take()
+            if item is None:
+                return
+            (target, count) = item
+            future = pool.submit(daemon_stamp, target, count, args, repos,
+                                 repos_lock)
+            future.add_done_callback(lambda f, t=target: queue.done(t))
+
+    if not args.quiet:
+        print("Listening on %s" % path, flush=True)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, args.jobs)) as pool:
+        dispatcher = threading.Thread(target=dispatch, args=(pool,))
+        dispatcher.start()
+        try:
+            while True:
+                (conn, _) = listener.accept()
+                with conn:
+                    conn.settimeout(5)
+                    try:
+                        request = json.loads(
+                            conn.makefile('rb').readline(65536))
+                        target = (request['repo'], request['commit'])
+                        if not (isinstance(target[0], str)
+                                and isinstance(target[1], str)):
+                            raise TypeError("Strings expected")
+                        reply = {'queued': queue.add(target)}
+                    except (ValueError, KeyError, TypeError) as e:
+                        reply = {'error': "Invalid request: %s" % e}
+                    except OSError:
+                        continue
+                    try:
+                        conn.sendall(json.dumps(reply).encode() + b'\n')
+                    except OSError:
+                        pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            os.unlink(path)
+            queue.close()
+            dispatcher.join()
+
+
+def notify_daemon(repo, args):
+    """`--notify`: Queue COMMIT with the daemon. Returns `False` if no
+    daemon is listening."""
+    commit = args.commit
+    if commit == 'HEAD' and not repo.head_is_detached:
+        # The daemon should stamp this branch, even if HEAD moves on
+        commit = repo.head.shorthand
+    path = daemon_socket(repo, args)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(10)
+            conn.connect(path)
+            conn.sendall(json.dumps({'repo': repo.path,
+                                     'commit': commit}).encode() + b'\n')
+            reply = json.loads(conn.makefile('rb').readline(65536))
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    except (OSError, ValueError) as e:
+        sys.exit("Timestamp daemon on %s failed: %s" % (path, e))
+    if 'error' in reply:
+        sys.exit("Timestamp daemon on %s: %s" % (path, reply['error']))
+    return True
+
+
+def short_circuit():
+    """Handle `--version` and timestamping disabled on the command line or
+    in the environment before anything expensive happens. Anything less
+    obvious is left to the argument parser."""
+    argv = sys.argv[1:]
+    if argv == ['--version']:
+        print("git timestamp v%s" % VERSION)
+        sys.exit(0)
+    enable = os.getenv('TIMESTAMP_ENABLE')
+    for (i, arg) in enumerate(argv):
+        if arg == '--':
+            break
+        elif arg.startswith('--enable='):
+            enable = arg[len('--enable='):]
+        elif arg == '--enable':
+            if i + 1 < len(argv) and not argv[i + 1].startswith('-'):
+                enable = argv[i + 1]
+            else:
+                enable = 'true'
+    try:
+        if enable is not None and not strtobool(enable):
+            sys.exit("Timestamping explicitely disabled")
+    except ValueError:
+        pass  # Let the argument parser complain
+
+
+def maybe_in_repository():
+    """Cheap check whether `git.discover_repository()` could find anything,
+    to avoid loading `pygit2` outside of repositories"""
+    if os.getenv('GIT_DIR'):
+        return True
+    path = os.getcwd()
+    while True:
+        if os.path.exists(os.path.join(path, '.git')):
+            return True
+        if (os.path.isfile(os.path.join(path, 'HEAD'))
+                and os.path.isdir(os.path.join(path, 'objects'))):
+            return True  # Bare repository
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+
+
+def timestamp_dir(repo):
+    """`$GIT_DIR/git-timestamp`, shared by all worktrees"""
+    gitdir = repo.path
+    try:
+        with open(os.path.join(gitdir, 'commondir'), 'r') as fh:
+            gitdir = os.path.join(gitdir, fh.read().strip())
+    except OSError:
         pass
-    if not first:
-        time.sleep(args.interval.total_seconds())
+    return os.path.join(os.path.normpath(gitdir), 'git-timestamp')
+
+
+class StampIndex:
+    """Per-repository index of timestamps, in
+    `$GIT_DIR/git-timestamp/index.db` (SQLite, which serializes concurrent
+    writers). Entries are keyed by commit or tag object ID; as these cover
+    their whole history, a force-rewritten branch simply has new, unknown
+    IDs and an entry can never become wrong, only unused.
+
+    Table `verified` holds timestamps which have been verified with `keyid`,
+    together with the number of stamps and the oldest stamp time of the
+    (fully verified) branch history up to and including it.
+
+    Table `stamps` maps each timestamp commit or tag to the `source` commit
+    it timestamps; table `covered` records, per timestamper, the first stamp
+    of each commit or one of its descendants. New stamps are only queued in
+    `uncovered` and added to `covered` later, see `update_covered()`.
+
+    Table `spool` holds the newest commit per server and timestamp branch
+    which could not be timestamped because the server was unavailable."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS verified (
+            id TEXT PRIMARY KEY,
+            keyname TEXT NOT NULL,
+            keyid TEXT NOT NULL,
+            time INTEGER,
+            count INTEGER NOT NULL,
+            first INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS stamps (
+            id TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            keyname TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            ref TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS stamps_source ON stamps (source);
+        CREATE TABLE IF NOT EXISTS covered (
+            id TEXT NOT NULL,
+            keyname TEXT NOT NULL,
+            stamp TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            PRIMARY KEY (id, keyname)
+        );
+        CREATE TABLE IF NOT EXISTS uncovered (
+            id TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS spool (
+            server TEXT NOT NULL,
+            branch TEXT NOT NULL,
+            source TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            PRIMARY KEY (server, branch)
+        );
+    """
+
+    def __init__(self, repo):
+        self.path = os.path.join(timestamp_dir(repo), 'index.db')
+        self.lock = threading.Lock()
+        self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+            self.db = None
+
+    def connect(self):
+        """The database connection, or `None` if it cannot be opened"""
+        if self.db is None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                db = sqlite3.connect(self.path, timeout=60,
+                                     check_same_thread=False)
+                queued = db.execute("SELECT 1 FROM sqlite_master"
+                                    " WHERE name = 'uncovered'").fetchone()
+                db.executescript(self.SCHEMA)
+                if queued is None:
+                    # Stamps recorded before coverage was queued
+                    with db:
+                        db.execute("INSERT OR IGNORE INTO uncovered"
+                                   " SELECT id FROM stamps")
+                self.db = db
+            except (OSError, sqlite3.Error) as e:
+                sys.stderr.write("INFO: Cannot use timestamp index %s: %s\n"
+                                 % (self.path, e))
+                self.db = False
+        return self.db or None
+
+    def verified(self, oid, keyids):
+        """`(keyname, count, first)` if `oid` has been verified with one of
+        `keyids`"""
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return None
+            row = db.execute("SELECT keyid, keyname, count, first"
+                             " FROM verified WHERE id = ?",
+                             (str(oid),)).fetchone()
+        if row is not None and row[0] in keyids:
+            return row[1:]
+        return None
+
+    def add_verified(self, rows):
+        """Record `(id, keyname, keyid, time, count, first)` rows"""
+        if len(rows) == 0:
+            return
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return
+            try:
+                with db:
+                    db.executemany("INSERT OR REPLACE INTO verified"
+                                   " VALUES (?, ?, ?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                sys.stderr.write("INFO: Cannot update timestamp index %s: %s\n"
+                                 % (self.path, e))
+
+    def has_stamp(self, oid):
+        """Whether timestamp commit or tag `oid` has been recorded"""
+        with self.lock:
+            db = self.connect()
+            return db is not None and db.execute(
+                "SELECT 1 FROM stamps WHERE id = ?", (str(oid),)
+            ).fetchone() is not None
+
+    def add_stamp(self, source, oid, keyname, when, ref):
+        """Record timestamp commit or tag `oid` by `keyname` at `when` for
+        commit `source`; the commits it covers are added later"""
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return
+            try:
+                with db:
+                    if db.execute("INSERT OR IGNORE INTO stamps"
+                                  " VALUES (?, ?, ?, ?, ?)",
+                                  (str(oid), str(source), keyname, when,
+                                   ref)).rowcount > 0:
+                        db.execute("INSERT OR IGNORE INTO uncovered"
+                                   " VALUES (?)", (str(oid),))
+            except sqlite3.Error as e:
+                sys.stderr.write("INFO: Cannot update timestamp index %s: %s\n"
+                                 % (self.path, e))
+
+    def stamps_of(self, source, keyname):
+        """`(id, ref)` of the stamps by `keyname` for commit `source`"""
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return []
+            return db.execute(
+                "SELECT id, ref FROM stamps WHERE source = ? AND keyname = ?"
+                " ORDER BY time", (str(source), keyname)).fetchall()
+
+    def spool(self, server, branch, source):
+        """Remember to timestamp `source` to `branch` on `server` later,
+        replacing any older request for the same branch"""
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return
+            try:
+                with db:
+                    db.execute("INSERT OR REPLACE INTO spool"
+                               " VALUES (?, ?, ?, ?)",
+                               (server, branch, str(source), int(time.time())))
+            except sqlite3.Error as e:
+                sys.stderr.write("INFO: Cannot update timestamp index %s: %s\n"
+                                 % (self.path, e))
+
+    def spooled(self):
+        """`(server, branch, source, time)` of all spooled requests"""
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return []
+            return db.execute("SELECT server, branch, source, time FROM spool"
+                              " ORDER BY time, server, branch").fetchall()
+
+    def unspool(self, repo, server, branch, source):
+        """Drop the spooled request for `branch` on `server`, if `source`
+        (just timestamped) is or descends from its commit"""
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return
+            row = db.execute("SELECT source FROM spool"
+                             " WHERE server = ? AND branch = ?",
+                             (server, branch)).fetchone()
+            if row is None:
+                return
+            try:
+                if row[0] != str(source) and not repo.descendant_of(
+                        source, row[0]):
+                    return
+            except (KeyError, ValueError, git.GitError):
+                pass  # Spooled commit is gone
+            try:
+                with db:
+                    db.execute("DELETE FROM spool WHERE server = ?"
+                               " AND branch = ? AND source = ?",
+                               (server, branch, row[0]))
+            except sqlite3.Error as e:
+                sys.stderr.write("INFO: Cannot update timestamp index %s: %s\n"
+                                 % (self.path, e))
+
+    def update_covered(self, repo):
+        """Mark the commits covered by the queued stamps, oldest first:
+        `source` and its ancestors, stopping at commits already covered by
+        the same timestamper no later. Only new history is walked."""
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return
+            try:
+                with db:
+                    rows = db.execute(
+                        "SELECT stamps.id, source, keyname, time"
+                        " FROM uncovered JOIN stamps USING (id)"
+                        " ORDER BY time").fetchall()
+                    for (stamp, source, keyname, when) in rows:
+                        pending = [source]
+                        while pending:
+                            commit = pending.pop()
+                            row = db.execute(
+                                "SELECT time FROM covered"
+                                " WHERE id = ? AND keyname = ?",
+                                (commit, keyname)).fetchone()
+                            if row is not None and row[0] <= when:
+                                continue
+                            db.execute("INSERT OR REPLACE INTO covered"
+                                       " VALUES (?, ?, ?, ?)",
+                                       (commit, keyname, stamp, when))
+                            try:
+                                pending.extend(
+                                    str(p) for p in repo[commit].parent_ids)
+                            except (KeyError, ValueError):
+                                pass  # Beyond a shallow clone
+                    # Stamps queued meanwhile stay queued
+                    db.executemany("DELETE FROM uncovered WHERE id = ?",
+                                   [(row[0],) for row in rows])
+            except sqlite3.Error as e:
+                sys.stderr.write("INFO: Cannot update timestamp index %s: %s\n"
+                                 % (self.path, e))
+
+    def covered(self, oid):
+        """`(keyname, time, stamp, source, ref)` of the first stamp per
+        timestamper for commit `oid` or a descendant, oldest first, as far
+        as `update_covered()` has marked them"""
+        with self.lock:
+            db = self.connect()
+            if db is None:
+                return []
+            return db.execute(
+                "SELECT covered.keyname, covered.time, covered.stamp,"
+                " stamps.source, stamps.ref"
+                " FROM covered JOIN stamps ON stamps.id = covered.stamp"
+                " WHERE covered.id = ? ORDER BY covered.time, covered.keyname",
+                (str(oid),)).fetchall()
+
+
+def known_timestampers(config):
+    """Map timestamper name → list of (keyname, keyid) from
+    `git config timestamper.*`. Several servers may share a name."""
+    timestampers = {}
+    for entry in config:
+        match = re.match(r'^timestamper\.(.+)\.name$', entry.name)
+        if match:
+            try:
+                keyid = config['timestamper.%s.keyid' % match[1]]
+            except KeyError:
+                continue
+            candidates = timestampers.setdefault(entry.value, [])
+            if (match[1], keyid) not in candidates:
+                candidates.append((match[1], keyid))
+    return timestampers
+
+
+def header_name_time(text, header):
+    """(name, time) of the first `header` line (e.g., 'author') or `None`"""
+    match = re.search('^%s (.*) ([0-9]+) [-+][0-9]{4}$' % header, text,
+                      re.MULTILINE)
+    return (match[1], int(match[2])) if match else None
+
+
+def stamp_keyname(candidates, refname):
+    """The keyname among `candidates` whose default branch `refname` is,
+    otherwise the first"""
+    for (keyname, _) in candidates:
+        if refname.startswith('refs/heads/%s-timestamps' % keyname):
+            return keyname
+    return candidates[0][0]
+
+
+def index_stamps(repo, index, timestampers):
+    """Add timestamps not yet in `index`, e.g., fetched from elsewhere or
+    obtained by an older version, oldest first; then mark what they cover"""
+    for refname in sorted(repo.references):
+        if refname.startswith('refs/heads/') and '-timestamps' in refname:
+            new = []
+            oid = repo.lookup_reference(refname).target
+            while not index.has_stamp(oid):
+                commit = repo[oid]
+                text = commit.read_raw().decode('ascii', errors='replace')
+                (name, when) = (header_name_time(text, 'author')
+                                or (None, None))
+                parents = commit.parent_ids
+                if name not in timestampers or len(parents) not in (1, 2):
+                    break
+                new.append((parents[-1], oid,
+                            stamp_keyname(timestampers[name], refname), when,
+                            refname))
+                if len(parents) == 1:
+                    break
+                oid = parents[0]
+            for stamp in reversed(new):
+                index.add_stamp(*stamp)
+        elif refname.startswith('refs/tags/'):
+            tag = repo[repo.lookup_reference(refname).target]
+            if tag.type != git.GIT_OBJECT_TAG or index.has_stamp(tag.id):
+                continue
+            text = tag.read_raw().decode('ascii', errors='replace')
+            (name, when) = header_name_time(text, 'tagger') or (None, None)
+            if name in timestampers:
+                index.add_stamp(tag.target, tag.id,
+                                timestampers[name][0][0], when, refname)
+    index.update_covered(repo)
+
+
+def still_stamped(repo, ref, stamp):
+    """Whether timestamp `stamp` is (still) part of `ref`"""
+    try:
+        target = repo.lookup_reference(ref).target
+        return (str(target) == stamp
+                or (ref.startswith('refs/heads/')
+                    and repo.descendant_of(target, stamp)))
+    except (KeyError, ValueError, git.GitError):
+        return False
+
+
+def already_covered(repo, commit_id, keyname, ref, skip):
+    """Why timestamping `commit_id` by `keyname` to branch `ref` is redundant
+    according to the timestamp index and `--skip` mode `skip`, or `None`"""
+    with StampIndex(repo) as index:
+        for (stamp, stamp_ref) in index.stamps_of(commit_id, keyname):
+            if ((skip != 'branch' or stamp_ref == ref)
+                    and still_stamped(repo, stamp_ref, stamp)):
+                return ("Already timestamped commit %s by %s in %s"
+                        % (commit_id, keyname, stamp_ref))
+        if skip == 'covered':
+            # Only the stamps since the last call need to be added
+            index.update_covered(repo)
+            for (name, _, stamp, source, stamp_ref) in index.covered(
+                    commit_id):
+                if name == keyname and still_stamped(repo, stamp_ref, stamp):
+                    return ("Commit %s already covered by timestamp of %s"
+                            " by %s in %s"
+                            % (commit_id, source, keyname, stamp_ref))
+    return None
+
+
+def record_stamp(repo, source, oid, text, header, args, ref):
+    """Add a newly obtained timestamp to the timestamp index"""
+    (_, when) = header_name_time(text, header)
+    with StampIndex(repo) as index:
+        index.add_stamp(source, oid, server_keyname(args.server), when, ref)
+
+
+def when_timestamped(repo, args):
+    """`--when`: Print the first timestamp per timestamper covering a
+    commit, directly or through a descendant"""
+    try:
+        commit = repo.revparse_single(args.when).peel(git.Commit)
+    except (KeyError, ValueError, git.InvalidSpecError) as e:
+        sys.exit("No such commit: '%s'" % (e,))
+    with StampIndex(repo) as index:
+        index_stamps(repo, index, known_timestampers(repo.config))
+        covered = index.covered(commit.id)
+    if len(covered) == 0:
+        sys.exit("Commit %s has not been timestamped" % commit.id)
+    print(commit.id)
+    for (keyname, when, stamp, source, ref) in covered:
+        print("%-30s %s  %s %s%s" % (
+            keyname, time_str(when), ref, stamp,
+            "" if source == str(commit.id) else " (via %s)" % source))
+
+
+def audit_branch(repo, refname, timestampers, index=None):
+    """Walk timestamp branch `refname` from its head to its first stamp,
+    or to the first stamp already verified according to `index`.
+    Returns a list of `(refname, id, keyname, time, task, error, known)`,
+    where `task` is to be passed to `audit_stamp()` and `error` is a
+    structural problem already found (then `task` is `None`). `keyname` is
+    the first candidate, `audit_stamp()` will determine the actual one
+    (for a stamp known to the index, it is the one which verified it).
+    `known` is `(count, first)` from the index for the final stamp, if any."""
+    stamps = []
+    oid = repo.lookup_reference(refname).target
+    while True:
+        commit = repo[oid]
+        raw = commit.read_raw()
+        text = raw.decode('ascii', errors='replace')
+        (name, when) = header_name_time(text, 'author') or (None, None)
+        if name not in timestampers:
+            stamps.append((refname, str(oid), None, when, None,
+                           "Not by a known timestamper: %s\n"
+                           "(Maybe run `git timestamp --refresh-keys`?)"
+                           % name, None))
+            break
+        candidates = timestampers[name]
+        keyname = candidates[0][0]
+        known = index and index.verified(oid, [k for (_, k) in candidates])
+        if known:
+            stamps.append((refname, str(oid), known[0], when, None, None,
+                           known[1:]))
+            break
+        parents = commit.parent_ids
+        if len(parents) not in (1, 2):
+            stamps.append((refname, str(oid), keyname, when, None,
+                           "Not a timestamp commit", None))
+            break
+        try:
+            tree = repo[parents[-1]].tree_id
+        except KeyError:
+            stamps.append((refname, str(oid), keyname, when, None,
+                           "Timestamped commit %s missing" % parents[-1],
+                           None))
+            break
+        data = {'tree': str(tree), 'commit': str(parents[-1])}
+        if len(parents) == 2:
+            data['parent'] = str(parents[0])
+        stamps.append((refname, str(oid), keyname, when,
+                       ('branch', raw, candidates, name, data, None), None,
+                       None))
+        if len(parents) == 1:
+            break
+        oid = parents[0]
+    return stamps
+
+
+def audit_tag(repo, refname, timestampers, index=None):
+    """Like `audit_branch()`, for a timestamp tag. Returns an empty list
+    if `refname` is not an annotated tag by a known timestamper."""
+    tag = repo[repo.lookup_reference(refname).target]
+    if tag.type != git.GIT_OBJECT_TAG:
+        return []
+    raw = tag.read_raw()
+    text = raw.decode('ascii', errors='replace')
+    (name, when) = header_name_time(text, 'tagger') or (None, None)
+    if name not in timestampers:
+        return []
+    candidates = timestampers[name]
+    known = index and index.verified(tag.id, [k for (_, k) in candidates])
+    if known:
+        return [(refname, str(tag.id), known[0], when, None, None,
+                 known[1:])]
+    return [(refname, str(tag.id), candidates[0][0], when,
+             ('tag', raw, candidates, name, str(tag.target),
+              refname[len('refs/tags/'):]), None, None)]
+
+
+def audit_init(args, keys):
+    """Set up a `--verify` worker process, with a context of its own"""
+    global audit_args
+    context = Context(None)
+    context.gpg = new_gpg(args)
+    context.verifier = new_verifier(context.gpg, args)
+    for (keyid, armored) in keys.items():
+        context.verifier.add_key(keyid, armored)
+    audit_args = copy.copy(args)
+    audit_args.context = context
+
+
+def audit_stamp(task):
+    """Check a single timestamp commit or tag like when it was obtained,
+    but relative to its own time, against each candidate timestamper key.
+    Returns `(keyname, keyid, None)` on success or
+    `(keyname, keyid, error message)`."""
+    (kind, body, candidates, name, data, tagname) = task
+    (_, when) = header_name_time(body.decode('ascii', errors='replace'),
+                                 'tagger' if kind == 'tag' else 'author')
+    args = copy.copy(audit_args)
+    args.tag = tagname
+    first_error = None
+    for (keyname, keyid) in candidates:
+        try:
+            if kind == 'tag':
+                validate_tag(body, data, keyid, name, args, when)
+            else:
+                validate_branch(body, keyid, name, data, args, when)
+            return (keyname, keyid, None)
+        except (SystemExit, TimestampError) as e:
+            if first_error is None:
+                first_error = (keyname, keyid, str(e))
+    return first_error
+
+
+def verify_timestamps(repo, args):
+    """`--verify`: Check existing timestamp branches and tags. Stamps
+    verified before are skipped, see `StampIndex`."""
+    timestampers = known_timestampers(repo.config)
+    index = StampIndex(repo)
+    known = None if args.full else index
+    stamps = []
+    if args.verify == '' or args.all:
+        for refname in sorted(repo.references):
+            if (refname.startswith('refs/heads/')
+                    and '-timestamps' in refname):
+                stamps.extend(audit_branch(repo, refname, timestampers,
+                                           known))
+            elif refname.startswith('refs/tags/'):
+                stamps.extend(audit_tag(repo, refname, timestampers, known))
+    elif 'refs/heads/' + args.verify in repo.references:
+        stamps = audit_branch(repo, 'refs/heads/' + args.verify, timestampers,
+                              known)
+    elif 'refs/tags/' + args.verify in repo.references:
+        stamps = audit_tag(repo, 'refs/tags/' + args.verify, timestampers,
+                           known)
+        if len(stamps) == 0:
+            sys.exit("Tag %s is not by a known timestamper" % args.verify)
+    else:
+        sys.exit("No such branch or tag: %s" % args.verify)
+    if len(stamps) == 0:
+        sys.exit("No timestamps found")
+
+    tasks = [stamp[4] for stamp in stamps if stamp[4] is not None]
+    # Key material for the workers, so that they need not ask GnuPG
+    keys = {}
+    if len(tasks) > 0:
+        for candidates in timestampers.values():
+            for (keyname, keyid) in candidates:
+                cached = args.context.key_cache.get(keyname, keyid)
+                keys[keyid] = (cached['key'] if cached
+                               else args.context.gpg.export_keys(keyid))
+    # The workers set up their own context
+    worker_args = copy.copy(args)
+    worker_args.context = None
+    if args.jobs > 1 and len(tasks) > 1:
+        chunksize = max(1, min(256, len(tasks) // (4 * args.jobs)))
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.jobs, initializer=audit_init,
+                initargs=(worker_args, keys)) as pool:
+            results = iter(list(pool.map(audit_stamp, tasks,
+                                         chunksize=chunksize)))
+    else:
+        audit_init(worker_args, keys)
+        results = iter([audit_stamp(task) for task in tasks])
+
+    # Oldest first, so that the history of each stamp is known by then
+    summary = {}
+    verified = []
+    history = {}
+    for (refname, oid, keyname, when, task, error, known) in reversed(stamps):
+        (count, first) = history.get(refname, (0, None))
+        if task is not None:
+            (keyname, keyid, error) = next(results)
+        entry = summary.setdefault(keyname or '(unknown)',
+                                   [0, 0, 0, None, None])
+        if known is not None:
+            (count, first) = known
+            entry[0] += count
+        elif error is None:
+            entry[0] += 1
+            entry[1] += 1
+            if count is not None:
+                count += 1
+                first = when if first is None else min(first, when)
+                verified.append((oid, keyname, keyid, when, count, first))
+        else:
+            entry[2] += 1
+            # Nothing newer on this branch counts as fully verified
+            count = None
+            sys.stderr.write("%s %s: %s\n" % (refname, oid,
+                                              error.replace('\n', '\n    ')))
+        history[refname] = (count, first)
+        for t in (first, when):
+            if t is not None:
+                entry[3] = t if entry[3] is None else min(entry[3], t)
+                entry[4] = t if entry[4] is None else max(entry[4], t)
+    index.add_verified(verified)
+
+    failed = 0
+    for (keyname, (good, new, bad, first, last)) in sorted(summary.items()):
+        failed += bad
+        print("%-30s %7d verified (%d new), %d failed%s" % (
+            keyname, good, new, bad,
+            "" if first is None else
+            ", %s … %s" % (time_str(first), time_str(last))))
+    if failed > 0:
+        sys.exit(1)
+
+
+@contextlib.contextmanager
+def typed_errors():
+    """Raise a plain `SystemExit` (`sys.exit(message)`) in the `with` block
+    as `TimestampError`, for `Stamper`"""
     try:
-        r = requests.post(args.server, data=data, allow_redirects=False)
-        quit_if_http_error(args.server, r)
-        validate_branch(r.text, keyid, name, data, args)
-        commitid = repo.write(
-            git.GIT_OBJECT_COMMIT,
-            r.text)
-        repo.create_reference('refs/heads/' + args.branch,
-                              commitid, force=True)
-    except requests.exceptions.ConnectionError as e:
-        sys.exit("Cannot connect to server: %s" % e)
+        yield
+    except SystemExit as e:
+        raise TimestampError(e.code) from e
+
+
+class Stamper:
+    """Timestamping from Python, without a `git timestamp` process per
+    timestamp: a long-lived context owning the repository, GnuPG/verifier,
+    HTTP session and key caches. Options are named as on the command line
+    and default to `git config` and `TIMESTAMP_*`, as there:
+
+        stamper = Stamper('/path/to/repo', server='gitta,diversity',
+                          timeout='10s', verifier='native')
+        for stamp in stamper.stamp_branch('HEAD'):
+            print(stamp.server, stamp.ref, stamp.stamp)
+
+    Returns `StampResult`s; failures raise `TimestampError` or one of its
+    subclasses (`AlreadyTimestamped`, `InvalidTimestamp`, `ClockSkew`,
+    `InvalidSignature`, `ServerUnavailable`). The methods can be called from
+    several threads; `Stamper`s are independent of each other."""
+
+    def __init__(self, path='.', **options):
+        with typed_errors():
+            try:
+                gitdir = git.discover_repository(  # pylint: disable=maybe-no-member
+                    os.path.abspath(path))
+            except KeyError:
+                gitdir = None
+            if gitdir is None:
+                raise TimestampError("Not a git repository: %s" % path)
+            repository = git.Repository(gitdir)
+            argv = self.argv(options, argument_parser(repository))
+            try:
+                self.args = get_args(argv, repository)
+            except SystemExit as e:
+                if isinstance(e.code, str):
+                    raise
+                # `argparse` has explained the problem on stderr
+                raise TimestampError("Invalid options: %s" % ' '.join(argv))
+            setup(self.args, repository)
+
+    @staticmethod
+    def argv(options, parser):
+        """Command line for `options`; booleans become a bare `--flag` or
+        `--flag=false`, but are left out if the flag takes no value"""
+        argv = []
+        for (option, value) in options.items():
+            flag = '--' + option.replace('_', '-')
+            if value is True:
+                argv.append(flag)
+            elif value is False:
+                action = parser._option_string_actions.get(flag)  # pylint: disable=protected-access
+                if action is None or action.nargs != 0:
+                    argv.append(flag + '=false')
+            elif value is not None:
+                argv.append('%s=%s' % (flag, value))
+        return argv
+
+    @property
+    def repository(self):
+        """The `pygit2.Repository` timestamped"""
+        return self.args.context.repo
+
+    def stamp_branch(self, commit='HEAD', server=None, branch=None):
+        """Timestamp `commit` to the automatic branches of `server` (default:
+        the configured servers; comma-separated) concurrently, as
+        `git timestamp` does. With `branch` (or `git config timestamp.branch`),
+        to that branch of the first server only.
+        Returns the `StampResult`s, in server order. Unless the quorum (all
+        servers by default) was reached, raises the first failure."""
+        with typed_errors():
+            repo = self.repository
+            args = copy.copy(self.args)
+            args.commit = commit
+            if server is not None:
+                args.server = server
+            if branch is not None:
+                args.branch = branch
+            if args.branch is not None:
+                args.server = server_url(args.server.split(',')[0])
+                (keyid, name) = get_keyid(args)
+                return [timestamp_branch(repo, keyid, name, args)]
+            stamps = {}
+            results = timestamp_servers(repo, args, args.jobs, stamps)
+            if not quorum_reached(results, args.quorum):
+                raise next(e for e in results if e is not None)
+            return [stamps[i] for i in sorted(stamps)]
+
+    def stamp_tag(self, tag, commit='HEAD', server=None):
+        """Timestamp `commit` as tag `tag` by `server` (default: the first
+        configured one). Returns a `StampResult`."""
+        with typed_errors():
+            args = copy.copy(self.args)
+            args.commit = commit
+            args.tag = tag
+            args.server = server_url((server or args.server).split(',')[0])
+            (keyid, name) = get_keyid(args)
+            return timestamp_tag(self.repository, keyid, name, args)
 
 
 def main():
-    global repo, gpg
-    requests.__title__ = 'git-timestamp/%s %s' % (VERSION, requests.__title__)
+    short_circuit()
+    start = time.time()
     try:
         # Depending on the version of pygit2, `git.discover_repository()`
         # returns `None` or raises `KeyError`
-        path = git.discover_repository(  # pylint: disable=maybe-no-member
-            os.getcwd())
+        if maybe_in_repository():
+            path = git.discover_repository(  # pylint: disable=maybe-no-member
+                os.getcwd())
+        else:
+            path = None
     except KeyError:
         path = None
     if path is not None:
         repo = git.Repository(path)
     else:
         repo = None
-    args = get_args()
+    found = time.time()
+    args = get_args(repository=repo)
+    if args.timings is not None:
+        timings.enable(args.timings, start)
+        timings.add('repository', start, found)
+        timings.add('config', found, time.time())
+    if args.metrics is not None:
+        metrics.enable(args.metrics)
+    profiler = Profiler(args.profile) if args.profile else None
+    status = 0
+    try:
+        run(repo, args)
+    except TimestampError as e:
+        status = 1
+        sys.exit(str(e))
+    except SystemExit as e:
+        status = (e.code if isinstance(e.code, int)
+                  else 0 if e.code is None else 1)
+        raise
+    except BaseException:
+        status = 1
+        raise
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        timings.write(status)
+        metrics.write(status, start)
+
+
+def setup(args, repository):
+    """Create GnuPG, verifier, HTTP session, key cache and server statistics
+    for `args` and `repository` (may be `None`), as `args.context`"""
+    context = Context(repository)
+    with timings.phase('gnupg'):
+        context.gpg = new_gpg(args)
+        context.verifier = new_verifier(context.gpg, args)
+    context.session = new_session(args)
+    context.key_cache = KeyCache(args, context.gpg)
+    context.server_stats = ServerStats(args)
+    context.rate_limiter = RateLimiter(args)
+    args.context = context
+
+
+def run(repo, args):
+    """Do what `args` ask for, in the repository `repo`"""
+    fleet = args.repos is not None or args.repo_glob is not None
     # Only check after parsing the arguments, so --version and --help work
-    if repo is None:
+    if (repo is None and not fleet and not args.refresh_keys
+            and not args.server_stats and not (args.daemon and args.socket)
+            and args.load is None):
         sys.exit("Not a git repository")
-
-    try:
-        gpg = gnupg.GPG(gnupghome=args.gnupg_home)
-    except TypeError:
-        traceback.print_exc()
-        sys.exit("*** `git timestamp` needs `python-gnupg`"
-                 " module from PyPI, not `gnupg`\n"
-                 "    Possible remedy: `pip uninstall gnupg;"
-                 " pip install python-gnupg`\n"
-                 "    (try `pip2`/`pip3` if it does not work with `pip`)")
-    if args.tag is not None or args.branch is not None:
+    if args.notify:
+        if notify_daemon(repo, args):
+            return
+        if not args.quiet:
+            sys.stderr.write("INFO: No timestamp daemon listening,"
+                             " timestamping directly\n")
+
+    setup(args, repo)
+    if args.server_stats:
+        print_server_stats(args)
+    elif args.refresh_keys:
+        refresh_keys(args)
+    elif args.verify is not None:
+        verify_timestamps(repo, args)
+    elif args.when is not None:
+        when_timestamped(repo, args)
+    elif args.load is not None:
+        run_load(args)
+    elif args.flush:
+        if fleet:
+            repos = []
+            for path in fleet_paths(args):
+                try:
+                    repos.append((path, git.Repository(path)))
+                except (KeyError, git.GitError) as e:  # pylint: disable=maybe-no-member
+                    sys.exit("Not a git repository: %s" % e)
+        else:
+            repos = [('', repo)]
+        flush_spool(repos, args)
+    elif args.daemon:
+        run_daemon(repo, args)
+    elif args.aggregate:
+        if args.tag is not None or args.branch is not None:
+            sys.exit("`--aggregate` only supports automatic branch names")
+        if repo is None:
+            sys.exit("`--aggregate` needs a repository for the aggregate"
+                     " timestamps")
+        if fleet:
+            members = []
+            for path in fleet_paths(args):
+                try:
+                    members.append((os.path.abspath(path).strip('/'),
+                                    git.Repository(path)))
+                except (KeyError, git.GitError) as e:  # pylint: disable=maybe-no-member
+                    sys.exit("Not a git repository: %s" % e)
+        else:
+            members = [('', repo)]
+        timestamp_aggregate(repo, members, args)
+    elif fleet:
+        if args.tag is not None or args.branch is not None:
+            sys.exit("Fleet mode only supports automatic branch names")
+        timestamp_fleet(args)
+    elif args.all_branches:
+        if args.tag is not None or args.branch is not None:
+            sys.exit("`--all-branches` only supports automatic branch names")
+        timestamp_all_branches(repo, args)
+    elif args.stdin_refs:
+        if args.tag is not None or args.branch is not None:
+            sys.exit("`--stdin-refs` only supports automatic branch names")
+        timestamp_stdin_refs(repo, args)
+    elif args.tag is not None or args.branch is not None:
         # Single tag or branch against one timestamping server
         if ',' in args.server:
             (server, _) = args.server.split(',', 1)
@@ -666,27 +4065,16 @@ def main():
         if args.tag:
             timestamp_tag(repo, keyid, name, args)
         else:
-            timestamp_branch(repo, keyid, name, args, True)
+            timestamp_branch(repo, keyid, name, args)
     else:
-        # Automatic branch, with support for multiple timestamping servers
-        success = True
-        first = True
-        for server in args.server.split(','):
-            if server in server_aliases:
-                server = server_aliases[server]
-            if ':' not in server:
-                server = 'https://' + server
-            fields = server.replace('/', '.').split('.')
-            args.branch = timestamp_branch_name(fields[1:])
-            args.server = server
-            try:
-                (keyid, name) = get_keyid(args)
-                timestamp_branch(repo, keyid, name, args, first)
-                first = False # Only on successful timestamp
-            except SystemExit as e:
-                sys.stderr.write(e.code + '\n')
-                success = False
-        if not success:
+        # Automatic branch, with support for multiple timestamping servers,
+        # contacted concurrently. Errors are reported in server order, even
+        # if the quorum has been reached.
+        results = timestamp_servers(repo, args, args.jobs)
+        for e in results:
+            if e is not None:
+                sys.stderr.write(str(e) + '\n')
+        if not quorum_reached(results, args.quorum):
             sys.exit(1)
 
 
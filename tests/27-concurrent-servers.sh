@@ -0,0 +1,56 @@
+#!/bin/bash -e
+# Timestamping against multiple servers concurrently, keeping the interval order
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+export XDG_CACHE_HOME="$d/27-cache"
+rm -rf "$XDG_CACHE_HOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+echo $RANDOM > 27-a.txt
+git add 27-a.txt
+git commit -m "Random change 27-$RANDOM"
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+git config --unset timestamp.defaultBranch || true
+
+if ! $h/git-timestamp.py --server=gitta,diversity --jobs=2 --interval=2s; then
+	echo "Assertion failed: Concurrently timestamping against two servers" >&2
+	exit 1
+fi
+
+# Both timestamps must be there, in order
+gitta=`git log -1 --format=%ct gitta-timestamps`
+diversity=`git log -1 --format=%ct diversity-timestamps`
+if [ $diversity -le $gitta ]; then
+	echo "Assertion failed: Interval not kept ($gitta, $diversity)" >&2
+	exit 1
+fi
+git verify-commit gitta-timestamps diversity-timestamps
+
+# Also when the server statistics rank the second server first
+. "$h/tests/standin.sh"
+start_standin --delay 1
+slow=`echo $url | sed 's,http://localhost:,localhost-,'`
+slowurl=$url
+start_standin
+fast=`echo $url | sed 's,http://localhost:,localhost-,'`
+fasturl=$url
+for interval in 0s 0s 2s; do
+	echo $RANDOM > 27-a.txt
+	git commit -q -m "Random change 27-$RANDOM" 27-a.txt
+	$h/git-timestamp.py --server=$slowurl,$fasturl --jobs=2 \
+		--interval=$interval
+done
+slow=`git log -1 --format=%ct $slow-timestamps`
+fast=`git log -1 --format=%ct $fast-timestamps`
+if [ $fast -le $slow ]; then
+	echo "Assertion failed: Interval order changed by server statistics ($slow, $fast)" >&2
+	exit 1
+fi
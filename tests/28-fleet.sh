@@ -0,0 +1,49 @@
+#!/bin/bash -e
+# Fleet mode: timestamping several repositories in one run
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+mkdir -p 28-fleet
+for i in 1 2 3; do
+	git init --initial-branch main 28-fleet/repo$i
+	echo $RANDOM > 28-fleet/repo$i/28-a.txt
+	git -C 28-fleet/repo$i add 28-a.txt
+	git -C 28-fleet/repo$i commit -m "Random change 28-$RANDOM"
+done
+echo "$d/28-fleet/repo1" > 28-fleet/list
+
+# Outside of any repository
+cd 28-fleet
+if ! $h/git-timestamp.py --server=gitta --repos list --repo-glob 'repo[23]' > out.txt; then
+	echo "Assertion failed: Fleet timestamping" >&2
+	exit 1
+fi
+if ! grep -q '^3 stamped, 0 already stamped, 0 failed$' out.txt; then
+	echo "Assertion failed: Unexpected fleet result:" >&2
+	cat out.txt >&2
+	exit 1
+fi
+git -C repo2 verify-commit gitta-timestamps
+
+# Second run: Nothing new, which is not an error
+if ! $h/git-timestamp.py --server=gitta --repo-glob 'repo*' > out.txt; then
+	echo "Assertion failed: Already stamped repositories are not an error" >&2
+	exit 1
+fi
+if ! grep -q '^0 stamped, 3 already stamped, 0 failed$' out.txt; then
+	echo "Assertion failed: Unexpected fleet result:" >&2
+	cat out.txt >&2
+	exit 1
+fi
+
+# A broken entry fails the run, unless configured otherwise
+echo "$d/28-fleet/does-not-exist" >> list
+if $h/git-timestamp.py --server=gitta --repos list > out.txt; then
+	echo "Assertion failed: Missing repository should fail the run" >&2
+	exit 1
+fi
+$h/git-timestamp.py --server=gitta --repos list --fail-on all > out.txt
+cd ..
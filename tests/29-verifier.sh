@@ -0,0 +1,31 @@
+#!/bin/bash -e
+# Verifier backends
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+for verifier in gnupg auto native; do
+	echo $RANDOM > 29-a.txt
+	git add 29-a.txt
+	git commit -m "Random change 29-$RANDOM"
+	tagid=v29-$verifier-$RANDOM
+	if ! $h/git-timestamp.py --verifier=$verifier --tag $tagid --server=gitta; then
+		echo "Assertion failed: Tag timestamp with $verifier verifier" >&2
+		exit 1
+	fi
+	git tag -v $tagid
+	if ! $h/git-timestamp.py --verifier=$verifier --server=gitta; then
+		echo "Assertion failed: Branch timestamp with $verifier verifier" >&2
+		exit 1
+	fi
+	git verify-commit gitta-timestamps
+done
@@ -0,0 +1,47 @@
+#!/bin/bash -e
+# Timestamper key cache and `--refresh-keys`
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+export XDG_CACHE_HOME="$d/30-cache"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+echo $RANDOM > 30-a.txt
+git add 30-a.txt
+git commit -m "Random change 30-$RANDOM"
+$h/git-timestamp.py --server=gitta
+if ! grep -q '"keyid": "8A0B0941E7C49D65"' $XDG_CACHE_HOME/git-timestamp/keys.json; then
+	echo "Assertion failed: Key not cached" >&2
+	exit 1
+fi
+
+# Cached key is used (native verifier does not need the keyring at all)
+echo $RANDOM >> 30-a.txt
+git commit -m "Random change 30-$RANDOM" -a
+$h/git-timestamp.py --server=gitta --verifier=auto
+git verify-commit gitta-timestamps
+
+# A changed keyring invalidates the cache
+gpg --batch --yes --delete-keys 9C67D18C5119896C35FE3E0D8A0B0941E7C49D65
+echo $RANDOM >> 30-a.txt
+git commit -m "Random change 30-$RANDOM" -a
+$h/git-timestamp.py --server=gitta 2> 30-stderr.txt
+if ! grep -q 'missing in keyring' 30-stderr.txt; then
+	echo "Assertion failed: Deleted key not detected" >&2
+	exit 1
+fi
+
+# Other aliased servers may be unreachable; only check ours
+$h/git-timestamp.py --refresh-keys --server=gitta > 30-refresh.txt || true
+if ! grep -q '^https://gitta.zeitgitter.net: 8A0B0941E7C49D65' 30-refresh.txt; then
+	echo "Assertion failed: Refreshing keys" >&2
+	exit 1
+fi
@@ -0,0 +1,54 @@
+#!/bin/bash -e
+# Startup time of trivial paths: no heavy imports, tight time budget
+h="$PWD"
+d=$1
+shift
+cd "$d"
+budget=${STARTUP_BUDGET_MS:-150}
+python=${PYTHON:-python3}
+
+# Milliseconds for a command, best of 5
+best_ms() {
+	best=999999
+	for i in 1 2 3 4 5; do
+		start=`date +%s%N`
+		"$@" > /dev/null 2>&1 || true
+		ms=$(( (`date +%s%N` - start) / 1000000 ))
+		[ $ms -lt $best ] && best=$ms
+	done
+	echo $best
+}
+
+# Modules not to be imported; the argument parser is only needed beyond the
+# short-circuited paths
+heavy_modules='requests|pygit2|gnupg|configargparse|distutils'
+
+check() {
+	what="$1"
+	shift
+	heavy=`$python -X importtime $h/git-timestamp.py "$@" 2>&1 \
+		| grep -E "\| +($heavy_modules)\$" || true`
+	if [ -n "$heavy" ]; then
+		echo "Assertion failed: $what imports heavy modules:" >&2
+		echo "$heavy" >&2
+		exit 1
+	fi
+	ms=`best_ms $python $h/git-timestamp.py "$@"`
+	echo "$what: ${ms}ms (interpreter alone: ${base}ms, budget: +${budget}ms)"
+	if [ $ms -gt $(( base + budget )) ]; then
+		echo "Assertion failed: $what too slow" >&2
+		exit 1
+	fi
+}
+
+base=`best_ms $python -c pass`
+mkdir -p 31-not-a-repo
+cd 31-not-a-repo
+check "--version" --version
+check "--enable=false" --enable=false
+TIMESTAMP_ENABLE=no check "TIMESTAMP_ENABLE=no"
+heavy_modules='requests|pygit2|gnupg|distutils' check "Not a git repository"
+cd ..
+git init --initial-branch main
+check "--version in repository" --version
+check "--enable=false in repository" --enable=false
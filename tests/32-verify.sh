@@ -0,0 +1,48 @@
+#!/bin/bash -e
+# Verifying existing timestamp branches and tags
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+for i in 1 2 3; do
+	echo $RANDOM > 32-a.txt
+	git add 32-a.txt
+	git commit -m "Random change 32-$RANDOM"
+	$h/git-timestamp.py --server=gitta
+done
+tagid=v32-$RANDOM
+$h/git-timestamp.py --server=gitta --tag $tagid
+
+for verifier in gnupg auto; do
+	if ! $h/git-timestamp.py --verify --full --verifier=$verifier > 32-verify.txt; then
+		echo "Assertion failed: Verifying all timestamps with $verifier" >&2
+		exit 1
+	fi
+	if ! grep -q '^gitta-zeitgitter-net .* 0 failed' 32-verify.txt; then
+		echo "Assertion failed: Unexpected verification summary" >&2
+		cat 32-verify.txt >&2
+		exit 1
+	fi
+done
+$h/git-timestamp.py --verify gitta-timestamps --jobs=1
+$h/git-timestamp.py --verify $tagid
+
+# Tampering with the newest timestamp must be detected
+head=`git rev-parse gitta-timestamps`
+git cat-file commit $head | sed '$s/$/ (modified)/' > 32-fake.txt
+fake=`git hash-object -t commit -w 32-fake.txt`
+git update-ref refs/heads/gitta-timestamps $fake
+if $h/git-timestamp.py --verify gitta-timestamps; then
+	echo "Assertion failed: Modified timestamp not detected" >&2
+	exit 1
+fi
+git update-ref refs/heads/gitta-timestamps $head
@@ -0,0 +1,72 @@
+#!/bin/bash -e
+# Re-verification only checks new timestamps
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+for i in 1 2; do
+	echo $RANDOM > 33-a.txt
+	git add 33-a.txt
+	git commit -m "Random change 33-$RANDOM"
+	$h/git-timestamp.py --server=gitta
+done
+$h/git-timestamp.py --verify gitta-timestamps > /dev/null
+if [ ! -f .git/git-timestamp/index.db ]; then
+	echo "Assertion failed: No timestamp index" >&2
+	exit 1
+fi
+if ! $h/git-timestamp.py --verify gitta-timestamps | grep -q ' (0 new), 0 failed'; then
+	echo "Assertion failed: Verified timestamps checked again" >&2
+	exit 1
+fi
+
+echo $RANDOM > 33-a.txt
+git commit -m "Random change 33-$RANDOM" 33-a.txt
+$h/git-timestamp.py --server=gitta
+if ! $h/git-timestamp.py --verify gitta-timestamps | grep -q ' (1 new), 0 failed'; then
+	echo "Assertion failed: Not only the new timestamp checked" >&2
+	exit 1
+fi
+
+# A rewritten branch is checked again, even below a verified head
+head=`git rev-parse gitta-timestamps`
+parent=`git rev-parse gitta-timestamps^`
+git cat-file commit $parent | sed '$s/$/ (modified)/' > 33-fake.txt
+fake=`git hash-object -t commit -w 33-fake.txt`
+git cat-file commit $head | sed "s/^parent $parent/parent $fake/" > 33-fake.txt
+fake=`git hash-object -t commit -w 33-fake.txt`
+git update-ref refs/heads/gitta-timestamps $fake
+if $h/git-timestamp.py --verify gitta-timestamps; then
+	echo "Assertion failed: Rewritten timestamp branch not detected" >&2
+	exit 1
+fi
+git update-ref refs/heads/gitta-timestamps $head
+
+# Known stamps are credited to the timestamper which verified them, also
+# when several timestampers share a name (all stand-ins do)
+. "$h/tests/standin.sh"
+start_standin
+first=$url
+start_standin
+second=$url
+for i in 1 2; do
+	echo $RANDOM > 33-a.txt
+	git commit -m "Random change 33-$RANDOM" 33-a.txt
+	$h/git-timestamp.py --server=$first,$second
+done
+$h/git-timestamp.py --verify | sed 's/ ([0-9]* new)//' > 33-full.txt
+$h/git-timestamp.py --verify | sed 's/ ([0-9]* new)//' > 33-known.txt
+if ! grep -q '^localhost-' 33-full.txt || ! cmp -s 33-full.txt 33-known.txt; then
+	echo "Assertion failed: Known stamps credited to another timestamper" >&2
+	diff 33-full.txt 33-known.txt >&2 || true
+	exit 1
+fi
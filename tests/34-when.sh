@@ -0,0 +1,52 @@
+#!/bin/bash -e
+# When was a commit timestamped?
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+for i in 1 2; do
+	echo $RANDOM > 34-a.txt
+	git add 34-a.txt
+	git commit -m "Random change 34-$RANDOM"
+done
+$h/git-timestamp.py --server=gitta
+stamp=`git rev-parse gitta-timestamps`
+if ! $h/git-timestamp.py --when HEAD | grep -q "gitta-timestamps $stamp\$"; then
+	echo "Assertion failed: Direct timestamp not found" >&2
+	exit 1
+fi
+# Covered through a descendant
+if ! $h/git-timestamp.py --when HEAD^ | grep -q "gitta-timestamps $stamp (via "; then
+	echo "Assertion failed: Timestamp of descendant not found" >&2
+	exit 1
+fi
+
+echo $RANDOM > 34-a.txt
+git commit -m "Random change 34-$RANDOM" 34-a.txt
+if $h/git-timestamp.py --when HEAD; then
+	echo "Assertion failed: New commit reported as timestamped" >&2
+	exit 1
+fi
+
+# The index can be rebuilt from the timestamp branches
+rm -rf .git/git-timestamp
+if ! $h/git-timestamp.py --when HEAD^^ | grep -q "gitta-timestamps $stamp (via "; then
+	echo "Assertion failed: Timestamp index not rebuilt" >&2
+	exit 1
+fi
+
+# Also from an index without coverage (as written by older versions)
+python3 -c "import sqlite3; sqlite3.connect('.git/git-timestamp/index.db').executescript('DROP TABLE covered; DROP TABLE uncovered')"
+if ! $h/git-timestamp.py --when HEAD^^ | grep -q "gitta-timestamps $stamp (via "; then
+	echo "Assertion failed: Coverage not added for older index" >&2
+	exit 1
+fi
@@ -0,0 +1,70 @@
+#!/bin/bash -e
+# No timestamp requests for commits already covered
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+for i in 1 2; do
+	echo $RANDOM > 35-a.txt
+	git add 35-a.txt
+	git commit -m "Random change 35-$RANDOM"
+done
+$h/git-timestamp.py --server=gitta
+
+# Same commit, sibling timestamp branch
+git checkout -b 35-same
+if $h/git-timestamp.py --server=gitta --skip=stamped 2> 35-err.txt; then
+	echo "Assertion failed: Timestamped the same commit again" >&2
+	exit 1
+fi
+if ! grep -q '^Already timestamped commit .* in refs/heads/gitta-timestamps$' 35-err.txt; then
+	echo "Assertion failed: Skipped timestamp not reported" >&2
+	cat 35-err.txt >&2
+	exit 1
+fi
+if git rev-parse -q --verify gitta-timestamps-35-same; then
+	echo "Assertion failed: Sibling timestamp branch created" >&2
+	exit 1
+fi
+
+# Ancestor
+git checkout -b 35-older HEAD^
+if $h/git-timestamp.py --server=gitta --skip=covered; then
+	echo "Assertion failed: Timestamped covered commit" >&2
+	exit 1
+fi
+$h/git-timestamp.py --server=gitta
+git rev-parse -q --verify gitta-timestamps-35-older
+
+# Ancestor covered by a timestamp obtained since the last check
+for i in 1 2; do
+	echo $RANDOM > 35-a.txt
+	git commit -m "Random change 35-$RANDOM" 35-a.txt
+done
+$h/git-timestamp.py --server=gitta
+git checkout -b 35-newer HEAD^
+if $h/git-timestamp.py --server=gitta --skip=covered; then
+	echo "Assertion failed: Timestamped commit covered by a new timestamp" >&2
+	exit 1
+fi
+git checkout 35-older
+
+# Older timestamp on the same branch
+echo $RANDOM > 35-a.txt
+git commit -m "Random change 35-$RANDOM" 35-a.txt
+$h/git-timestamp.py --server=gitta
+git reset --hard HEAD^
+if $h/git-timestamp.py --server=gitta; then
+	echo "Assertion failed: Timestamped again to the same branch" >&2
+	exit 1
+fi
+git checkout main
@@ -0,0 +1,78 @@
+#!/bin/bash -e
+# Coalescing timestamp daemon
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+echo $RANDOM > 36-a.txt
+git add 36-a.txt
+git commit -m "Random change 36-$RANDOM"
+$h/git-timestamp.py --server=gitta
+before=`git rev-list --first-parent --count gitta-timestamps`
+
+$h/git-timestamp.py --server=gitta --daemon --coalesce=3s > 36-daemon.txt &
+daemon=$!
+trap "kill $daemon 2> /dev/null || true" EXIT
+while [ ! -S .git/git-timestamp/daemon.sock ]; do
+	sleep 0.1
+done
+for i in 1 2 3; do
+	echo $RANDOM > 36-a.txt
+	git commit -m "Random change 36-$RANDOM" 36-a.txt
+	$h/git-timestamp.py --notify
+done
+# Terminating the daemon still timestamps pending requests
+kill $daemon
+wait $daemon
+
+after=`git rev-list --first-parent --count gitta-timestamps`
+if [ $after -ne `expr $before + 1` ]; then
+	echo "Assertion failed: Requests not coalesced into one timestamp" >&2
+	cat 36-daemon.txt >&2
+	exit 1
+fi
+if [ `git rev-parse gitta-timestamps^2` != `git rev-parse HEAD` ]; then
+	echo "Assertion failed: Newest commit not timestamped" >&2
+	exit 1
+fi
+if ! grep -q ' stamped .* main (3 requests)$' 36-daemon.txt; then
+	echo "Assertion failed: Unexpected daemon log" >&2
+	cat 36-daemon.txt >&2
+	exit 1
+fi
+
+# Outside of a repository (global `--socket`), without a usable global git
+# config to record the timestamper key in: a clean error per request
+outside=`mktemp -d`
+touch 36-nohome  # A file, so nothing can be created below it
+(cd "$outside" && HOME="$d/36-nohome" XDG_CONFIG_HOME="$d/36-nohome" \
+	XDG_CACHE_HOME="$d/36-cache" $h/git-timestamp.py --server=gitta \
+	--daemon --socket="$d/36-global.sock" --coalesce=1s \
+	> "$d/36-global.txt" 2> "$d/36-global-err.txt") &
+daemon=$!
+trap "kill $daemon 2> /dev/null || true; rm -rf '$outside'" EXIT
+while [ ! -S "$d/36-global.sock" ]; do
+	sleep 0.1
+done
+echo $RANDOM > 36-a.txt
+git commit -m "Random change 36-$RANDOM" 36-a.txt
+$h/git-timestamp.py --notify --socket="$d/36-global.sock"
+sleep 2
+kill $daemon
+wait $daemon || true
+if ! grep -q ' failed ' 36-global.txt \
+		|| ! grep -q 'Cannot use or create the global git config' 36-global-err.txt \
+		|| grep -q 'Traceback' 36-global-err.txt; then
+	echo "Assertion failed: No clean error outside of a repository" >&2
+	cat 36-global.txt 36-global-err.txt >&2
+	exit 1
+fi
@@ -0,0 +1,48 @@
+#!/bin/bash -e
+# Timestamping all branches of a push in a post-receive hook
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+rm -rf 37-server.git 37-client
+git init --bare --initial-branch main 37-server.git
+git -C 37-server.git config timestamp.server gitta
+cat > 37-server.git/hooks/post-receive << EOT
+#!/bin/sh
+exec $h/git-timestamp.py --stdin-refs
+EOT
+chmod +x 37-server.git/hooks/post-receive
+
+git init --initial-branch main 37-client
+cd 37-client
+echo $RANDOM > 37-a.txt
+git add 37-a.txt
+git commit -m "Random change 37-$RANDOM"
+git branch 37-one
+git branch 37-two
+git push ../37-server.git main 37-one 37-two 2> ../37-push.txt
+cd ..
+
+for b in gitta-timestamps gitta-timestamps-37-one gitta-timestamps-37-two; do
+	if ! git -C 37-server.git rev-parse -q --verify $b; then
+		echo "Assertion failed: Timestamp branch $b missing" >&2
+		cat 37-push.txt >&2
+		exit 1
+	fi
+done
+if ! grep -q '3 stamped, 0 already stamped, 0 failed' 37-push.txt; then
+	echo "Assertion failed: Unexpected push output" >&2
+	cat 37-push.txt >&2
+	exit 1
+fi
+
+# Deletions and tags are ignored
+if ! printf '%s %s refs/heads/37-gone\n%s %s refs/tags/37-tag\n' \
+		`git -C 37-client rev-parse HEAD` 0000000000000000000000000000000000000000 \
+		0000000000000000000000000000000000000000 `git -C 37-client rev-parse HEAD` |
+		(cd 37-server.git && $h/git-timestamp.py --stdin-refs); then
+	echo "Assertion failed: Ignored refs not ignored" >&2
+	exit 1
+fi
@@ -0,0 +1,43 @@
+#!/bin/bash -e
+# One timestamp for all branch heads
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+echo $RANDOM > 38-a.txt
+git add 38-a.txt
+git commit -m "Random change 38-$RANDOM"
+git branch -f 38-one
+git branch -f 38-two HEAD^ 2> /dev/null || git branch -f 38-two
+
+$h/git-timestamp.py --server=gitta --aggregate
+stamp=`git rev-parse gitta-aggregate-timestamps`
+git verify-commit $stamp
+for b in main 38-one 38-two; do
+	proof=refs/timestamp-proofs/gitta-aggregate-timestamps/heads/$b
+	if [ `git rev-parse $proof` != $stamp ]; then
+		echo "Assertion failed: Proof ref for $b missing" >&2
+		exit 1
+	fi
+	if [ "`git ls-tree $proof refs/heads/$b | cut -f1`" != "160000 commit `git rev-parse $b`" ]; then
+		echo "Assertion failed: Head of $b not in aggregate" >&2
+		git ls-tree -r $proof >&2
+		exit 1
+	fi
+done
+
+# Unchanged heads are not timestamped again
+$h/git-timestamp.py --server=gitta --aggregate
+if [ `git rev-parse gitta-aggregate-timestamps` != $stamp ]; then
+	echo "Assertion failed: Unchanged aggregate timestamped again" >&2
+	exit 1
+fi
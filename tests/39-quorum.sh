@@ -0,0 +1,31 @@
+#!/bin/bash -e
+# k-of-n quorum
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+echo $RANDOM > 39-a.txt
+git add 39-a.txt
+git commit -m "Random change 39-$RANDOM"
+
+# Nothing listens on port 9 (discard)
+if ! $h/git-timestamp.py --server=gitta,diversity,http://localhost:9 --retries=0 --quorum=2; then
+	echo "Assertion failed: Quorum of 2 not reached" >&2
+	exit 1
+fi
+
+echo $RANDOM > 39-a.txt
+git commit -m "Random change 39-$RANDOM" 39-a.txt
+if $h/git-timestamp.py --server=gitta,diversity,http://localhost:9 --retries=0 --quorum=3; then
+	echo "Assertion failed: Quorum of 3 reached with a dead server" >&2
+	exit 1
+fi
@@ -0,0 +1,40 @@
+#!/bin/bash -e
+# Server statistics and circuit breaker
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+export XDG_CACHE_HOME="$d/40-cache"
+rm -rf "$XDG_CACHE_HOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+# Nothing listens on port 9 (discard)
+for i in 1 2 3 4; do
+	echo $RANDOM > 40-a.txt
+	git add 40-a.txt
+	git commit -m "Random change 40-$RANDOM"
+	$h/git-timestamp.py --server=gitta,http://localhost:9 --retries=0 2> 40-err.txt || true
+done
+if ! grep -q '^http://localhost:9: Skipped after 3 failures in a row' 40-err.txt; then
+	echo "Assertion failed: Failing server not skipped" >&2
+	cat 40-err.txt >&2
+	exit 1
+fi
+$h/git-timestamp.py --server=gitta,http://localhost:9 --server-stats > 40-stats.txt
+if ! grep -q '^localhost-9 .* 3 .* open until ' 40-stats.txt; then
+	echo "Assertion failed: Unexpected server statistics" >&2
+	cat 40-stats.txt >&2
+	exit 1
+fi
+if ! grep -q '^gitta-zeitgitter-net .* closed$' 40-stats.txt; then
+	echo "Assertion failed: Unexpected server statistics" >&2
+	cat 40-stats.txt >&2
+	exit 1
+fi
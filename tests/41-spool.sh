@@ -0,0 +1,62 @@
+#!/bin/bash -e
+# Spooling stamps for unavailable servers
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+export XDG_CACHE_HOME="$d/41-cache"
+rm -rf "$XDG_CACHE_HOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+# Nothing listens on port 9 (discard)
+for i in 1 2; do
+	echo $RANDOM > 41-a.txt
+	git add 41-a.txt
+	git commit -m "Random change 41-$RANDOM"
+	git branch -f 41-spool
+	if $h/git-timestamp.py --server=http://localhost:9 --retries=0 41-spool 2> 41-err.txt; then
+		echo "Assertion failed: Timestamping to a dead server succeeded" >&2
+		exit 1
+	fi
+	if ! grep -q 'Spooled for `git timestamp --flush`' 41-err.txt; then
+		echo "Assertion failed: Request not spooled" >&2
+		cat 41-err.txt >&2
+		exit 1
+	fi
+done
+spooled=`git rev-parse --short=12 41-spool`
+
+# Only the newest commit per branch is kept; flushing to a dead server keeps it
+if $h/git-timestamp.py --flush --server-health=false --retries=0 > 41-flush.txt 2> 41-err.txt; then
+	echo "Assertion failed: Flushing to a dead server succeeded" >&2
+	exit 1
+fi
+if [ `grep -c ' localhost-9-timestamps-41-spool ' 41-flush.txt` -ne 1 ] \
+		|| ! grep -q "^failed .* localhost-9-timestamps-41-spool $spooled " 41-flush.txt; then
+	echo "Assertion failed: Spooled requests not coalesced" >&2
+	cat 41-flush.txt >&2
+	exit 1
+fi
+
+# With `--spool=false`, nothing new is spooled
+echo $RANDOM > 41-a.txt
+git commit -m "Random change 41-$RANDOM" 41-a.txt
+git branch -f 41-spool
+$h/git-timestamp.py --server=http://localhost:9 --retries=0 --spool=false 41-spool 2> 41-err.txt || true
+if grep -q 'Spooled' 41-err.txt; then
+	echo "Assertion failed: Request spooled despite --spool=false" >&2
+	exit 1
+fi
+$h/git-timestamp.py --flush --server-health=false --retries=0 > 41-flush.txt 2> /dev/null || true
+if ! grep -q "^failed .* localhost-9-timestamps-41-spool $spooled " 41-flush.txt; then
+	echo "Assertion failed: Spooled request changed" >&2
+	cat 41-flush.txt >&2
+	exit 1
+fi
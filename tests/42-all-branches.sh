@@ -0,0 +1,49 @@
+#!/bin/bash -e
+# Timestamping all local branches
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+echo $RANDOM > 42-a.txt
+git add 42-a.txt
+git commit -m "Random change 42-$RANDOM"
+for b in 42-one 42-two 42-skipped; do
+	git branch -f $b
+	echo $RANDOM > 42-a.txt
+	git commit -m "Random change 42-$RANDOM" 42-a.txt
+done
+
+$h/git-timestamp.py --server=gitta --all-branches --include-branches='42-*' \
+	--exclude-branches='*-skipped' > 42-out.txt
+for b in 42-one 42-two; do
+	if ! git rev-list --parents -n 1 gitta-timestamps-$b | grep -q " `git rev-parse $b`"; then
+		echo "Assertion failed: Branch $b not timestamped" >&2
+		exit 1
+	fi
+done
+if git rev-parse -q --verify gitta-timestamps-42-skipped > /dev/null \
+		|| grep -q -- '-timestamps' 42-out.txt; then
+	echo "Assertion failed: Excluded or timestamp branch timestamped" >&2
+	cat 42-out.txt >&2
+	exit 1
+fi
+
+# Heads already timestamped are not requested again
+git branch -f 42-two
+$h/git-timestamp.py --server=gitta --all-branches --include-branches='42-*' \
+	--exclude-branches='*-skipped' > 42-out.txt
+if ! grep -q '^already stamped .* 42-one$' 42-out.txt \
+		|| ! grep -q '^stamped .* 42-two$' 42-out.txt; then
+	echo "Assertion failed: Unexpected --all-branches result" >&2
+	cat 42-out.txt >&2
+	exit 1
+fi
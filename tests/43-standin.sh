@@ -0,0 +1,67 @@
+#!/bin/bash -e
+# Offline, against local stand-in servers with injected faults
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+export XDG_CACHE_HOME="$d/43-cache"
+rm -rf "$XDG_CACHE_HOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+. "$h/tests/standin.sh"
+
+stamp() {
+	echo $RANDOM > 43-a.txt
+	git add 43-a.txt
+	git commit -m "Random change 43-$RANDOM"
+	$h/git-timestamp.py --retries=0 --spool=false "$@"
+}
+
+start_standin
+good=$url
+start_standin --key-type ed25519 --chunked
+ed25519=$url
+if ! stamp --server=$good,$ed25519 --verifier=native; then
+	echo "Assertion failed: Timestamping against stand-ins failed" >&2
+	exit 1
+fi
+$h/git-timestamp.py --tag v43-$RANDOM --server=$ed25519
+$h/git-timestamp.py --verify --verifier=native
+
+# Each fault must be detected
+start_standin --skew 300
+if stamp --server=$url 2> 43-err.txt || ! grep -q 'falseticker' 43-err.txt; then
+	echo "Assertion failed: Clock skew not detected" >&2
+	exit 1
+fi
+start_standin --pad 10000
+if stamp --server=$url 2> 43-err.txt || ! grep -q 'too long' 43-err.txt; then
+	echo "Assertion failed: Oversized response not rejected" >&2
+	exit 1
+fi
+start_standin --pad 10000 --chunked
+if stamp --server=$url 2> 43-err.txt || ! grep -q 'too long' 43-err.txt; then
+	echo "Assertion failed: Oversized chunked response not rejected" >&2
+	exit 1
+fi
+start_standin --delay 3
+if stamp --server=$url --timeout=1s 2> 43-err.txt || ! grep -q 'Timeout' 43-err.txt; then
+	echo "Assertion failed: Slow server not timed out" >&2
+	exit 1
+fi
+start_standin --fail 1
+if stamp --server=$url 2> 43-err.txt || ! grep -q '503' 43-err.txt; then
+	echo "Assertion failed: Server error not reported" >&2
+	exit 1
+fi
+if ! stamp --server=$url; then
+	echo "Assertion failed: Stand-in did not recover" >&2
+	exit 1
+fi
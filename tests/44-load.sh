@@ -0,0 +1,34 @@
+#!/bin/bash -e
+# Load generator, against local stand-in servers
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+
+. "$h/tests/standin.sh"
+
+start_standin --delay 0.05
+if ! $h/git-timestamp.py --server=$url --load=4 --load-rate=10 \
+		--load-duration=2s > 44-load.txt; then
+	echo "Assertion failed: Load test against a healthy server failed" >&2
+	cat 44-load.txt >&2
+	exit 1
+fi
+if ! grep -q '^  ok  *[1-9]' 44-load.txt || ! grep -q '^  latency  *p50 ' 44-load.txt; then
+	echo "Assertion failed: Unexpected load report" >&2
+	cat 44-load.txt >&2
+	exit 1
+fi
+
+start_standin --skew 300
+if $h/git-timestamp.py --server=$url --load=2 --load-duration=1s > 44-load.txt; then
+	echo "Assertion failed: Load test with clock skew succeeded" >&2
+	exit 1
+fi
+if ! grep -q '^  clock skew  *[1-9]' 44-load.txt; then
+	echo "Assertion failed: Clock skew not reported" >&2
+	cat 44-load.txt >&2
+	exit 1
+fi
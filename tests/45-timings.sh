@@ -0,0 +1,70 @@
+#!/bin/bash -e
+# Phase timings and profiling, against a local stand-in server
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+. "$h/tests/standin.sh"
+start_standin
+
+stamp() {
+	echo $RANDOM > 45-a.txt
+	git add 45-a.txt
+	git commit -m "Random change 45-$RANDOM"
+	$h/git-timestamp.py --server=$url "$@"
+}
+
+# The trace lists each phase, per server and repository
+rm -f 45-trace.json
+stamp --timings=45-trace.json
+TIMESTAMP_TRACE=45-trace.json stamp
+if ! python3 - 45-trace.json "$PWD/.git/" << 'EOF'
+import json, sys
+runs = [json.loads(line) for line in open(sys.argv[1])]
+assert len(runs) == 2, runs
+for run in runs:
+    assert run['status'] == 0, run
+    phases = {p['phase']: p for p in run['phases']}
+    for name in ('config', 'gnupg', 'http', 'verify', 'write'):
+        assert name in phases, (name, run)
+    assert phases['http']['repository'] == sys.argv[2], run
+    assert phases['http']['server'].startswith('localhost'), run
+    assert sum(p['seconds'] for p in run['phases']) <= run['seconds'] * 1.01
+assert 'key' in {p['phase'] for p in runs[0]['phases']}, runs[0]
+EOF
+then
+	echo "Assertion failed: Unexpected timing trace" >&2
+	cat 45-trace.json >&2
+	exit 1
+fi
+
+# To stderr, also for failures
+if stamp --timings --retries=0 --spool=false \
+		--server=http://localhost:9 2> 45-stderr.txt; then
+	echo "Assertion failed: Stamping against a closed port succeeded" >&2
+	exit 1
+fi
+if ! grep -q '"status": 1.*"phase": "key".*"ok": false' 45-stderr.txt; then
+	echo "Assertion failed: Failed run not traced" >&2
+	cat 45-stderr.txt >&2
+	exit 1
+fi
+
+# Profile, including the worker threads
+rm -f 45-profile.out
+stamp --profile=45-profile.out
+python3 -c 'import pstats; pstats.Stats("45-profile.out").print_stats()' \
+	> 45-profile.txt
+if ! grep -q 'timestamp_branch' 45-profile.txt; then
+	echo "Assertion failed: Profile misses timestamp_branch()" >&2
+	exit 1
+fi
@@ -0,0 +1,71 @@
+#!/bin/bash -e
+# Prometheus textfile metrics, against local stand-in servers
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+. "$h/tests/standin.sh"
+
+stamp() {
+	echo $RANDOM > 46-a.txt
+	git add 46-a.txt
+	git commit -m "Random change 46-$RANDOM"
+	$h/git-timestamp.py --retries=0 --spool=false --metrics=46-metrics.prom "$@"
+}
+
+start_standin
+good=`echo $url | sed 's,http://localhost:,localhost-,'`
+goodurl=$url
+start_standin --fail 1
+bad=`echo $url | sed 's,http://localhost:,localhost-,'`
+badurl=$url
+start_standin --skew 300
+skewed=`echo $url | sed 's,http://localhost:,localhost-,'`
+skewedurl=$url
+
+rm -f 46-metrics.prom
+if stamp --server=$goodurl,$badurl; then
+	echo "Assertion failed: Injected failure not reported" >&2
+	exit 1
+fi
+stamp --server=$goodurl,$badurl
+TIMESTAMP_METRICS=46-metrics.prom $h/git-timestamp.py --server=$goodurl \
+	|| true
+if stamp --server=$skewedurl; then
+	echo "Assertion failed: Clock skew not reported" >&2
+	exit 1
+fi
+
+expect() {
+	if ! grep -qxF "$1" 46-metrics.prom; then
+		echo "Assertion failed: Missing $1" >&2
+		cat 46-metrics.prom >&2
+		exit 1
+	fi
+}
+expect "git_timestamp_stamps_total{server=\"$good\"} 2"
+expect "git_timestamp_stamps_total{server=\"$bad\"} 1"
+expect "git_timestamp_failures_total{reason=\"http_503\",server=\"$bad\"} 1"
+expect "git_timestamp_failures_total{reason=\"already_timestamped\",server=\"$good\"} 1"
+expect "git_timestamp_request_duration_seconds_count{server=\"$good\"} 2"
+expect "git_timestamp_failures_total{reason=\"falseticker\",server=\"$skewed\"} 1"
+if grep -q "request_duration_seconds.*server=\"$skewed\"" 46-metrics.prom; then
+	echo "Assertion failed: Invalid timestamp counted as served" >&2
+	exit 1
+fi
+expect "git_timestamp_request_duration_seconds_bucket{le=\"+Inf\",server=\"$bad\"} 1"
+expect "git_timestamp_last_run_exit_status 1"
+expect "# TYPE git_timestamp_request_duration_seconds histogram"
+if ! grep -q "^git_timestamp_last_success_timestamp_seconds{server=\"$bad\"} 1[0-9]*" 46-metrics.prom; then
+	echo "Assertion failed: Last success time missing" >&2
+	exit 1
+fi
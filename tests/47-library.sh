@@ -0,0 +1,116 @@
+#!/bin/bash -e
+# Library use (`git_timestamp.Stamper`), against local stand-in servers
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+. "$h/tests/standin.sh"
+
+start_standin
+good=$url
+start_standin --fail 100
+bad=$url
+
+echo $RANDOM > 47-a.txt
+git add 47-a.txt
+git commit -m "Random change 47-$RANDOM"
+head=`git rev-parse HEAD`
+if ! PYTHONPATH="$h" python3 - "$PWD" $good $bad << 'EOF'
+import sys
+from git_timestamp import (AlreadyTimestamped, ServerUnavailable, Stamper,
+                           TimestampError)
+(path, good, bad) = sys.argv[1:]
+stamper = Stamper(path, server=good, retries=0, spool=False)
+(stamp,) = stamper.stamp_branch()
+assert stamp.ref.startswith('refs/heads/localhost-'), stamp
+assert stamp.commit == str(stamper.repository.head.target), stamp
+assert str(stamper.repository.lookup_reference(stamp.ref).target) \
+    == stamp.stamp, stamp
+try:
+    stamper.stamp_branch()
+    assert False, "Second timestamp accepted"
+except AlreadyTimestamped:
+    pass
+stamp = stamper.stamp_tag('library-tag')
+assert stamp.ref == 'refs/tags/library-tag', stamp
+try:
+    stamper.stamp_tag('library-tag')
+    assert False, "Tag reused"
+except TimestampError as e:
+    assert 'already in use' in str(e), e
+try:
+    stamper.stamp_branch(server=bad)
+    assert False, "Failure not raised"
+except ServerUnavailable as e:
+    assert e.status == 503, e.status
+# Boolean options, also for flags which take no value
+assert Stamper(path, server=good, full=True, require_enable=False,
+               quiet=True).args.full
+try:
+    Stamper(path, server=good, require_enable=True)
+    assert False, "--require-enable ignored"
+except TimestampError as e:
+    assert 'not explicitely enabled' in str(e), e
+# Library callers can catch `Exception`
+try:
+    Stamper(path + '/nonexistent/..', bogus_option=1)
+    assert False, "Bogus option accepted"
+except Exception as e:
+    assert isinstance(e, TimestampError), e
+EOF
+then
+	echo "Assertion failed: Library use" >&2
+	exit 1
+fi
+if [ "`git rev-parse refs/tags/library-tag^{commit}`" != "$head" ]; then
+	echo "Assertion failed: Tag does not point to the commit" >&2
+	exit 1
+fi
+
+# Independent `Stamper`s with separate keyrings, used concurrently
+rm -rf 47-second 47-gnupg
+mkdir -m 700 47-gnupg
+git init -q --initial-branch main 47-second
+echo $RANDOM > 47-second/47-a.txt
+git -C 47-second add 47-a.txt
+git -C 47-second commit -q -m "Random change 47-$RANDOM"
+echo $RANDOM > 47-a.txt
+git commit -q -m "Random change 47-$RANDOM" 47-a.txt
+if ! PYTHONPATH="$h" python3 - "$PWD" "$PWD/47-second" "$PWD/47-gnupg" $good \
+		<< 'EOF'
+import sys, threading
+from git_timestamp import Stamper
+(path, second, home, good) = sys.argv[1:]
+stampers = [Stamper(path, server=good, retries=0, spool=False),
+            Stamper(second, server=good, retries=0, spool=False,
+                    gnupg_home=home)]
+results = [None, None]
+
+def stamp(i):
+    try:
+        results[i] = stampers[i].stamp_branch()
+    except Exception as e:
+        results[i] = e
+
+threads = [threading.Thread(target=stamp, args=(i,)) for i in (0, 1)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+for (stamper, result) in zip(stampers, results):
+    assert isinstance(result, list), result
+    assert result[0].commit == str(stamper.repository.head.target), result
+EOF
+then
+	echo "Assertion failed: Independent Stampers" >&2
+	exit 1
+fi
@@ -0,0 +1,101 @@
+#!/bin/bash -e
+# Shared request rate limit and `Retry-After`, against local stand-in servers
+h="$PWD"
+d=$1
+shift
+cd "$d"
+export GNUPGHOME="$d/gnupg"
+mkdir -p -m 700 "$GNUPGHOME"
+export XDG_CACHE_HOME="$d/48-cache"
+rm -rf "$XDG_CACHE_HOME"
+git init --initial-branch main
+git config init.defaultBranch main
+
+# Clean config
+git config --unset timestamp.branch || true
+git config --unset timestamp.server || true
+
+. "$h/tests/standin.sh"
+
+commit() {
+	echo $RANDOM > 48-a.txt
+	git add 48-a.txt
+	git commit -m "Random change 48-$RANDOM"
+}
+
+now() {
+	date +%s.%N
+}
+
+# 429 with `Retry-After` is retried after that time
+start_standin --fail 1 --fail-status 429 --retry-after 2
+commit
+start=`now`
+if ! $h/git-timestamp.py --server=$url --retries=1 --spool=false; then
+	echo "Assertion failed: 429 with Retry-After not retried" >&2
+	exit 1
+fi
+if ! python3 -c "import sys; sys.exit(not $(now) - $start >= 2)"; then
+	echo "Assertion failed: Retry-After not honored" >&2
+	exit 1
+fi
+
+# Also under `--load`, which bypasses the rate limiter
+start_standin --fail 1 --fail-status 429 --retry-after 2
+start=`now`
+if ! $h/git-timestamp.py --server=$url --retries=1 --load=1 --load-rate=1 \
+		--load-duration=1s > 48-load.txt \
+		|| ! grep -q '^  ok  *1$' 48-load.txt; then
+	echo "Assertion failed: 429 with Retry-After not retried under --load" >&2
+	cat 48-load.txt >&2
+	exit 1
+fi
+if ! python3 -c "import sys; sys.exit(not $(now) - $start >= 2)"; then
+	echo "Assertion failed: Retry-After not honored under --load" >&2
+	exit 1
+fi
+
+# Too long `Retry-After`s fail, also for the next process
+start_standin --fail 1 --retry-after 3600
+commit
+if $h/git-timestamp.py --server=$url --retries=2 --spool=false \
+		2> 48-stderr.txt; then
+	echo "Assertion failed: Long Retry-After waited for" >&2
+	exit 1
+fi
+if ! grep -q 'Retry-After: 3600' 48-stderr.txt; then
+	echo "Assertion failed: Retry-After not reported" >&2
+	cat 48-stderr.txt >&2
+	exit 1
+fi
+if $h/git-timestamp.py --server=$url --spool=false 2> 48-stderr.txt \
+		|| ! grep -q 'asked to retry after' 48-stderr.txt; then
+	echo "Assertion failed: Retry-After not shared with the next process" >&2
+	cat 48-stderr.txt >&2
+	exit 1
+fi
+
+# Concurrent processes share `--rate`
+start_standin
+commit
+$h/git-timestamp.py --server=$url --rate=0.5
+for i in 1 2 3; do
+	rm -rf 48-clone-$i
+	git clone -q . 48-clone-$i
+done
+start=`now`
+cpids=""
+for i in 1 2 3; do
+	(cd 48-clone-$i && $h/git-timestamp.py --server=$url --rate=0.5) &
+	cpids="$cpids $!"
+done
+for p in $cpids; do
+	if ! wait $p; then
+		echo "Assertion failed: Rate-limited timestamp failed" >&2
+		exit 1
+	fi
+done
+if ! python3 -c "import sys; sys.exit(not $(now) - $start >= 3.9)"; then
+	echo "Assertion failed: --rate not shared by processes" >&2
+	exit 1
+fi
@@ -0,0 +1,25 @@
+# Local stand-in servers for the tests (sourced, not run on its own):
+# `start_standin [OPTION...]` starts tests/zeitgitter-standin.py with the
+# given options and sets $url; all stand-ins are stopped on exit
+pids=""
+trap 'kill $pids 2> /dev/null || true' EXIT
+start_standin() {
+	rm -f standin-port.txt
+	$h/tests/zeitgitter-standin.py --port-file standin-port.txt "$@" > /dev/null &
+	pid=$!
+	pids="$pids $pid"
+	tries=100
+	while [ ! -s standin-port.txt ]; do
+		if ! kill -0 $pid 2> /dev/null; then
+			echo "Stand-in server failed to start" >&2
+			exit 1
+		fi
+		tries=$((tries - 1))
+		if [ $tries -le 0 ]; then
+			echo "Stand-in server did not start within 10s" >&2
+			exit 1
+		fi
+		sleep 0.1
+	done
+	url=http://localhost:`cat standin-port.txt`
+}
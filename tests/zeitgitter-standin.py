@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+#
+# zeitgitter-standin — Local stand-in for a Zeitgitter timestamping server
+#
+# Implements `get-public-key-v1`, `stamp-tag-v1` and `stamp-branch-v1`
+# (see `doc/Protocol.md`), signing with a throwaway GnuPG key, for offline
+# tests and benchmarks. Faults can be injected: latency, errors, clock skew
+# and oversized responses.
+#
+# Usage: tests/zeitgitter-standin.py [--port 0] [--port-file FILE] ...
+#
+# With `--port 0` (the default), a free port is chosen; it is printed
+# and, with `--port-file`, written to FILE once the server is ready.
+
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gnupg
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for a Zeitgitter timestamping server")
+    parser.add_argument('--port', type=int, default=0,
+                        help="TCP port on localhost (default: any free one)")
+    parser.add_argument('--port-file', metavar='FILE',
+                        help="Write the port to FILE when ready to serve")
+    parser.add_argument('--name',
+                        default='Stand-in Stamper <standin@localhost>',
+                        help="Timestamper name and email")
+    parser.add_argument('--key-type', choices=('rsa', 'ed25519'),
+                        default='rsa',
+                        help="Type of the throwaway signing key")
+    parser.add_argument('--delay', type=float, default=0,
+                        help="Seconds to wait before answering a stamp request")
+    parser.add_argument('--fail', type=int, default=0, metavar='N',
+                        help="Answer the first N stamp requests with an error")
+    parser.add_argument('--fail-status', type=int, default=503,
+                        metavar='STATUS',
+                        help="HTTP status for `--fail` (default: 503)")
+    parser.add_argument('--retry-after', metavar='SECONDS',
+                        help="`Retry-After` header for `--fail`")
+    parser.add_argument('--skew', type=int, default=0, metavar='SECONDS',
+                        help="Offset of the timestamps (and signature times)"
+                        " from the real time")
+    parser.add_argument('--pad', type=int, default=0, metavar='BYTES',
+                        help="Add BYTES to each timestamp message, e.g., to"
+                        " exceed the client's size limit")
+    parser.add_argument('--chunked', action='store_true',
+                        help="Send responses without `Content-Length`")
+    return parser.parse_args()
+
+
+class Signer:
+    """Throwaway GnuPG key in a temporary home directory"""
+
+    def __init__(self, name, key_type, skew):
+        self.home = tempfile.mkdtemp(prefix='zeitgitter-standin-')
+        self.gpg = gnupg.GPG(gnupghome=self.home)
+        (real, _, email) = name.partition(' <')
+        params = {'name_real': real, 'name_email': email.rstrip('>'),
+                  'no_protection': True}
+        if key_type == 'ed25519':
+            params.update(key_type='EDDSA', key_curve='ed25519')
+        else:
+            params.update(key_type='RSA', key_length=2048)
+        key = self.gpg.gen_key(self.gpg.gen_key_input(**params))
+        if not key.fingerprint:
+            sys.exit("Cannot create signing key: %s" % key.stderr)
+        self.fingerprint = key.fingerprint
+        self.public = self.gpg.export_keys(self.fingerprint)
+        if skew != 0:
+            # Only the signatures, the key itself must not be from the future
+            self.gpg = gnupg.GPG(gnupghome=self.home, options=[
+                '--faked-system-time', str(int(time.time()) + skew)])
+        self.lock = threading.Lock()
+
+    def sign(self, data):
+        """Armored detached signature for `data`"""
+        with self.lock:
+            return str(self.gpg.sign(data, keyid=self.fingerprint,
+                                     detach=True))
+
+    def close(self):
+        subprocess.run(['gpgconf', '--homedir', self.home, '--kill', 'all'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.home, ignore_errors=True)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'zeitgitter-standin'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, content_type='text/plain', headers={}):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        if self.server.args.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for pos in range(0, len(data), 1024):
+                chunk = data[pos:pos + 1024]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        if query.get('request') == ['get-public-key-v1']:
+            self.reply(200, self.server.signer.public,
+                       'application/pgp-keys')
+        else:
+            self.reply(400, "Unknown request\n")
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for (k, v) in urllib.parse.parse_qs(
+            self.rfile.read(length).decode('utf-8')).items()}
+        args = self.server.args
+        time.sleep(args.delay)
+        with self.server.lock:
+            fail = self.server.failures_left > 0
+            if fail:
+                self.server.failures_left -= 1
+        if fail:
+            return self.reply(args.fail_status, "Injected failure\n",
+                              headers={'Retry-After': args.retry_after}
+                              if args.retry_after else {})
+        try:
+            if form.get('request') == 'stamp-tag-v1':
+                self.reply(200, self.stamp_tag(form['commit'],
+                                               form['tagname']))
+            elif form.get('request') == 'stamp-branch-v1':
+                self.reply(200, self.stamp_branch(form['commit'],
+                                                  form.get('parent'),
+                                                  form['tree']))
+            else:
+                self.reply(400, "Unknown request\n")
+        except KeyError as e:
+            self.reply(400, "Missing parameter %s\n" % e)
+
+    def message(self):
+        return "\n:watch: Stand-in timestamp\n" + 'x' * self.server.args.pad
+
+    def now(self):
+        return int(time.time()) + self.server.args.skew
+
+    def stamp_tag(self, commit, tagname):
+        name = self.server.args.name
+        tag = ("object %s\ntype commit\ntag %s\ntagger %s %d +0000\n%s"
+               % (commit, tagname, name, self.now(), self.message()))
+        return tag + self.server.signer.sign(tag)
+
+    def stamp_branch(self, commit, parent, tree):
+        name = self.server.args.name
+        now = self.now()
+        head = "tree %s\n" % tree
+        if parent:
+            head += "parent %s\n" % parent
+        head += ("parent %s\nauthor %s %d +0000\ncommitter %s %d +0000\n"
+                 % (commit, name, now, name, now))
+        message = self.message()
+        signature = self.server.signer.sign(head + message)
+        return (head + "gpgsig " + signature.rstrip('\n').replace('\n', '\n ')
+                + "\n" + message)
+
+
+def main():
+    args = get_args()
+    signer = Signer(args.name, args.key_type, args.skew)
+    try:
+        server = ThreadingHTTPServer(('localhost', args.port), StandinHandler)
+        server.daemon_threads = True
+        server.args = args
+        server.signer = signer
+        server.lock = threading.Lock()
+        server.failures_left = args.fail
+        port = server.server_address[1]
+        if args.port_file:
+            with open(args.port_file + '.tmp', 'w') as f:
+                f.write("%d\n" % port)
+            os.rename(args.port_file + '.tmp', args.port_file)
+        print("Serving on http://localhost:%d/" % port, flush=True)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signer.close()
+
+
+if __name__ == '__main__':
+    main()